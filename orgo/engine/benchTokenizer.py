@@ -0,0 +1,83 @@
+"""
+benchTokenizer.py
+Times toMolecule.tokenize against the lexing it replaced: seven regex
+passes over the string to mark bonds that precede atoms (the old
+toMolecule.preprocess), then rply's regex lexer. Both have to produce the
+same tokens before anything is timed.
+
+Run from this directory:
+    python benchTokenizer.py [repetitions]
+"""
+
+import re
+import sys
+import time
+
+from rply import LexerGenerator
+
+from toMolecule import tokenize, SYMBOLS, LETTERS, BOND_SYMBOLS, \
+                       BOND_SYMBOLS_TILDE, ATOM_MATCHER
+
+SAMPLES = [
+    'CCC=CCC', 'CC(CBr)=C(CCl)CO', 'C=C1CCCCC1', 'C1CC=CCC1', 'C=CCCO',
+    'CC#CC(C)C', 'OC(=O)CC(N)C', 'c1ccc2CCCc2c1', 'C1=CC=CC=C1',
+    'N[C@@H](C)C(=O)O', 'F/C=C/F', 'C/C=C\\C', '[13CH3][O-]', '[NH4+].[Cl-]',
+    'C%10CCCCC%10', 'O=C=O', 'C[Se]C', '[2H]C([2H])([2H])[2H]', 'CC(=O)Cl',
+    'C' * 200, 'C(C(C(C(C(C(C(C)C)C)C)C)C)C)C' * 4,
+]
+
+
+def legacyLexer():
+    "return :: Lexer. The rply lexer toMolecule used to build."
+    lg = LexerGenerator()
+    lg.ignore(r"\s+")
+    for name in SYMBOLS:
+        lg.add(name, re.escape(name))
+    for name in LETTERS:
+        lg.add(name, name)
+    for char, name in BOND_SYMBOLS.iteritems():
+        lg.add(name, re.escape(char))
+    for char, name in BOND_SYMBOLS_TILDE.iteritems():
+        lg.add(name, re.escape('~%s~' % char))
+    lg.add('DIGIT', r'[0-9]')
+    lg.add('TERMINATOR', r'[ \t\r\n]')
+    return lg.build()
+
+LEGACY_LEXER = legacyLexer()
+
+
+def legacyTokens(smiles):
+    "The old preprocess, then the old lexer."
+    for char in BOND_SYMBOLS:
+        smiles = re.sub(re.escape(char) + r'(?=[\[' + ATOM_MATCHER + r'])',
+                        lambda match: '~%s~' % match.group(), smiles)
+    return LEGACY_LEXER.lex(smiles)
+
+
+def names(tokens):
+    return [token.gettokentype() for token in tokens]
+
+
+def timeIt(lex, repetitions):
+    "return :: float. Tokens per second."
+    count = 0
+    start = time.time()
+    for _ in xrange(repetitions):
+        for smiles in SAMPLES:
+            for _ in lex(smiles):
+                count += 1
+    return count / (time.time() - start)
+
+
+def main(repetitions):
+    for smiles in SAMPLES:
+        assert names(tokenize(smiles)) == names(legacyTokens(smiles)), smiles
+    old = timeIt(legacyTokens, repetitions)
+    new = timeIt(tokenize, repetitions)
+    print "preprocess + rply lexer: %10.0f tokens/s" % old
+    print "tokenize:                %10.0f tokens/s" % new
+    print "speedup:                 %10.1fx" % (new / old)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,46 @@
+"""
+buildParseTable.py
+Writes the SMILES parser's LALR tables for toMolecule to load, in place of
+the tables for any older grammar. toMolecule never writes them itself; run
+this after changing the grammar, and commit the result.
+
+Run from this directory:
+    python buildParseTable.py [directory]
+The directory defaults to toMolecule.PARSE_TABLE_DIR.
+"""
+
+import glob
+import json
+import os
+import sys
+
+import toMolecule
+
+
+def save(directory):
+    """
+    Builds the tables for the current grammar and writes them to directory,
+    removing the tables of other grammars there.
+    directory :: str.
+    return :: str. The path written.
+    """
+    grammar = toMolecule._grammar()
+    table = toMolecule._buildTable(grammar)
+    name = os.path.basename(toMolecule._tablePath(grammar))
+    path = os.path.join(directory, name)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for old in glob.glob(os.path.join(directory, "molparser-*.json")):
+        if old != path:
+            os.remove(old)
+    with open(path, 'w') as f:
+        json.dump(toMolecule.PG.serialize_table(table), f, sort_keys=True)
+    return path
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        directory = sys.argv[1]
+    else:
+        directory = toMolecule.PARSE_TABLE_DIR
+    print save(directory)
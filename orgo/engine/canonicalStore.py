@@ -0,0 +1,115 @@
+"""
+canonicalStore.py
+A table of canonical SMILES kept in a SQLite file on local disk, so that
+every worker process on a host shares, and keeps across restarts, the
+canonical forms any of them has worked out.
+
+Reads go straight to the file; SQLite's write-ahead log lets any number of
+processes read while one writes. Writes are buffered and flushed in one
+transaction every FLUSH_SIZE entries or FLUSH_INTERVAL seconds, and whenever
+flush() is called (toCanonical flushes its store at exit). A store that
+can't be opened, read or written behaves as if it were empty: it only ever
+saves work.
+
+Public-facing:
+    `CanonicalStore`
+"""
+
+import sqlite3
+import threading
+import time
+
+FLUSH_SIZE = 256 # buffered entries
+FLUSH_INTERVAL = 30 # seconds
+TIMEOUT = 5 # seconds to wait for another process's write lock
+
+_BATCH = 500 # SQLite allows at most 999 parameters per statement
+
+
+class CanonicalStore(object):
+    """
+    A persistent map from SMILES to canonical SMILES. Safe to share between
+    threads, and between processes using the same path.
+        self.path :: str. The SQLite file.
+        self.table :: str. The table in it; one per canonicalizer, since
+            each writes its own canonical forms.
+    """
+
+    def __init__(self, path, table="canonical"):
+        self.path = path
+        self.table = table
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._lastFlush = time.time()
+        try:
+            self._connection().execute(
+                "CREATE TABLE IF NOT EXISTS %s ("
+                "smiles TEXT PRIMARY KEY, canonical TEXT NOT NULL)"
+                % self.table)
+        except sqlite3.Error:
+            pass # e.g. a directory that doesn't exist: nothing gets stored
+
+    def getMany(self, smileses):
+        """
+        smileses :: [str].
+        return :: {str: str}. The canonical form of each of smileses the
+            store knows, whether flushed or not.
+        """
+        with self._lock:
+            output = dict((smiles, self._pending[smiles])
+                          for smiles in smileses if smiles in self._pending)
+        rest = [smiles for smiles in set(smileses) if smiles not in output]
+        try:
+            connection = self._connection()
+            for i in xrange(0, len(rest), _BATCH):
+                chunk = rest[i:i + _BATCH]
+                output.update(connection.execute(
+                    "SELECT smiles, canonical FROM %s WHERE smiles IN (%s)"
+                    % (self.table, ",".join("?" * len(chunk))), chunk))
+        except sqlite3.Error:
+            pass
+        return output
+
+    def putMany(self, pairs):
+        """
+        Buffers canonical forms for writing, flushing if the buffer is due.
+        pairs :: iterable of (str, str). (smiles, canonical smiles).
+        """
+        with self._lock:
+            self._pending.update(pairs)
+            due = (len(self._pending) >= FLUSH_SIZE or
+                   time.time() - self._lastFlush >= FLUSH_INTERVAL)
+        if due:
+            self.flush()
+
+    def flush(self):
+        "Writes everything buffered so far to disk, in one transaction."
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._lastFlush = time.time()
+        if not pending:
+            return
+        try:
+            with self._connection() as connection:
+                connection.executemany(
+                    "INSERT OR IGNORE INTO %s (smiles, canonical) "
+                    "VALUES (?, ?)" % self.table, pending.iteritems())
+        except sqlite3.Error:
+            pass # another worker will get round to it
+
+    def _connection(self):
+        """
+        return :: sqlite3.Connection. This thread's, since SQLite connections
+            can't be shared between threads.
+        """
+        try:
+            return self._local.connection
+        except AttributeError:
+            connection = sqlite3.connect(self.path, timeout=TIMEOUT)
+            connection.text_factory = str
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            return connection
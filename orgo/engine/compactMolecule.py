@@ -0,0 +1,360 @@
+"""
+compactMolecule.py
+Contains class CompactMolecule, an array-backed form of a Molecule for bulk
+work (deduplication, fingerprinting, generating corpora), and compactify,
+which builds one from a Molecule.
+
+Atoms are numbered 0..n-1. Per-atom properties live in typed arrays, bonds
+are stored as CSR adjacency (the neighbors of atom i are
+targets[offsets[i]:offsets[i+1]], with matching bond orders), and the few
+atoms with stereochemistry are listed in side arrays. Converting either way
+takes time linear in the number of atoms and bonds.
+
+The functional-group finders, elementCounts and the canonical SMILES
+writer (toSmiles) work on the arrays directly. makeCompareDict compares
+element counts on the arrays, and only expands CompactMolecules with
+toMolecule to match up their atoms.
+"""
+
+from array import array
+
+from molecularStructure import Molecule, Atom, _Stereo, INTERNAL_FIELDS
+
+# Element codes are atomic numbers, with 0 for the wildcard '*'. The table
+# is fixed, so codes mean the same thing in every process. Symbols outside
+# it (e.g. lowercase aromatic symbols) are kept by each CompactMolecule in
+# its otherElements list, and get codes past the end of the table.
+ELEMENTS = tuple('* H He Li Be B C N O F Ne Na Mg Al Si P S Cl Ar K Ca Sc Ti V Cr '
+            'Mn Fe Co Ni Cu Zn Ga Ge As Se Br Kr Rb Sr Y Zr Nb Mo Tc Ru Rh Pd '
+            'Ag Cd In Sn Sb Te I Xe Cs Ba La Ce Pr Nd Pm Sm Eu Gd Tb Dy Ho Er '
+            'Tm Yb Lu Hf Ta W Re Os Ir Pt Au Hg Tl Pb Bi Po At Rn Fr Ra Ac Th '
+            'Pa U Np Pu Am Cm Bk Cf Es Fm Md No Lr Rf Db Sg Bh Hs Mt Ds Rg Cn '
+            'Nh Fl Mc Lv Ts Og'.split())
+ELEMENT_CODES = dict((symbol, code) for code, symbol in enumerate(ELEMENTS))
+
+HYDROGEN_CODE = ELEMENT_CODES['H']
+CARBON_CODE = ELEMENT_CODES['C']
+OXYGEN_CODE = ELEMENT_CODES['O']
+
+# Flags in CompactMolecule.stereoFlags.
+IS_CHIRAL = 1
+IS_CISTRANS = 2
+
+NONE = -1 # stands in for None in the integer arrays
+
+
+def compactify(molecule):
+    """
+    Converts a Molecule to a CompactMolecule, in linear time.
+    Atom i of the output is molecule.atoms[i]. Atoms that are bonded to the
+    molecule without being listed in molecule.atoms are numbered after them.
+
+    molecule :: Molecule.
+    return :: CompactMolecule.
+    """
+    output = CompactMolecule()
+    atoms = list(molecule.atoms)
+    output.size = len(atoms)
+    index = {}
+    for i, atom in enumerate(atoms):
+        index[atom] = i
+
+    i = 0
+    while i < len(atoms):
+        atom = atoms[i]
+        output.elements.append(output.elementCode(atom.element))
+        output.charges.append(atom.charge or 0)
+        output.implicitH.append(atom.implicit_h)
+        output.hcounts.append(NONE if atom.hcount is None else atom.hcount)
+        output.isotopes.append(NONE if atom.isotope is None else atom.isotope)
+        output.aromatic.append(1 if atom.is_aromatic else 0)
+        for neighbor, bondOrder in atom.neighbors.iteritems():
+            if neighbor not in index:
+                index[neighbor] = len(atoms)
+                atoms.append(neighbor)
+            output.targets.append(index[neighbor])
+            output.orders.append(bondOrder)
+        output.offsets.append(len(output.targets))
+        if atom.tags:
+            output.tags[i] = dict(atom.tags)
+        i += 1
+
+    def ref(atom):
+        if atom is None:
+            return NONE
+        if atom not in index:
+            ## Stereo reference to an atom that isn't bonded anywhere.
+            ## Nothing sensible to point at.
+            return NONE
+        return index[atom]
+
+    for i, atom in enumerate(atoms):
+        stereo = atom._stereo
+        if stereo is None:
+            continue
+        output.stereoAtoms.append(i)
+        output.stereoFlags.append((IS_CHIRAL if stereo.is_chiral else 0) |
+                                  (IS_CISTRANS if stereo.is_cistrans else 0))
+        output.stereoRefs.extend((
+            ref(stereo.chiralA), ref(stereo.chiralB), ref(stereo.chiralC),
+            ref(stereo.chiralD), ref(stereo.CTotherC), ref(stereo.CTa),
+            ref(stereo.CTb)))
+
+    for key, value in molecule.__dict__.iteritems():
+        if key not in INTERNAL_FIELDS:
+            output.moleculeTags[key] = value
+    return output
+
+
+class CompactMolecule(object):
+    """
+    Array-backed molecule. See the module docstring.
+        self.size :: int. Number of atoms that belong to the molecule;
+            atoms numbered from size up are only bonded to it.
+        self.elements :: array of element codes (see ELEMENTS).
+        self.otherElements :: [str]. Symbols that aren't in ELEMENTS;
+            code len(ELEMENTS) + k is otherElements[k].
+        self.charges, self.implicitH, self.aromatic :: arrays, per atom.
+        self.hcounts, self.isotopes :: arrays, per atom. NONE for None.
+        self.offsets, self.targets, self.orders :: CSR bonds.
+        self.stereoAtoms :: array of atoms with stereochemistry.
+        self.stereoFlags :: array of IS_CHIRAL | IS_CISTRANS, per entry.
+        self.stereoRefs :: array, 7 per entry: chiralA, chiralB, chiralC,
+            chiralD, CTotherC, CTa, CTb. NONE for None.
+        self.tags :: {int: {str: object}}. Atom tags, for the atoms that
+            have any.
+        self.moleculeTags :: {str: object}. Molecule-level attributes,
+            e.g. implicitHydrogens.
+
+    The parse-time Atom.chirality record is not kept.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.elements = array('H')
+        self.otherElements = []
+        self.charges = array('b')
+        self.implicitH = array('B')
+        self.hcounts = array('b')
+        self.isotopes = array('h')
+        self.aromatic = array('B')
+        self.offsets = array('i', [0])
+        self.targets = array('i')
+        self.orders = array('f')
+        self.stereoAtoms = array('i')
+        self.stereoFlags = array('B')
+        self.stereoRefs = array('i')
+        self.tags = {}
+        self.moleculeTags = {}
+
+    def __len__(self):
+        return self.size
+
+    def element(self, i):
+        "return :: str. Element of atom i."
+        return self.symbol(self.elements[i])
+
+    def symbol(self, code):
+        "return :: str. The element with this code in self.elements."
+        if code < len(ELEMENTS):
+            return ELEMENTS[code]
+        return self.otherElements[code - len(ELEMENTS)]
+
+    def elementCounts(self):
+        """
+        Counts atoms by element, implicit hydrogens included as 'H', as
+        Molecule.elementCounts does, straight from the element codes.
+        return :: {str: int}. Elements with no atoms are left out.
+        """
+        codes = {}
+        for code in self.elements[:self.size]:
+            codes[code] = codes.get(code, 0) + 1
+        output = {}
+        for code, count in codes.iteritems():
+            output[self.symbol(code)] = count
+        hydrogens = sum(self.implicitH[:self.size])
+        if hydrogens:
+            output['H'] = output.get('H', 0) + hydrogens
+        return output
+
+    def elementCode(self, symbol):
+        """
+        symbol :: str. An Atom's element.
+        return :: int. The code for that element in self.elements. Symbols
+            that aren't in ELEMENTS are added to self.otherElements.
+        """
+        try:
+            return ELEMENT_CODES[symbol]
+        except KeyError:
+            pass
+        if symbol not in self.otherElements:
+            self.otherElements.append(symbol)
+        return len(ELEMENTS) + self.otherElements.index(symbol)
+
+    def neighbors(self, i):
+        """
+        return :: [(int, int)]. (neighbor, bond order) for each bond of atom i.
+        """
+        start, end = self.offsets[i], self.offsets[i+1]
+        return [(self.targets[k], bondOrder(self.orders[k]))
+                for k in xrange(start, end)]
+
+    def degree(self, i):
+        "return :: int. Number of atoms bonded to atom i."
+        return self.offsets[i+1] - self.offsets[i]
+
+    def neighborCount(self, i):
+        "return :: int. Like Atom.neighborCount: implicit hydrogens count."
+        return self.offsets[i+1] - self.offsets[i] + self.implicitH[i]
+
+    def bondOrder(self, i, j):
+        "return :: int, float or None. Order of the bond i-j, if any."
+        for k in xrange(self.offsets[i], self.offsets[i+1]):
+            if self.targets[k] == j:
+                return bondOrder(self.orders[k])
+        return None
+
+    def toMolecule(self):
+        """
+        Converts back to a Molecule, in linear time.
+        return :: (Molecule, [Atom]). The Atom list is indexed like this
+            compact molecule, outside atoms included.
+        """
+        atoms = []
+        for i in xrange(len(self.elements)):
+            atom = Atom(self.element(i))
+            atom.charge = self.charges[i]
+            atom.implicit_h = self.implicitH[i]
+            if self.hcounts[i] != NONE:
+                atom.hcount = self.hcounts[i]
+            if self.isotopes[i] != NONE:
+                atom.isotope = self.isotopes[i]
+            atom.is_aromatic = bool(self.aromatic[i])
+            if i in self.tags:
+                atom.tags = dict(self.tags[i])
+            atoms.append(atom)
+
+        for i, atom in enumerate(atoms):
+            for k in xrange(self.offsets[i], self.offsets[i+1]):
+                atom.neighbors[atoms[self.targets[k]]] = \
+                    bondOrder(self.orders[k])
+
+        def deref(j):
+            if j == NONE:
+                return None
+            return atoms[j]
+
+        for n, i in enumerate(self.stereoAtoms):
+            refs = self.stereoRefs[7*n:7*n+7]
+            stereo = _Stereo()
+            stereo.is_chiral = bool(self.stereoFlags[n] & IS_CHIRAL)
+            stereo.is_cistrans = bool(self.stereoFlags[n] & IS_CISTRANS)
+            (stereo.chiralA, stereo.chiralB, stereo.chiralC, stereo.chiralD,
+             stereo.CTotherC, stereo.CTa, stereo.CTb) = [deref(j) for j in refs]
+            atoms[i]._stereo = stereo
+
+        output = Molecule.__new__(Molecule)
+        output.__dict__.update(self.moleculeTags)
+        output.atoms = atoms[:self.size]
+        return output, atoms
+
+    ## Functional-group finders. These mirror the ones in helperFunctions,
+    ## but work on atom numbers instead of Atoms.
+
+    def _carbonPairs(self, order):
+        "All (i, j) with carbons i and j joined by a bond of `order`."
+        output = []
+        elements = self.elements
+        targets = self.targets
+        orders = self.orders
+        for i in xrange(self.size):
+            if elements[i] != CARBON_CODE:
+                continue
+            for k in xrange(self.offsets[i], self.offsets[i+1]):
+                if elements[targets[k]] == CARBON_CODE and orders[k] == order:
+                    output.append((i, targets[k]))
+        return output
+
+    def findAlkene(self):
+        "return :: (int, int) or None."
+        pairs = self._carbonPairs(2)
+        return pairs[0] if pairs else None
+
+    def findAlkenes(self):
+        "return :: [(int, int)]. Each double bond once."
+        return [(i, j) for i, j in self._carbonPairs(2) if i < j]
+
+    def findAlkyne(self):
+        "return :: (int, int) or None."
+        pairs = self._carbonPairs(3)
+        return pairs[0] if pairs else None
+
+    def findAlkynes(self):
+        "return :: [(int, int)]. Each triple bond once."
+        return [(i, j) for i, j in self._carbonPairs(3) if i < j]
+
+    def findAlkenesAndAlkynes(self):
+        "return :: [(int, int)]."
+        return self.findAlkenes() + self.findAlkynes()
+
+    def findAlkeneAndAlkyne(self):
+        "return :: (int, int) or None."
+        x = self.findAlkene()
+        if x is None:
+            return self.findAlkyne()
+        return x
+
+    def findHydrogenAlkyne(self):
+        """
+        return :: int or None. An uncharged alkyne carbon with nothing else
+            bonded to it, as in helperFunctions.findHydrogenAlkyne.
+        """
+        for i in xrange(self.size):
+            if self.elements[i] != CARBON_CODE or self.charges[i] != 0:
+                continue
+            if self.neighborCount(i) != 1:
+                continue
+            for j, order in self.neighbors(i):
+                if self.elements[j] == CARBON_CODE and order == 3 and \
+                   self.charges[j] == 0:
+                    return i
+        return None
+
+    def findHydroxyls(self):
+        """
+        return :: [int]. Oxygens of water and of hydroxyl groups.
+        Raises StandardError for an oxygen with 3+ neighbors.
+        """
+        if self.size == 1 and self.elements[0] == OXYGEN_CODE and \
+           self.implicitH[0] == 0:
+            return [0]
+        output = []
+        for i in xrange(self.size):
+            if self.elements[i] != OXYGEN_CODE:
+                continue
+            count = self.neighborCount(i)
+            if count == 0:
+                output.append(i)
+            elif count == 1:
+                total = self.implicitH[i] + sum(
+                    order for _, order in self.neighbors(i))
+                if total == 1:
+                    output.append(i)
+            elif count == 2:
+                continue
+            else:
+                print "Error -- Invalid oxygen atom with 3+ neighbors."
+                raise StandardError
+        return output
+
+
+def bondOrder(stored):
+    """
+    Bond orders are stored as floats, so that aromatic 1.5 fits. Turns a
+    stored one back into the int (or 1.5) that Atom.neighbors uses.
+    stored :: float.
+    return :: int or float.
+    """
+    if stored == int(stored):
+        return int(stored)
+    return stored
@@ -0,0 +1,70 @@
+"""
+functionalGroups.py
+Per-atom functional-group classification, used by Molecule to keep an index
+of where each group is (see Molecule.groupAtoms).
+
+Whether an atom belongs to a group depends only on the atom, its bonds, and
+its neighbors' elements, charges and neighbor counts. So after an edit, only
+the atoms it touched and their neighbors need reclassifying.
+"""
+
+HALOGENS = ('F', 'Cl', 'Br', 'I')
+
+# The kinds of site the index keeps, each keyed by one atom:
+#   alkene            a carbon double-bonded to a carbon
+#   alkyne            a carbon triple-bonded to a carbon
+#   hydrogenAlkyne    an uncharged alkyne carbon with one neighbor (the
+#                     other alkyne carbon, also uncharged); see
+#                     helperFunctions.findHydrogenAlkyne
+#   acetylide         a carbanion triple-bonded to a carbon
+#   hydroxyl          an oxygen of water or of a hydroxyl group
+#   overvalentOxygen  an oxygen with 3 or more neighbors
+#   halideCarbon      a carbon bonded to a halogen
+#   enol              an alkene carbon carrying an OH
+KINDS = ('alkene', 'alkyne', 'hydrogenAlkyne', 'acetylide', 'hydroxyl',
+         'overvalentOxygen', 'halideCarbon', 'enol')
+
+
+def classify(atom):
+    """
+    atom :: Atom.
+    return :: [str]. The kinds (from KINDS) that atom is the key atom of.
+    """
+    output = []
+    if atom.element == 'C':
+        carbonOrders = set()
+        halide = False
+        hydroxyl = False
+        for neighbor, bondOrder in atom.neighbors.iteritems():
+            if neighbor.element == 'C':
+                carbonOrders.add(bondOrder)
+            elif neighbor.element in HALOGENS:
+                halide = True
+            elif neighbor.element == 'O' and bondOrder == 1 and \
+                 neighbor.neighborCount() == 1:
+                hydroxyl = True
+        if 2 in carbonOrders:
+            output.append('alkene')
+            if hydroxyl:
+                output.append('enol')
+        if 3 in carbonOrders:
+            output.append('alkyne')
+            if atom.charge == -1:
+                output.append('acetylide')
+            if atom.charge == 0 and atom.neighborCount() == 1:
+                for neighbor, bondOrder in atom.neighbors.iteritems():
+                    if neighbor.element == 'C' and bondOrder == 3 and \
+                       neighbor.charge == 0:
+                        output.append('hydrogenAlkyne')
+        if halide:
+            output.append('halideCarbon')
+    elif atom.element == 'O':
+        count = atom.neighborCount()
+        if count == 0:
+            output.append('hydroxyl')
+        elif count == 1:
+            if atom.totalBondOrder() + atom.implicit_h == 1:
+                output.append('hydroxyl')
+        elif count > 2:
+            output.append('overvalentOxygen')
+    return output
@@ -1,5 +1,7 @@
 from molecularStructure import *
 from toSmiles import *
+from compactMolecule import CompactMolecule
+from rings import findRings
 import copy
 import itertools
 import cPickle
@@ -15,30 +17,36 @@ def antiAdd(molecule, target1, target2, add1, add2,
 
 def duplicateInputs(molecule, target1, target2, add1, add2, addtarget1,
                     addtarget2):
-    #Helper function for adds.  Returns a deep-copied version of all the inputs.
-    target1Pos = molecule.atoms.index(target1)
-    target2Pos = molecule.atoms.index(target2)
-    if addtarget1 != None:
-        addtarget1Pos = add1.atoms.index(addtarget1)
-    if addtarget2 != None:
-        addtarget2Pos = add2.atoms.index(addtarget2)
-
-    Xmolecule = copy.deepcopy(molecule)
+    #Helper function for adds.  Returns cloned versions of all the inputs.
+    Xmolecule, atomMap = molecule.clone()
     #Remake pointers to targets
-    Xtarget1 = Xmolecule.atoms[target1Pos]
-    Xtarget2 = Xmolecule.atoms[target2Pos]
-    Xadd1 = copy.deepcopy(add1)
-    Xadd2 = copy.deepcopy(add2)
-    if addtarget1 != None:
-        Xaddtarget1 = Xadd1.atoms[addtarget1Pos]
-    else:
-        Xaddtarget1 = None
-    if addtarget2 != None:
-        Xaddtarget2 = Xadd2.atoms[addtarget2Pos]
-    else:
-        Xaddtarget2 = None
+    Xtarget1 = atomMap[target1]
+    Xtarget2 = atomMap[target2]
+    Xadd1, Xaddtarget1 = cloneAddition(add1, addtarget1)
+    Xadd2, Xaddtarget2 = cloneAddition(add2, addtarget2)
     return (Xmolecule, Xtarget1, Xtarget2, Xadd1, Xadd2, Xaddtarget1, Xaddtarget2)
 
+def cloneAddition(add, addtarget):
+    #Helper function for duplicateInputs.  add is a Molecule, an Atom or None;
+    #addtarget is the atom of add where the new bond originates, if any.
+    if isinstance(add, Molecule):
+        Xadd, atomMap = add.clone()
+        if addtarget != None:
+            return Xadd, atomMap[addtarget]
+        return Xadd, None
+    elif isinstance(add, Atom):
+        #Bring along anything already bonded to the atom (e.g. the H on a
+        #copy of HYDROXYL_OXYGEN).
+        return Molecule(add).clone()[1][add], None
+    return add, None
+
+def cloneMolecules(molecules):
+    #Returns clones of a molecule, or of each molecule in a list.
+    #Use this instead of copy.deepcopy to protect reaction inputs.
+    if isinstance(molecules, Molecule):
+        return molecules.clone()[0]
+    return [molecule.clone()[0] for molecule in molecules]
+
 #Returns a list of molecules.
 def synAdd(molecule, target1, target2, add1, add2,
            addtarget1 = None, addtarget2 = None, antiAdd = False):
@@ -55,10 +63,8 @@ def synAdd(molecule, target1, target2, add1, add2,
                                addtarget2)
 
     #Set bond orders to single.
-    target1.neighbors[target2] = 1
-    target2.neighbors[target1] = 1
-    Xtarget1.neighbors[Xtarget2] = 1
-    Xtarget2.neighbors[Xtarget1] = 1
+    molecule.changeBond(target1, target2, 1)
+    Xmolecule.changeBond(Xtarget1, Xtarget2, 1)
 
     if antiAdd:
         bigListOfStuff =\
@@ -76,6 +82,11 @@ def synAdd(molecule, target1, target2, add1, add2,
     for thismolecule, thisAdd, thisTarget, thisAddTarget, otherTarget, ct1, ct2\
             in bigListOfStuff:
         if isinstance(thisAdd, Atom):
+            if ct1 == None and ct2 == None and thisAdd.isPlainHydrogen():
+                #No stereo depends on this hydrogen, so it can be implicit.
+                thismolecule.addHydrogen(thisTarget)
+                thisTarget.eliminateCT()
+                continue
             thismolecule.addAtom(thisAdd, thisTarget, 1)
             if ct1 != None or ct2 != None:
                 thisTarget.newChiralCenter(otherTarget,
@@ -116,6 +127,8 @@ def allAdd(molecule, target1, target2, add1, add2, addtarget1=None, addtarget2=N
         (target1, add1, addtarget1), (target2, add2, addtarget2)):
         if isinstance(thisAdd, Molecule):
             molecule.addMolecule(thisAdd, thisAddtarget, thisTarget, 1)
+        elif isinstance(thisAdd, Atom) and thisAdd.isPlainHydrogen():
+            molecule.addHydrogen(thisTarget)
         elif isinstance(thisAdd, Atom):
             molecule.addAtom(thisAdd, thisTarget, 1)
         else:
@@ -183,6 +196,8 @@ def allTripleAdd(molecule, target1, target2, add1, add2, addtarget1 = None, addt
         (target1, add1b, addtarget1b), (target2, add2b, addtarget2b)):
         if isinstance(thisAdd, Molecule):
             molecule.addMolecule(thisAdd, thisAddtarget, thisTarget, 1)
+        elif isinstance(thisAdd, Atom) and thisAdd.isPlainHydrogen():
+            molecule.addHydrogen(thisTarget)
         elif isinstance(thisAdd, Atom):
             molecule.addAtom(thisAdd, thisTarget, 1)
         else:
@@ -203,6 +218,8 @@ def makeCompareDict(a, b, checkChiral = True):
     ## :: dictionary from atoms of a to atoms of b
     ## makeCompareDict maps atoms in a to their hypothesized counterparts in b.
     ## if a and b do NOT have same atom set, return None
+    ## CompactMolecules are only expanded to Molecules for matching up atoms,
+    ## once their element counts agree.
     
     finishedDict = None
     
@@ -210,10 +227,6 @@ def makeCompareDict(a, b, checkChiral = True):
         #Determines whether two molecules are isomorphic.  In the worst case
         #(two molecules with the same atoms), this procedure does not run in
         #polynomial time, so be careful.
-        for ele in ['C','N','O']:
-            if a.countElement(ele) != b.countElement(ele):
-                return False
-
         if len(expanded) == len(a.atoms):
             #We've reached every atom.  Call it equal.
             finishedDict = compareDict
@@ -256,6 +269,9 @@ def makeCompareDict(a, b, checkChiral = True):
         #If the elements don't match, obviously there are no pairings.
         if set(aN) != set(bN):
             return None
+        if a.implicit_h != b.implicit_h:
+            #Different numbers of implicit hydrogens.  No pairings.
+            return None
         if a.is_chiral != b.is_chiral:
             #One atom has chirality, where the other doesn't.  Obviously no pairings.
             return None
@@ -341,33 +357,37 @@ def makeCompareDict(a, b, checkChiral = True):
                 out.append(temp)
         return out
         
+    #Element counts are cached on the molecules (or read off the element
+    #codes of CompactMolecules), so this check is cheap and never has to be
+    #repeated during the search.
+    aCounts = a.elementCounts()
+    bCounts = b.elementCounts()
+    for ele in ['C','N','O']:
+        if aCounts.get(ele, 0) != bCounts.get(ele, 0):
+            return None
+    if isinstance(a, CompactMolecule):
+        a = a.toMolecule()[0]
+    if isinstance(b, CompactMolecule):
+        b = b.toMolecule()[0]
     ans = insideCompare(a, b)
     return finishedDict
 
 def shift(l, n):
     return l[n:] + l[:n]
 
-def isInRing(start, current, last=None, alreadyVisited=[]):
+def isInRing(start, current, molecule=None):
     #Tests whether ADJACENT Atoms start and current are in the same ring.
     #Only works on adjacent atoms!
-    #If so, returns a list of elements in the ring in connected order, starting (current, ..., start)
+    #If so, returns the atoms of the smallest such ring in connected order,
+    #starting (current, ..., start)
     #If not, returns None
-    #Do a depth-first search.
-    if last == None:
-        #Initialization only.
-        last = start
-    if start == current:
-        return [current]
-    if current in alreadyVisited:
-        return None
-    for nextNeighbor in current.neighbors:
-        if nextNeighbor == last:
-            #Don't go where we've already been.
-            continue
-        x = isInRing(start, nextNeighbor, current, alreadyVisited + [current])
-        if x!= None:
-            return [current] + x
-    return None
+    #Pass the molecule to answer from its cached ring perception; otherwise
+    #the rings around start are perceived from scratch.
+    if molecule is not None:
+        ringInfo = molecule.rings()
+    else:
+        ringInfo = findRings([start])
+    return ringInfo.ringPath(start, current)
 
 def markovnikov(a, b):
     #a and b are two carbon atoms.  Function tuple of all possible markovnikov
@@ -397,9 +417,6 @@ def carbonylAdd(molecule, target1, target2):
     #Protect the inputs from modification:
     (molecule, target1, target2, add1, add2, addtarget1, addtarget2)=\
                duplicateInputs(molecule, target1, target2, add1, add2, addtarget1, addtarget2)
-    #We need an extra copy of add1 and add2, along with corresponding addtargets.
-    (notused, notused2, notused3, add1b, add2b, addtarget1b, addtarget2b)=\
-               duplicateInputs(molecule, target1, target2, add1, add2, addtarget1, addtarget2)
     #Change to single bond
     molecule.changeBond(target1, target2, 1)
     #Add new stuff
@@ -410,10 +427,12 @@ def carbonylAdd(molecule, target1, target2):
 
 #Returns a tuple of atoms.
 #Returns None if none found.
+#These finders look sites up in the molecule's functional-group index.
+#They also take a CompactMolecule, and then return atom numbers.
 def findAlkene(molecule):
-    for atom in molecule.atoms:
-        if not (atom.element == 'C'):
-            continue
+    if isinstance(molecule, CompactMolecule):
+        return molecule.findAlkene()
+    for atom in molecule.groupAtoms('alkene'):
         for neighbor in atom.neighbors:
             if neighbor.element == 'C' and atom.neighbors[neighbor] == 2:
                 return (atom, neighbor)
@@ -423,10 +442,10 @@ def findAlkene(molecule):
 #Returns a list of tuples of atoms.
 #Returns [] if none found.
 def findAlkenes(molecule):
+    if isinstance(molecule, CompactMolecule):
+        return molecule.findAlkenes()
     output = []
-    for atom in molecule.atoms:
-        if not (atom.element == 'C'):
-            continue
+    for atom in molecule.groupAtoms('alkene'):
         for neighbor in atom.neighbors:
             if neighbor.element == 'C' and atom.neighbors[neighbor] == 2:
                 output += [(atom, neighbor)]
@@ -444,9 +463,9 @@ def findAlkenes(molecule):
 def findAlkyne(molecule):
     if molecule == None:
         return None
-    for atom in molecule.atoms:
-        if not (atom.element == 'C'):
-            continue
+    if isinstance(molecule, CompactMolecule):
+        return molecule.findAlkyne()
+    for atom in molecule.groupAtoms('alkyne'):
         for neighbor in atom.neighbors:
             if neighbor.element == 'C' and atom.neighbors[neighbor] == 3:
                 if atom == neighbor:
@@ -458,25 +477,19 @@ def findAlkyne(molecule):
 #Returns an atom. That atom is part of an alkyne, and is attached to an H.
 #Returns None if none found.
 def findHydrogenAlkyne(molecule):
-    for atom in molecule.atoms:
-        if not (atom.element == 'C'):
-            continue
-        if len(list(atom.neighbors)) != 1:
-            continue
-        if atom.charge != 0:
-            continue
-        for neighbor in atom.neighbors:
-            if neighbor.element == 'C' and atom.neighbors[neighbor] == 3 and neighbor.charge == 0:
-                return atom
+    if isinstance(molecule, CompactMolecule):
+        return molecule.findHydrogenAlkyne()
+    for atom in molecule.groupAtoms('hydrogenAlkyne'):
+        return atom
     return None
 
 #Returns a list of tuples of atoms.
 #Returns [] if none found.
 def findAlkynes(molecule):
+    if isinstance(molecule, CompactMolecule):
+        return molecule.findAlkynes()
     output = []
-    for atom in molecule.atoms:
-        if not (atom.element == 'C'):
-            continue
+    for atom in molecule.groupAtoms('alkyne'):
         for neighbor in atom.neighbors:
             if neighbor.element == 'C' and atom.neighbors[neighbor] == 3:
                 output += [(atom, neighbor)]
@@ -490,34 +503,30 @@ def findAlkynes(molecule):
 #Returns a list of atoms.
 #Returns [] if none found.
 def findHydroxyls(molecule):
+    if isinstance(molecule, CompactMolecule):
+        return molecule.findHydroxyls()
     output = []
     if moleculeSame(Molecule(Atom("O")), molecule):
         return [[x for x in molecule.atoms if x.element == "O"][0]]
-    for atom in molecule.atoms:
-        if not (atom.element == 'O'):
-            continue
-        if len(list(atom.neighbors)) == 0: #water
-            output += [atom]
-        elif len(list(atom.neighbors)) == 1: #it's a hydroxyl?
-            if atom.neighbors.values()[0] == 1: #single bonds only!  No ketones!
-                output += [atom]
-            else:
-                continue
-        elif len(list(atom.neighbors)) == 2: #it's an ether, don't return it
-            continue
-        else:
-            print "Error -- Invalid oxygen atom with 3+ neighbors."
-            raise StandardError
+    #Water, or hydroxyls (single bonds only!  No ketones!); not ethers.
+    if molecule.groupAtoms('overvalentOxygen'):
+        print "Error -- Invalid oxygen atom with 3+ neighbors."
+        raise StandardError
+    output += molecule.groupAtoms('hydroxyl')
     return output
 
 #Returns a list of tuples of atoms.
 #Returns [] if none found.
 def findAlkenesAndAlkynes(molecule):
+    if isinstance(molecule, CompactMolecule):
+        return molecule.findAlkenesAndAlkynes()
     return findAlkenes(molecule) + findAlkynes(molecule)
 
 #Returns a tuple of atoms.
 #Returns None if none found.
 def findAlkeneAndAlkyne(molecule):
+    if isinstance(molecule, CompactMolecule):
+        return molecule.findAlkeneAndAlkyne()
     #Tiny helper function.
     x = findAlkene(molecule)
     if x == None:
@@ -540,30 +549,22 @@ def findAlkeneOrAlkyne(molecule):
 #Make sure not to include duplicates.
 def findAlkenesOrAlkynes(molecule, bo):
     #bo = bond order (2 or 3)
-    #To track which bonds we've counted, we use the atom.flag property.
-    #atom.flag starts at 0, and must be reset to 0 at the end.
+    #To track which bonds we've counted, we keep a table of the partners
+    #counted so far for each atom.
+    counted = {}
     doubleBonds = []
     for atom in molecule.atoms:
         if not(atom.element == 'C'):
             continue
         for neighbor in atom.neighbors:
             if neighbor.element == 'C' and atom.neighbors[neighbor] == bo:
-                if atom.flag != 0 and neighbor.flag != 0 and atom in neighbor.flag\
-                   and neighbor in atom.flag:
+                if atom in counted.get(neighbor, ()) and \
+                   neighbor in counted.get(atom, ()):
                     #We've already counted this bond.  Move on.
                     continue
-                if atom.flag == 0:
-                    atom.flag = [neighbor]
-                else:
-                    atom.flag.append(neighbor)
-                if neighbor.flag == 0:
-                    neighbor.flag = [atom]
-                else:
-                    neighbor.flag.append(atom)
+                counted.setdefault(atom, []).append(neighbor)
+                counted.setdefault(neighbor, []).append(atom)
                 doubleBonds.append((atom, neighbor))
-    #Reset the flags - other functions like to use them, as well.
-    for atom in molecule.atoms:
-        atom.flag = 0
     return doubleBonds
 
 
@@ -577,44 +578,55 @@ def findAlkenesOrAlkynes(molecule, bo):
 #Outputs a list of molecule(s), representing distinct contiguous parts of the old molecule(s).
 #Uses include ozonolysis reactions.
 def splice(molecules):
+    #Splits each molecule into its connected components, as new Molecules.
+    #The atoms themselves carry over, so stereo references stay valid.
+    #Union-find over the bonds: linear time, and all traversal state is
+    #local, so nothing is written to the atoms.
     if not isinstance(molecules, list):
         molecules = [molecules]
     output = []
     for molecule in molecules:
-        #Find the next unflagged atom, if it exists
-        while 0 in [atom.flag for atom in molecule.atoms]:
-            originalAtom = [atom for atom in molecule.atoms if atom.flag == 0][0]
-            currentAtom = originalAtom
-            newMolecule = Molecule(originalAtom)
-            newMolecule.atoms = []
-            #Traverse the map of bonds, storing parent atoms and checking for flags
-            #Do this until you are back at the original atom with nothing left to check
-            while (0 in [atom.flag for atom in list(originalAtom.neighbors)]) or (currentAtom != originalAtom):
-                #If current atom unflagged:
-                if currentAtom.flag == 0:
-                    #Add current atom to list
-                    newMolecule.atoms += [currentAtom]
-                    #Flag current atom
-                    currentAtom.flag = 1
-                #If current atom lacks unflagged neighbors:
-                if not 0 in [atom.flag for atom in list(currentAtom.neighbors)]:
-                    #Return to parent atom.
-                    currentAtom = currentAtom.parentAtom
-                #Else:
-                else:
-                    #Next atom is the first unflagged neighbor.
-                    nextAtom = [atom for atom in list(currentAtom.neighbors) if atom.flag == 0][0]
-                    #Store current atom as next atom's parent.
-                    nextAtom.parentAtom = currentAtom
-                    #Store next atom as current atom.
-                    currentAtom = nextAtom
+        atoms = list(molecule.atoms)
+        parent = {}
+        for atom in atoms:
+            parent[atom] = atom
+
+        def find(atom):
+            while parent[atom] is not atom:
+                #Path halving.
+                parent[atom] = parent[parent[atom]]
+                atom = parent[atom]
+            return atom
+
+        i = 0
+        while i < len(atoms):
+            atom = atoms[i]
+            for neighbor in atom.neighbors:
+                if neighbor not in parent:
+                    #Bonded to the molecule without being listed in it.
+                    parent[neighbor] = neighbor
+                    atoms.append(neighbor)
+                root1 = find(atom)
+                root2 = find(neighbor)
+                if root1 is not root2:
+                    parent[root2] = root1
+            i += 1
+
+        #Components come out in order of their first atom, and keep the
+        #molecule's atom order.
+        components = {}
+        order = []
+        for atom in atoms:
+            root = find(atom)
+            if root not in components:
+                components[root] = []
+                order.append(root)
+            components[root].append(atom)
+        for root in order:
+            newMolecule = Molecule(root)
+            newMolecule.implicitHydrogens = molecule.implicitHydrogens
+            newMolecule.atoms = components[root]
             output += [newMolecule]
-
-
-        #Reset flags
-        for atom in molecule.atoms:
-            atom.flag = 0
-            atom.parentAtom = 0
     return output
     
     
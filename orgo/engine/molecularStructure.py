@@ -2,25 +2,418 @@
 molecularStructure.py
 Contains class Molecule and class Atom.
 """
-import copy
+
+import weakref
+
+import functionalGroups
+import rings
 
 #Testing - replace "H" with "Br" to visualize all hydrogens
 HYDROGEN = "H"
 
 DEBUG = False # True
 
+# Standard atomic weights (IUPAC, abridged), for Molecule.molecularWeight.
+ATOMIC_WEIGHTS = {
+    'H': 1.008, 'Li': 6.94, 'B': 10.81, 'C': 12.011, 'N': 14.007,
+    'O': 15.999, 'F': 18.998, 'Na': 22.990, 'Mg': 24.305, 'Al': 26.982,
+    'Si': 28.085, 'P': 30.974, 'S': 32.06, 'Cl': 35.45, 'K': 39.098,
+    'Ca': 40.078, 'Cr': 51.996, 'Mn': 54.938, 'Fe': 55.845, 'Cu': 63.546,
+    'Zn': 65.38, 'Br': 79.904, 'Pd': 106.42, 'Sn': 118.71, 'I': 126.90,
+    'Os': 190.23, 'Pt': 195.08, 'Hg': 200.59,
+}
+
+# Molecule's own bookkeeping, as opposed to molecule-level tags such as
+# oneEqvAdded. Copies of a molecule rebuild these rather than share them.
+INTERNAL_FIELDS = ('_atoms', '_atomIndex', '_removed', '_seq', '_nextSeq',
+                   '_journal', '_savepoints', '_groups', '_counts', '_rings',
+                   'version', '_memo')
+
 class Molecule(object):
     """
     This class represents the structure of a molecule.
         self.atoms :: [Atom].
+        self.implicitHydrogens :: bool. Whether plain hydrogens are carried
+            as counts on their heavy atoms (Atom.implicit_h) instead of as
+            Atom objects. See collapseHydrogens.
+        self.version :: int. Goes up with every edit made through this
+            molecule's methods (touchAtom included), rollbacks too, and
+            with every stereo edit to one of its atoms (Atom.eliminateChiral
+            and the like), which reach it through Atom._molecule.
+
+    Next to the ordered atom list, the molecule keeps an identity-keyed
+    index of its atoms so membership tests, insertion and removal don't
+    have to scan the list. Removed atoms are only dropped from the list
+    the next time self.atoms is read.
+
+    Edits can be made speculatively: between begin() and rollback(), every
+    bond change, added atom and removed atom is journaled, so undoing them
+    costs as much as making them did, however big the molecule is.
+
+    The molecule also indexes its functional groups (see groupAtoms). The
+    index is built the first time it is asked for, then kept up to date by
+    the editing methods here: edits reclassify just the atoms they touch.
+    Edit atoms' own fields only after passing them to touchAtom(), and bonds
+    only through this molecule's methods, or the index goes stale (and so
+    do version and anything remembered, see below).
+
+    Element counts (see elementCounts, formula) are kept the same way: a
+    histogram built on first use, which adding, removing and touching
+    atoms keep current.
+
+    Ring perception (see rings()) is cached until a bond that could be part
+    of a ring is made or broken.
+
+    Anything else worked out from the whole molecule, such as its SMILES,
+    can be kept with remember() and looked up with memo() for as long as
+    self.version stays the same.
+
+    None of these lookups leave scratch state on the atoms, and the lazily
+    built caches are built on the side and swapped in with one assignment,
+    together with the (emptied) set of atoms still to be brought into them,
+    so a molecule that nobody edits can be read from several threads at
+    once (e.g. the constants in reactions.py, or a cached product).
     """
 
+    implicitHydrogens = False
+    _journal = None # list of undo entries while a begin() is open
+    ## Once groupAtoms has been called: ({kind: set of Atoms}, set of Atoms
+    ## to reclassify).
+    _groups = None
+    ## Once elementCounts has been called: ({element: int}, set of Atoms
+    ## left out of the counts).
+    _counts = None
+    _rings = None # rings.RingInfo, until the ring structure changes
+    version = 0
+    _memo = None # (version, {key: value})
+
     def __init__(self, firstAtom):
         """
         firstAtom :: Atom.
         """
         self.atoms = [firstAtom]
-    
+
+    def _getAtoms(self):
+        if self._removed:
+            # Fresh list and set, so the old ones can go in the journal as-is.
+            self._log(('atoms', self._atoms, self._removed))
+            self._atoms = [atom for atom in self._atoms
+                           if atom not in self._removed]
+            self._removed = set()
+        return self._atoms
+
+    def _setAtoms(self, atoms):
+        owner = weakref.ref(self)
+        for atom in atoms:
+            atom._molecule = owner
+        self._atoms = atoms
+        self._atomIndex = set(atoms)
+        self._removed = set()
+        # Position of each atom in the list, for putting index lookups back
+        # in list order. Only ever compared, so removals leave gaps.
+        self._seq = dict((atom, i) for i, atom in enumerate(atoms))
+        self._nextSeq = len(atoms)
+        self._groups = None
+        self._counts = None
+        self._rings = None
+        self.version += 1
+
+    atoms = property(_getAtoms, _setAtoms)
+
+    def __contains__(self, atom):
+        """
+        atom :: Atom.
+        return :: bool. Whether atom is in this molecule.
+        """
+        return atom in self._atomIndex
+
+    def _appendAtom(self, atom):
+        if atom in self._removed:
+            # Still sitting in the list from before it was removed; flush
+            # that entry so the atom doesn't show up twice.
+            self._getAtoms()
+        atom._molecule = weakref.ref(self)
+        self._atoms.append(atom)
+        self._atomIndex.add(atom)
+        self._seq[atom] = self._nextSeq
+        self._nextSeq += 1
+        self._log(('append', atom))
+        self._edited(atom)
+        if self._counts is not None:
+            self._counts[1].add(atom)
+
+    def _edited(self, atom):
+        "Marks atom and its neighbors for reclassification."
+        self.version += 1
+        if self._groups is not None:
+            dirty = self._groups[1]
+            dirty.add(atom)
+            dirty.update(atom.neighbors)
+
+    def _refreshGroups(self):
+        """
+        Reclassifies the atoms edited since the last lookup, or every atom
+        the first time.
+        return :: {str: set of Atoms}. The up-to-date index.
+        """
+        if self._groups is None:
+            groups = dict((name, set()) for name in functionalGroups.KINDS)
+            dirty = self._atomIndex
+        else:
+            groups, dirty = self._groups
+            if not dirty:
+                return groups
+            groups = dict((name, set(group))
+                          for name, group in groups.iteritems())
+        for atom in dirty:
+            for group in groups.itervalues():
+                group.discard(atom)
+            if atom in self._atomIndex:
+                for name in functionalGroups.classify(atom):
+                    groups[name].add(atom)
+        ## One assignment, so that a reader in another thread sees either
+        ## the old index with its dirty atoms, or the new one without.
+        self._groups = (groups, set())
+        return groups
+
+    def _uncount(self, atom):
+        "Takes atom out of the element histogram until the next lookup."
+        if self._counts is None:
+            return
+        counts, uncounted = self._counts
+        if atom in uncounted:
+            return
+        uncounted.add(atom)
+        if atom in self._atomIndex:
+            counts[atom.element] -= 1
+            if atom.implicit_h:
+                counts['H'] -= atom.implicit_h
+
+    def elementCounts(self):
+        """
+        Counts this molecule's atoms by element, implicit hydrogens
+        included as 'H'. Kept up to date as the molecule is edited, so
+        this costs as much as the edits since the last call.
+        return :: {str: int}. Elements with no atoms are left out.
+        """
+        if self._counts is None:
+            counts = {}
+            uncounted = self._atomIndex
+        else:
+            counts, uncounted = self._counts
+        if uncounted:
+            counts = dict(counts)
+            for atom in uncounted:
+                if atom in self._atomIndex:
+                    counts[atom.element] = counts.get(atom.element, 0) + 1
+                    if atom.implicit_h:
+                        counts['H'] = counts.get('H', 0) + atom.implicit_h
+            ## One assignment, as in _refreshGroups.
+            self._counts = (counts, set())
+        return dict((element, count) for element, count in counts.iteritems()
+                    if count)
+
+    def formula(self):
+        """
+        return :: str. The molecular formula in Hill order: C, then H, then
+            the rest alphabetically; without carbon, all alphabetically.
+            e.g. 'C2H6O'.
+        """
+        counts = self.elementCounts()
+        if 'C' in counts:
+            order = ['C'] + (['H'] if 'H' in counts else []) + \
+                sorted(e for e in counts if e not in ('C', 'H'))
+        else:
+            order = sorted(counts)
+        output = ''
+        for element in order:
+            output += element
+            if counts[element] > 1:
+                output += str(counts[element])
+        return output
+
+    def molecularWeight(self):
+        """
+        return :: float. Average molecular weight, in g/mol.
+
+        Throws error if an element has no entry in ATOMIC_WEIGHTS.
+        """
+        output = 0.0
+        for element, count in self.elementCounts().iteritems():
+            if element not in ATOMIC_WEIGHTS:
+                raise StandardError("No atomic weight for %s" % element)
+            output += ATOMIC_WEIGHTS[element] * count
+        return output
+
+    def _linking(self, atom1, atom2):
+        """
+        Call before making or breaking the bond atom1-atom2. Drops the ring
+        cache unless one end has no other bonds, since a bond to a dead end
+        can't close or open a ring.
+        """
+        if self._rings is None:
+            return
+        if len(atom1.neighbors) - (atom2 in atom1.neighbors) > 0 and \
+           len(atom2.neighbors) - (atom1 in atom2.neighbors) > 0:
+            self._rings = None
+
+    def rings(self):
+        """
+        Perceives this molecule's rings, or returns them from the cache.
+        return :: rings.RingInfo.
+        """
+        if self._rings is None:
+            self._rings = rings.findRings(self.atoms)
+        return self._rings
+
+    def memo(self, key):
+        """
+        Looks up a value stored by remember(), unless this molecule has been
+        edited since.
+        key :: hashable.
+        return :: the value, or None.
+        """
+        memo = self._memo
+        if memo is None or memo[0] != self.version:
+            return None
+        return memo[1].get(key)
+
+    def remember(self, key, value):
+        """
+        Stores value, worked out from this molecule as it is now, for
+        memo(key) to return until the molecule is next edited. Clones of
+        the molecule start out with the same values, so value mustn't
+        refer to this molecule's atoms.
+        key :: hashable.
+        value :: anything but None.
+        return :: value.
+        """
+        memo = self._memo
+        if memo is None or memo[0] != self.version:
+            values = {}
+        else:
+            values = dict(memo[1])
+        values[key] = value
+        self._memo = (self.version, values)
+        return value
+
+    def groupAtoms(self, kind):
+        """
+        Looks up the functional-group index.
+        kind :: str. One of functionalGroups.KINDS.
+        return :: [Atom]. The key atoms of every site of that kind, in the
+            order of self.atoms.
+        """
+        group = self._refreshGroups()[kind]
+        if len(group) < 2:
+            return list(group)
+        return sorted(group, key=self._seq.__getitem__)
+
+    def _logBond(self, atom1, atom2):
+        "Journals the bond between atom1 and atom2 before it changes."
+        if self._journal is not None:
+            self._journal.append(('bond', atom1, atom2,
+                                  atom1.neighbors.get(atom2),
+                                  atom2.neighbors.get(atom1)))
+
+    def _log(self, entry):
+        if self._journal is not None:
+            self._journal.append(entry)
+
+    def begin(self):
+        """
+        Starts journaling edits to this molecule, so that rollback() can
+        undo them. Calls nest; each begin() is closed by one commit() or
+        rollback().
+        Bonds and atom membership are journaled automatically. Atoms' own
+        fields (element, charge, implicit hydrogens, stereochemistry) are only
+        journaled for atoms passed to touchAtom() before they are edited.
+        To keep the edited molecule as a product and still roll back, take
+        a clone() first.
+        """
+        if self._journal is None:
+            self._journal = []
+            self._savepoints = []
+        self._savepoints.append(len(self._journal))
+
+    def commit(self):
+        """
+        Keeps the edits made since the matching begin(). The molecule
+        itself is the product; nothing is copied.
+        """
+        self._savepoints.pop()
+        if not self._savepoints:
+            del self._journal, self._savepoints
+
+    def rollback(self):
+        """
+        Undoes the edits made since the matching begin(), newest first.
+        """
+        mark = self._savepoints.pop()
+        while len(self._journal) > mark:
+            self._undo(self._journal.pop())
+        if not self._savepoints:
+            del self._journal, self._savepoints
+
+    def touchAtom(self, atom):
+        """
+        Call before editing atom's element, charge, implicit hydrogen count
+        or stereochemistry. Journals them, so that rollback() restores them,
+        and has the atom reclassified in the functional-group index.
+        atom :: Atom.
+        """
+        self._uncount(atom)
+        if self._journal is not None:
+            stereo = atom._stereo
+            if stereo is not None:
+                stereo = stereo.remapped(lambda other: other)
+            self._journal.append(('atom', atom, atom.element, atom.charge,
+                                  atom.implicit_h, stereo))
+        self._edited(atom)
+
+    def _undo(self, entry):
+        kind = entry[0]
+        if kind == 'bond':
+            _, atom1, atom2, order1, order2 = entry
+            if (order1 is None) != (atom2 not in atom1.neighbors):
+                self._linking(atom1, atom2)
+            for atom, other, order in ((atom1, atom2, order1),
+                                       (atom2, atom1, order2)):
+                if order is None:
+                    atom.neighbors.pop(other, None)
+                else:
+                    atom.neighbors[other] = order
+            self._edited(atom1)
+            self._edited(atom2)
+        elif kind == 'append':
+            atom = entry[1]
+            assert self._atoms[-1] is atom, "Journal out of step"
+            self._uncount(atom)
+            self._atoms.pop()
+            self._atomIndex.discard(atom)
+            self._edited(atom)
+        elif kind == 'remove':
+            _, target, detached, wasMember = entry
+            for atom in detached:
+                self._linking(atom, target)
+                atom.neighbors[target] = target.neighbors[atom]
+                self._edited(atom)
+            if wasMember:
+                # Still in self._atoms: removal is lazy, and any compaction
+                # since has been undone already.
+                self._atomIndex.add(target)
+                self._removed.discard(target)
+                if self._counts is not None:
+                    self._counts[1].add(target)
+            self._edited(target)
+        elif kind == 'atoms':
+            _, self._atoms, self._removed = entry
+        elif kind == 'atom':
+            self._uncount(entry[1])
+            (_, atom, atom.element, atom.charge, atom.implicit_h,
+             atom._stereo) = entry
+            self._edited(atom)
+
     def addAtom(self, newAtom, targetAtom, bondOrder=1):
         """
         For adding new atoms to the molecule.
@@ -37,13 +430,13 @@ class Molecule(object):
         if bondOrder not in [1, 2, 3, 4]:
             if DEBUG:
                 raise StandardError("Invalid bond order: %s" % str(bondOrder))
-        if targetAtom not in self.atoms:
+        if targetAtom not in self._atomIndex:
             if DEBUG:
                 raise StandardError("Target atom not already in molecule.")
-        if newAtom in self.atoms:
+        if newAtom in self._atomIndex:
             print "WARNING: new atom already in molecule. Using addBond."
             return self.addBond(targetAtom, newAtom, bondOrder)
-        self.atoms.append(newAtom)
+        self._appendAtom(newAtom)
         self.addBond(newAtom, targetAtom, bondOrder)
         
     def addBond(self, atom1, atom2, bondOrder=1):
@@ -53,16 +446,21 @@ class Molecule(object):
         atom2 :: Atom.
         bondOrder :: int. 1, 2, 3, or 4.
         """
-        if atom1 not in self.atoms:
+        if atom1 not in self._atomIndex:
             if DEBUG:
                 raise StandardError("Improper use of addBond")
-            self.atoms.append(atom1)
-        if atom2 not in self.atoms:
+            self._appendAtom(atom1)
+        if atom2 not in self._atomIndex:
             if DEBUG:
                 raise StandardError("Improper use of addBond")
-            self.atoms.append(atom2)
+            self._appendAtom(atom2)
+        if atom2 not in atom1.neighbors:
+            self._linking(atom1, atom2)
+        self._logBond(atom1, atom2)
         atom1.neighbors[atom2] = bondOrder
         atom2.neighbors[atom1] = bondOrder
+        self._edited(atom1)
+        self._edited(atom2)
 
     def addMolecule(self, molecule, foreignTarget, selfTarget, bondOrder=1):
         """
@@ -75,8 +473,8 @@ class Molecule(object):
         """
         #Preserves objects in added molecule (no deepcopy)
         for foreignAtom in molecule.atoms:
-            if foreignAtom not in self.atoms:
-                self.atoms.append(foreignAtom)
+            if foreignAtom not in self._atomIndex:
+                self._appendAtom(foreignAtom)
         self.addBond(selfTarget, foreignTarget, bondOrder)
         
     def removeAtom(self, target):
@@ -84,11 +482,23 @@ class Molecule(object):
         Remove an atom from this molecule. Destroys the atom.
         target :: Atom.
         """
-        for atom in self.atoms:
+        detached = []
+        for atom in target.neighbors:
             if target in atom.neighbors:
+                self._linking(atom, target)
                 del atom.neighbors[target]
-        if target in self.atoms:
-            self.atoms.remove(target)
+                detached.append(atom)
+        wasMember = target in self._atomIndex
+        if wasMember:
+            self._uncount(target)
+            self._atomIndex.remove(target)
+            self._removed.add(target)
+        self._log(('remove', target, detached, wasMember))
+        self._edited(target)
+        ## Losing a bond can change what the atoms next to each detached
+        ## atom are (e.g. the C of an enol, when its O loses its H).
+        for atom in detached:
+            self._edited(atom)
         del target
         
     def changeBond(self, atom1, atom2, newBondOrder):
@@ -100,15 +510,19 @@ class Molecule(object):
         Note that newBondOrder=0 breaks the bond.
         """
         if DEBUG:
-            assert atom1 in self.atoms, "Not in molecule: %s" % str(atom1)
-            assert atom2 in self.atoms, "Not in molecule: %s" % str(atom2)
+            assert atom1 in self._atomIndex, "Not in molecule: %s" % str(atom1)
+            assert atom2 in self._atomIndex, "Not in molecule: %s" % str(atom2)
 
+        self._logBond(atom1, atom2)
         if newBondOrder == 0:
+            self._linking(atom1, atom2)
             del atom1.neighbors[atom2]
             del atom2.neighbors[atom1]
         else:
             atom1.neighbors[atom2] = newBondOrder
             atom2.neighbors[atom1] = newBondOrder
+        self._edited(atom1)
+        self._edited(atom2)
 
     def addHydrogens(self):
         """
@@ -126,15 +540,15 @@ class Molecule(object):
                     maxval = 1
                 else:
                     continue
-                val = 0
+                val = atom.implicit_h
                 for neighbor in atom.neighbors:
                     if DEBUG:
-                        assert neighbor in self.atoms
+                        assert neighbor in self._atomIndex
                     val += atom.neighbors[neighbor]
                 diff = maxval - val
 
             else:
-                hydrogen_already_added = 0
+                hydrogen_already_added = atom.implicit_h
                 for neighbor in atom.neighbors:
                     if neighbor.element == 'H':
                         hydrogen_already_added += 1
@@ -171,17 +585,79 @@ class Molecule(object):
                             raise StandardError("[C@H] weirdness: why no H?")
 
 
+    def collapseHydrogens(self):
+        """
+        Switches this molecule to implicit-hydrogen mode: every plain
+        hydrogen atom is removed and counted in its heavy atom's implicit_h
+        instead. Hydrogens that a chiral or cis-trans center refers to stay
+        as atoms, as do isotopes, charged or unusually bonded hydrogens.
+        """
+        stereoHydrogens = set()
+        for atom in self.atoms:
+            stereoHydrogens.update((atom.chiralA, atom.chiralB, atom.chiralC,
+                                    atom.chiralD, atom.CTa, atom.CTb))
+        for atom in list(self.atoms):
+            if not atom.isPlainHydrogen() or atom in stereoHydrogens:
+                continue
+            if len(atom.neighbors) != 1:
+                continue
+            parent, bondOrder = atom.neighbors.items()[0]
+            if parent.element == 'H' or bondOrder != 1:
+                continue
+            self.removeAtom(atom)
+            self.touchAtom(parent)
+            parent.implicit_h += 1
+        self.implicitHydrogens = True
+
+    def expandHydrogens(self):
+        """
+        Switches this molecule back to explicit-hydrogen mode, turning
+        every implicit hydrogen count into hydrogen atoms.
+        """
+        for atom in list(self.atoms):
+            count = atom.implicit_h
+            self.touchAtom(atom)
+            atom.implicit_h = 0
+            for _ in xrange(count):
+                self.addAtom(Atom(HYDROGEN), atom, 1)
+        self.implicitHydrogens = False
+
+    def addHydrogen(self, targetAtom):
+        """
+        Attaches one hydrogen to targetAtom, the way this molecule stores
+        hydrogens.
+        targetAtom :: Atom.
+        return :: Atom or None. The new hydrogen atom, if one was made.
+        """
+        if self.implicitHydrogens:
+            self.touchAtom(targetAtom)
+            targetAtom.implicit_h += 1
+            return None
+        H = Atom(HYDROGEN)
+        self.addAtom(H, targetAtom, 1)
+        return H
+
+    def removeHydrogen(self, targetAtom):
+        """
+        Takes one hydrogen off targetAtom, using up implicit hydrogens first.
+        targetAtom :: Atom.
+
+        Throws error if targetAtom has no hydrogens.
+        """
+        if targetAtom.implicit_h > 0:
+            self.touchAtom(targetAtom)
+            targetAtom.implicit_h -= 1
+        else:
+            self.removeAtom(targetAtom.selectNeighborWithElement('H'))
+
     def countElement(self, element):
         """
         Counts the occurrences of `element` in this molecule's atoms.
+        Implicit hydrogens count as hydrogen. See elementCounts.
         element :: str. Case matters.
         return :: int.
         """
-        out = 0
-        for atom in self.atoms:
-            if atom.element == element:
-                out += 1
-        return out
+        return self.elementCounts().get(element, 0)
 
     def removeBond(self, atom1, atom2):
         """
@@ -197,10 +673,132 @@ class Molecule(object):
         Return a version of this molecule in which explicit hydrogens have 
         been added to all molecules for which we can infer the number to add.
         """
-        output = copy.deepcopy(self)
+        output, _ = self.clone()
         output.addHydrogens()
         return output
 
+    def clone(self):
+        """
+        Copies this molecule in a single pass over its atoms. Bonds and
+        stereo references are re-pointed at the new atoms.
+        Much cheaper than copy.deepcopy, which also walks every dict and
+        scratch field reachable from each atom.
+
+        return :: (Molecule, {Atom: Atom}). The copy, and a map from each
+            atom of this molecule to its counterpart in the copy.
+        """
+        atomMap = {}
+        for atom in self.atoms:
+            atomMap[atom] = atom.copy()
+        toLink = list(self.atoms)
+
+        def remap(atom):
+            # Atoms referenced from outside self.atoms (e.g. the H still
+            # bonded to a copied HYDROXYL_OXYGEN) get copied as well, just
+            # like copy.deepcopy would have done.
+            if atom is None:
+                return None
+            if atom not in atomMap:
+                atomMap[atom] = atom.copy()
+                toLink.append(atom)
+            return atomMap[atom]
+
+        i = 0
+        while i < len(toLink):
+            old = toLink[i]
+            new = atomMap[old]
+            new.neighbors = dict((remap(neighbor), bondOrder)
+                                 for neighbor, bondOrder
+                                 in old.neighbors.iteritems())
+            if old._stereo is not None:
+                new._stereo = old._stereo.remapped(remap)
+            i += 1
+
+        output = Molecule.__new__(Molecule)
+        ## Molecule-level tags (e.g. oneEqvAdded) carry over as-is, but an
+        ## open edit journal stays with this molecule.
+        for key, value in self.__dict__.iteritems():
+            if key not in INTERNAL_FIELDS:
+                output.__dict__[key] = value
+        output.atoms = [atomMap[atom] for atom in self.atoms]
+        if self._groups is not None:
+            ## Carry the functional-group index over instead of rebuilding it.
+            output._groups = (dict(
+                (kind, set(atomMap[atom] for atom in group))
+                for kind, group in self._refreshGroups().iteritems()), set())
+        if self._counts is not None:
+            output._counts = (self.elementCounts(), set())
+        memo = self._memo
+        if memo is not None and memo[0] == self.version:
+            output._memo = (output.version, memo[1])
+        return output, atomMap
+
+
+class _Stereo(object):
+    """
+    The stereochemistry fields of an Atom, kept together in one record so
+    that the many atoms without any stereochemistry don't carry them.
+    Only ever reached through the Atom properties of the same names.
+    """
+    __slots__ = ('is_chiral', 'chiralA', 'chiralB', 'chiralC', 'chiralD',
+                 'is_cistrans', 'CTotherC', 'CTa', 'CTb')
+
+    def __init__(self):
+        self.is_chiral = False
+        self.chiralA = None
+        self.chiralB = None
+        self.chiralC = None
+        self.chiralD = None
+        self.is_cistrans = False
+        self.CTotherC = None
+        self.CTa = None
+        self.CTb = None
+
+    def isEmpty(self):
+        "return :: bool. Whether every field is back to its default."
+        return not self.is_chiral and not self.is_cistrans and \
+            self.chiralA is None and self.chiralB is None and \
+            self.chiralC is None and self.chiralD is None and \
+            self.CTotherC is None and self.CTa is None and self.CTb is None
+
+    def remapped(self, remap):
+        """
+        Returns a copy of this record with every atom passed through remap.
+        remap :: Atom or None -> Atom or None.
+        return :: _Stereo.
+        """
+        output = _Stereo()
+        output.is_chiral = self.is_chiral
+        output.chiralA = remap(self.chiralA)
+        output.chiralB = remap(self.chiralB)
+        output.chiralC = remap(self.chiralC)
+        output.chiralD = remap(self.chiralD)
+        output.is_cistrans = self.is_cistrans
+        output.CTotherC = remap(self.CTotherC)
+        output.CTa = remap(self.CTa)
+        output.CTb = remap(self.CTb)
+        return output
+
+
+def _stereoField(name, default):
+    "Makes an Atom property that reads and writes the atom's _Stereo record."
+    def get(self):
+        if self._stereo is None:
+            return default
+        return getattr(self._stereo, name)
+    def set(self, value):
+        if self._stereo is None:
+            if value == default:
+                return
+            self._stereo = _Stereo()
+        setattr(self._stereo, name, value)
+        # Stereo edits don't go through the molecule, so tell it here.
+        if self._molecule is not None:
+            molecule = self._molecule()
+            if molecule is not None:
+                molecule.version += 1
+    return property(get, set)
+
 
 class Atom(object):
     """
@@ -209,23 +807,89 @@ class Atom(object):
         self.element :: str.
         self.charge :: int.
         self.neighbors :: {Atom, int}. This atom's neighbors; int -> bond order.
+        self.is_aromatic :: bool.
+        self.isotope :: int or None.
+        self.chirality :: Chirality or None. Parse-time record, see toMolecule.
+        self.hcount :: int or None. Hydrogen count from a bracket atom.
+        self.implicit_h :: int. Hydrogens carried as a count, not as atoms.
+        self.tags :: {str: object} or None. Sparse map of optional tags,
+            such as the atom class `clss`.
 
-    Refer to moleculeToSmiles for these attributes; **ignore** them otherwise.
-        self.flag :: int.
-        self.rflag :: [(int, Atom)].
-        self.nRead :: int.
-        self.parent_atom :: 0 or Atom.
-        self.nonHNeighbors = [Atom].
+    Atoms are slotted to keep them small. The stereochemistry fields
+    (is_chiral, chiralA-D, is_cistrans, CTotherC, CTa, CTb) read and write
+    a shared-shape _Stereo record which only exists for atoms that have
+    some stereochemistry. Traversal scratch state belongs to whoever is
+    traversing (see toSmiles), never to the atom.
+
+    Each atom keeps a weak reference to the molecule that last took it in
+    (_molecule), so that stereo edits made on the atom itself still bump
+    that molecule's version. Molecules that share atoms with it (such as
+    the one splice took them from) aren't told.
     """
 
-    def sort_by(self):
-        stuff = [str(k) + str(v) for k,v in self.neighbors.iteritems()]
-        list.sort(stuff)
-        return str(self) + str(stuff)
+    __slots__ = ('element', 'charge', 'neighbors', 'is_aromatic', 'isotope',
+                 'chirality', 'hcount', 'implicit_h', '_stereo', 'tags',
+                 '_molecule')
+
+    is_chiral = _stereoField('is_chiral', False)
+    chiralA = _stereoField('chiralA', None)
+    chiralB = _stereoField('chiralB', None)
+    chiralC = _stereoField('chiralC', None)
+    chiralD = _stereoField('chiralD', None)
+    is_cistrans = _stereoField('is_cistrans', False)
+    CTotherC = _stereoField('CTotherC', None)
+    CTa = _stereoField('CTa', None)
+    CTb = _stereoField('CTb', None)
+
+    def _getClss(self):
+        if self.tags is None or 'clss' not in self.tags:
+            raise AttributeError("clss")
+        return self.tags['clss']
+
+    def _setClss(self, clss):
+        if self.tags is None:
+            self.tags = {}
+        self.tags['clss'] = clss
+
+    clss = property(_getClss, _setClss)
 
     def neighborElements(self):
-        # :: set of strings
-        return set([atom.element for atom in self.neighbors])
+        # :: set of strings. Includes 'H' for implicit hydrogens.
+        out = set([atom.element for atom in self.neighbors])
+        if self.implicit_h > 0:
+            out.add('H')
+        return out
+
+    def neighborCount(self):
+        """
+        Counts this atom's neighbors, implicit hydrogens included, so the
+        answer doesn't depend on how the molecule stores its hydrogens.
+
+        return :: int.
+        """
+        return len(self.neighbors) + self.implicit_h
+
+    def hydrogenCount(self):
+        """
+        Counts the hydrogens on this atom, explicit and implicit.
+
+        return :: int.
+        """
+        out = self.implicit_h
+        for atom in self.neighbors:
+            if atom.element == 'H':
+                out += 1
+        return out
+
+    def isPlainHydrogen(self):
+        """
+        Whether this is an ordinary hydrogen atom, which a molecule in
+        implicit-hydrogen mode would carry as a count instead.
+
+        return :: bool.
+        """
+        return self.element == 'H' and self.isotope is None and \
+            not self.charge and not self.tags
 
     def selectNeighborWithElement(self, element):
         # element :: string
@@ -257,7 +921,7 @@ class Atom(object):
         # oxonium cation is [OH3+] and the cobalt III cation (Co3+) is either
         # [Co+3] or [Co+++].
 
-        ## ALL MOLECULES SHOULD HAVE HYDROGENS EXPLICITLY ATTACHED AS ATOMS
+        ## HYDROGENS ARE EXPLICIT ATOMS, EXCEPT THOSE COUNTED IN implicit_h
 
         output = self.element
 
@@ -286,9 +950,12 @@ class Atom(object):
                 output += 'H'
 
         ## Hydrogens
-        ## Since we represent hydrogens explicitly, as atoms OUTSIDE of this
-        ## bracket structure -- which is valid -- we would never need to put
-        ## them here.
+        ## Explicit hydrogens are atoms OUTSIDE of this bracket structure --
+        ## which is valid. Only implicit hydrogens need to be put here.
+        if self.implicit_h == 1:
+            output += 'H'
+        elif self.implicit_h > 1:
+            output += 'H' + str(self.implicit_h)
 
         ## Charge
         if self.charge != 0 and self.charge is not None:
@@ -296,7 +963,7 @@ class Atom(object):
             output = output + self.charge_string()
 
         ## Class
-        if hasattr(self, 'clss'):
+        if self.tags is not None and 'clss' in self.tags:
             brackets = True
             assert isinstance(self.clss, int)
             output += ':' + str(self.clss)
@@ -332,30 +999,35 @@ class Atom(object):
         self.charge = 0
         self.neighbors = dict()
 
-        # Temporary values which should only be meaningful within smiles()
-        # and subsmiles(), for traversing.
-        self.flag = 0
-        #for ring-finding
-        self.rflag = [] #empty if not part of a ring bond
-        self.n_read = 0 #neighbors already read
-        self.parent_atom = 0 #atom right before this one
-        self.non_h_neighbors = []
-
         self.is_aromatic = False
         self.isotope = None
         self.chirality = None
         self.hcount = None
+        self.implicit_h = 0 # hydrogens carried as a count, not as atoms
 
-        self.is_chiral = False
-        self.chiralA = None
-        self.chiralB = None
-        self.chiralC = None
-        self.chiralD = None
+        self._stereo = None # see _Stereo
+        self.tags = None
+        self._molecule = None # weakref.ref to a Molecule, see Molecule.atoms
 
-        self.is_cistrans = False
-        self.CTotherC = None
-        self.CTa = None
-        self.CTb = None
+    def copy(self):
+        """
+        Returns a copy of this atom's own properties, with no bonds and no
+        stereo references. See Molecule.clone for copying whole molecules.
+        The parse-time chirality record is shared, since it is only read
+        once parsing is over.
+
+        return :: Atom.
+        """
+        output = Atom(self.element)
+        output.charge = self.charge
+        output.is_aromatic = self.is_aromatic
+        output.isotope = self.isotope
+        output.chirality = self.chirality
+        output.hcount = self.hcount
+        output.implicit_h = self.implicit_h
+        if self.tags is not None:
+            output.tags = dict(self.tags)
+        return output
 
     def newChiralCenter(self, reference, clockwiseList):
         """
@@ -383,8 +1055,11 @@ class Atom(object):
                 raise StandardError("%s atom is not chiral" % (str(self)))
         if reference is None:
             hydrogens = [atom for atom in self.neighbors if atom.element == 'H']
-            assert len(hydrogens) > 0, "No hydrogen connected to this atom"
-            reference = hydrogens[0]
+            if len(hydrogens) > 0:
+                reference = hydrogens[0]
+            else:
+                ## An implicit hydrogen sits in the chiral slot holding None.
+                assert self.implicit_h > 0, "No hydrogen connected to this atom"
         if reference is self.chiralA:
             return [self.chiralB, self.chiralC, self.chiralD]
         elif reference is self.chiralB:
@@ -495,6 +1170,8 @@ class Atom(object):
         self.chiralC = None
         self.chiralD = None
         self.is_chiral = False
+        if self._stereo is not None and self._stereo.isEmpty():
+            self._stereo = None
 
     def eliminateCT(self):
         """
@@ -507,6 +1184,8 @@ class Atom(object):
         self.CTa = None
         self.CTb = None
         self.is_cistrans = False
+        if self._stereo is not None and self._stereo.isEmpty():
+            self._stereo = None
 
     def totalBondOrder(self):
         """
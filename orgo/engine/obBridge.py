@@ -0,0 +1,203 @@
+"""
+obBridge.py
+Converts between OpenBabel's OBMol and our Molecule directly, atom by atom
+and bond by bond, so neither side has to write SMILES for the other to
+parse again.
+
+Stereochemistry isn't carried across. readSmiles turns down SMILES with
+chirality or cis-trans marks, and toOBMol turns down molecules with
+stereocenters, so callers go through SMILES text for those. toOBMol also
+turns down aromatic molecules, which OpenBabel would have to kekulize
+before drawing.
+
+Written against the OpenBabel 2 Python bindings (python-openbabel, see the
+Aptfile), using OpenBabel 3's names where they differ.
+
+Public-facing:
+    `readSmiles`, `fromOBMol`, `toOBMol`
+"""
+
+from collections import deque
+import threading
+
+try:
+    import openbabel
+except ImportError:
+    openbabel = None
+
+from molecularStructure import Molecule, Atom
+from toSmiles import MAX_VALENCE
+
+## As toMolecule has it.
+AROMATIC_BOND = 1.5
+
+## Characters that only appear in SMILES with stereochemistry.
+STEREO_MARKS = ('@', '/', '\\')
+
+# Each thread's SMILES reader; OBConversion keeps state between calls.
+_local = threading.local()
+
+
+def readSmiles(smiles):
+    """
+    Reads smiles with OpenBabel and converts the result straight into
+    Molecules, without writing canonical SMILES or running our parser.
+    smiles :: str.
+    return :: [Molecule] or None. None if OpenBabel isn't installed, can't
+        read smiles, or smiles has stereochemistry.
+    """
+    if openbabel is None or any(mark in smiles for mark in STEREO_MARKS):
+        return None
+    obmol = openbabel.OBMol()
+    if not _reader().ReadString(obmol, str(smiles)) or obmol.NumAtoms() == 0:
+        return None
+    return fromOBMol(obmol)
+
+
+def fromOBMol(obmol):
+    """
+    obmol :: openbabel.OBMol.
+    return :: [Molecule]. One per connected part, with hydrogens added as
+        atoms and hcount set where a SMILES string would need brackets,
+        just as toMolecule makes them.
+    """
+    atoms = {} # OpenBabel's atom index -> Atom
+    hydrogens = {} # Atom -> OpenBabel's implicit hydrogen count
+    order = []
+    for obatom in openbabel.OBMolAtomIter(obmol):
+        atom = Atom(_symbol(obatom.GetAtomicNum()))
+        atom.charge = obatom.GetFormalCharge()
+        if obatom.GetIsotope():
+            atom.isotope = obatom.GetIsotope()
+        atom.is_aromatic = bool(obatom.IsAromatic())
+        atoms[obatom.GetIdx()] = atom
+        hydrogens[atom] = _implicitHydrogens(obatom)
+        order.append(atom)
+
+    bonds = dict((atom, []) for atom in order)
+    for obbond in openbabel.OBMolBondIter(obmol):
+        atom1 = atoms[obbond.GetBeginAtomIdx()]
+        atom2 = atoms[obbond.GetEndAtomIdx()]
+        if obbond.IsAromatic():
+            bondOrder = AROMATIC_BOND
+        else:
+            bondOrder = obbond.GetBondOrder()
+        bonds[atom1].append((atom2, bondOrder))
+        bonds[atom2].append((atom1, bondOrder))
+
+    ## Breadth-first through each part, so every atom is added next to one
+    ## that is already in the molecule.
+    output = []
+    placed = set()
+    for start in order:
+        if start in placed:
+            continue
+        placed.add(start)
+        molecule = Molecule(start)
+        queue = deque([start])
+        while queue:
+            atom = queue.popleft()
+            for neighbor, bondOrder in bonds[atom]:
+                if neighbor not in placed:
+                    placed.add(neighbor)
+                    molecule.addAtom(neighbor, atom, bondOrder)
+                    queue.append(neighbor)
+                elif neighbor not in atom.neighbors:
+                    molecule.addBond(atom, neighbor, bondOrder)
+        for atom in molecule.atoms:
+            atom.hcount = _hcount(atom, hydrogens[atom])
+        molecule.addHydrogens()
+        output.append(molecule)
+    return output
+
+
+def toOBMol(molecule):
+    """
+    molecule :: Molecule or [Molecule].
+    return :: openbabel.OBMol or None. None if OpenBabel isn't installed, or
+        if any atom is aromatic or a stereocenter.
+    """
+    if openbabel is None:
+        return None
+    molecules = molecule if isinstance(molecule, list) else [molecule]
+    atoms = [atom for molecule in molecules for atom in molecule.atoms]
+    for atom in atoms:
+        if atom.is_aromatic or atom.is_chiral or atom.is_cistrans:
+            return None
+
+    obmol = openbabel.OBMol()
+    obmol.BeginModify()
+    indices = {}
+    for atom in atoms:
+        obatom = obmol.NewAtom()
+        obatom.SetAtomicNum(_atomicNum(atom.element))
+        obatom.SetFormalCharge(atom.charge or 0)
+        if atom.isotope is not None:
+            obatom.SetIsotope(atom.isotope)
+        indices[atom] = obatom.GetIdx()
+        ## Hydrogens carried as counts go in as atoms, and come out again
+        ## with the rest below, so OpenBabel works out the counts itself.
+        for _ in xrange(atom.implicit_h):
+            hydrogen = obmol.NewAtom()
+            hydrogen.SetAtomicNum(1)
+            obmol.AddBond(indices[atom], hydrogen.GetIdx(), 1)
+    for atom in atoms:
+        for neighbor, bondOrder in atom.neighbors.iteritems():
+            if neighbor not in indices:
+                return None # bonded to an atom none of molecules lists
+            if indices[atom] < indices[neighbor]:
+                obmol.AddBond(indices[atom], indices[neighbor], int(bondOrder))
+    obmol.EndModify()
+    obmol.DeleteHydrogens()
+    return obmol
+
+
+def _hcount(atom, implicit):
+    """
+    atom :: Atom. Bonded to all its heavy neighbors and explicit hydrogens.
+    implicit :: int. OpenBabel's count of its other hydrogens.
+    return :: int or None. The hcount toMolecule would give atom: None if
+        SMILES could leave its hydrogens unwritten, else all its hydrogens.
+    """
+    valence = sum(atom.neighbors.itervalues())
+    if atom.element in MAX_VALENCE and not atom.charge and \
+            atom.isotope is None and \
+            implicit == max(0, int(MAX_VALENCE[atom.element] - valence)):
+        return None
+    return implicit + sum(1 for neighbor in atom.neighbors
+                          if neighbor.element == 'H')
+
+
+def _implicitHydrogens(obatom):
+    try:
+        return obatom.GetImplicitHCount() # OpenBabel 3
+    except AttributeError:
+        return obatom.ImplicitHydrogenCount()
+
+
+def _symbol(atomicNum):
+    if atomicNum == 0:
+        return '*'
+    try:
+        return openbabel.etab.GetSymbol(atomicNum)
+    except AttributeError:
+        return openbabel.GetSymbol(atomicNum) # OpenBabel 3
+
+
+def _atomicNum(element):
+    if element == '*':
+        return 0
+    try:
+        return openbabel.etab.GetAtomicNum(element)
+    except AttributeError:
+        return openbabel.GetAtomicNum(element) # OpenBabel 3
+
+
+def _reader():
+    "return :: OBConversion. This thread's, set up to read SMILES."
+    try:
+        return _local.reader
+    except AttributeError:
+        _local.reader = openbabel.OBConversion()
+        _local.reader.SetInFormat("smi")
+        return _local.reader
@@ -182,39 +182,53 @@ def add_random_links(molecule):
     carbons = [i for i in molecule.atoms if i.element is 'C']
     carbons = shuffled(carbons)
 
-    def get_n_away(parent, start_carbon, n):
-        noncarbons = [i for i in start_carbon.neighbors if i.element != 'C']
-        if n == 0:
-            if len(noncarbons) > 0 and start_carbon.element == 'C':
-                return start_carbon, random.choice(noncarbons)
-            else: ## self does not have a noncarbon substituent, or is not carbon
-                return None, None
-        for next_atom in shuffled(start_carbon.neighbors):
-            if next_atom in carbons and next_atom is not parent:
-                if start_carbon.neighbors[next_atom] < 3:
-                    return get_n_away(start_carbon, next_atom, n-1)
-        return None, None
-
-    ## Add a ring at random if it is discovered to be possible
+    def chain_distances(start_carbon):
+        ## Breadth-first search along carbon chains, as far as ring_size
+        ## allows. Triple bonds can't be part of a small ring.
+        distances = {start_carbon: 0}
+        frontier = [start_carbon]
+        for distance in xrange(1, ring_size):
+            next_frontier = []
+            for atom in frontier:
+                for next_atom in atom.neighbors:
+                    if next_atom.element == 'C' and next_atom not in distances \
+                       and atom.neighbors[next_atom] < 3:
+                        distances[next_atom] = distance
+                        next_frontier.append(next_atom)
+            frontier = next_frontier
+        return distances
+
+    ## Add a ring at random if it is discovered to be possible.
+    ## Closing a bond to a carbon whose shortest path is ring_size - 1 bonds
+    ## away makes a ring of exactly ring_size, never a smaller one.
+    def substituents(carbon):
+        ## Noncarbons that hang off carbon alone (not an ether O or amine N
+        ## in the chain), so that removing one can't split the molecule.
+        return [i for i in carbon.neighbors if i.element != 'C' and
+                all(j is carbon or j.element == 'H' for j in i.neighbors)]
+
     if len(carbons) > 4:
         for start_carbon in carbons:
-            noncarbons = [i for i in start_carbon.neighbors if i.element != 'C']
+            noncarbons = substituents(start_carbon)
             if len(noncarbons) <= 0:
                 continue
-            start_noncarbon = random.choice(noncarbons)
-            for next_atom in shuffled(start_carbon.neighbors):
-                if next_atom in carbons:
-                    if start_carbon.neighbors[next_atom] < 3:
-                        result_carbon, result_noncarbon = get_n_away(start_carbon, next_atom, ring_size-2)
-                        if result_carbon == None:
-                            return
-                        else:
-                            ## delete a random noncarbon substituent from each atom
-                            molecule.removeAtom(start_noncarbon)
-                            molecule.removeAtom(result_noncarbon)
-                            ## make a bond between the two atoms
-                            molecule.addBond(start_carbon, result_carbon, 1)
-                            return
+            distances = chain_distances(start_carbon)
+            ends = [i for i in distances if distances[i] == ring_size - 1 and
+                    substituents(i)]
+            if len(ends) == 0:
+                continue
+            result_carbon = random.choice(ends)
+            result_noncarbon = random.choice(substituents(result_carbon))
+            ## delete a random noncarbon substituent from each atom, along
+            ## with any hydrogens on it (e.g. the H of an OH)
+            for substituent in (random.choice(noncarbons), result_noncarbon):
+                for hydrogen in [i for i in substituent.neighbors
+                                 if i.element == 'H']:
+                    molecule.removeAtom(hydrogen)
+                molecule.removeAtom(substituent)
+            ## make a bond between the two atoms
+            molecule.addBond(start_carbon, result_carbon, 1)
+            return
 
 def add_random_chirality(molecule):
     """
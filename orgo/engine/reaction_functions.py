@@ -138,21 +138,32 @@ chlorinate_it = lambda x: rxns.halogenate(x, "Cl")
 
 epoxidate_it = rxns.epoxidate
 
-acidhydrate_it = lambda x: rxns.acidhydrate(x, molec("O"), False)
-acidhydrate_it_hgso4 = lambda x: rxns.acidhydrate(x, molec("O"), True)
-acidhydrate_it_ethanol = lambda x: rxns.acidhydrate(x, molec("CCO"), False)
-acidhydrate_it_hgso4_ethanol = lambda x: rxns.acidhydrate(x, molec("CCO"), True)
+def reagent(smiles, molecules):
+    """
+    Parses a reagent in the same hydrogen mode as the molecules it will
+    react with, so that products don't mix the two modes.
+    smiles :: str.
+    molecules :: [Molecule]. The substrates.
+    return :: [Molecule].
+    """
+    implicit = any(molecule.implicitHydrogens for molecule in molecules)
+    return molec(smiles, implicitHydrogens=implicit)
+
+acidhydrate_it = lambda x: rxns.acidhydrate(x, reagent("O", x), False)
+acidhydrate_it_hgso4 = lambda x: rxns.acidhydrate(x, reagent("O", x), True)
+acidhydrate_it_ethanol = lambda x: rxns.acidhydrate(x, reagent("CCO", x), False)
+acidhydrate_it_hgso4_ethanol = lambda x: rxns.acidhydrate(x, reagent("CCO", x), True)
 acidhydrate_it_auto = lambda x: rxns.acidhydrate(x, x, False)
 acidhydrate_it_hgso4_auto = lambda x: rxns.acidhydrate(x, x, True)
 
-bromohydrate_it_water = lambda x: rxns.halohydrate(x, molec("O"), "Br")
-bromohydrate_it_ethanol = lambda x: rxns.halohydrate(x, molec("CCO"), "Br")
+bromohydrate_it_water = lambda x: rxns.halohydrate(x, reagent("O", x), "Br")
+bromohydrate_it_ethanol = lambda x: rxns.halohydrate(x, reagent("CCO", x), "Br")
 bromohydrate_it_auto = lambda x: rxns.halohydrate(x, x, "Br")
-iodohydrate_it_water = lambda x: rxns.halohydrate(x, molec("O"), "I")
-iodohydrate_it_ethanol = lambda x: rxns.halohydrate(x, molec("CCO"), "I")
+iodohydrate_it_water = lambda x: rxns.halohydrate(x, reagent("O", x), "I")
+iodohydrate_it_ethanol = lambda x: rxns.halohydrate(x, reagent("CCO", x), "I")
 iodohydrate_it_auto = lambda x: rxns.halohydrate(x, x, "I")
-chlorohydrate_it_water = lambda x: rxns.halohydrate(x, molec("O"), "Cl")
-chlorohydrate_it_ethanol = lambda x: rxns.halohydrate(x, molec("CCO"), "Cl")
+chlorohydrate_it_water = lambda x: rxns.halohydrate(x, reagent("O", x), "Cl")
+chlorohydrate_it_ethanol = lambda x: rxns.halohydrate(x, reagent("CCO", x), "Cl")
 chlorohydrate_it_auto = lambda x: rxns.halohydrate(x, x, "Cl")
 
 hydroborate_oxidate_it = rxns.hydroborate
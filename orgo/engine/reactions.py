@@ -14,7 +14,7 @@ def removeDuplicates(moleculeList):
         return [moleculeList]
     if len(moleculeList) == 0:
         return []
-    return reduceChirality(removeDuplicatesAt(tautomerize(copy.deepcopy(moleculeList)), 0))
+    return reduceChirality(removeDuplicatesAt(tautomerize(cloneMolecules(moleculeList)), 0))
 
 
 def removeDuplicatesAt(moleculeList, ind):
@@ -22,7 +22,7 @@ def removeDuplicatesAt(moleculeList, ind):
         return moleculeList
     a = moleculeList[ind]
     for i in range(ind+1, len(moleculeList)):
-        if a == moleculeList[i] or moleculeCompare(a, moleculeList[i]):
+        if a == moleculeList[i] or moleculeSame(a, moleculeList[i]):
             del moleculeList[ind]
             return removeDuplicatesAt(moleculeList, ind)
 
@@ -159,9 +159,7 @@ def tautomerize(moleculeList):
     def findPlace(molecule):
         if molecule == None:
             return None
-        for atom in molecule.atoms:
-            if not (atom.element == 'C'):
-                continue
+        for atom in molecule.groupAtoms('enol'):
             isAlkene = False
             alkeneCarbon = None
             #check if is alkene
@@ -173,7 +171,7 @@ def tautomerize(moleculeList):
                 continue
             #Sanity check this later
             for neighbor in atom.neighbors:
-                if neighbor.element == 'O' and atom.neighbors[neighbor] == 1 and len(list(neighbor.neighbors))==1:
+                if neighbor.element == 'O' and atom.neighbors[neighbor] == 1 and neighbor.neighborCount()==1:
                     return (atom, alkeneCarbon, neighbor)
         return None
     
@@ -413,10 +411,8 @@ def epoxidate(molecules):
         Xadd1 = Xadd2
 
         #Set bond orders to single.
-        target1.neighbors[target2] = 1
-        target2.neighbors[target1] = 1
-        Xtarget1.neighbors[Xtarget2] = 1
-        Xtarget2.neighbors[Xtarget1] = 1
+        molecule.changeBond(target1, target2, 1)
+        Xmolecule.changeBond(Xtarget1, Xtarget2, 1)
 
         bigListOfStuff = (
             (molecule, add1, target1, addtarget1, target2, target1.CTb, target1.CTa),
@@ -461,9 +457,7 @@ def tertButoxide(molecules):
     def findPlace(molecule):
         ans = [] #Used only for complete mode
         #Returns a carbon with a halogen, followed by a carbon with the most suitable H.
-        for carbon1 in molecule.atoms:
-            if carbon1.element != 'C':
-                continue
+        for carbon1 in molecule.groupAtoms('halideCarbon'):
             #Make sure carbon1 isn't part of a double bond or ketone.
             OK = True
             for neighbor, bo in carbon1.neighbors.items():
@@ -482,7 +476,7 @@ def tertButoxide(molecules):
             #considered yet.
             neighborCs = [neighbor for neighbor in carbon1.neighbors.keys() if (neighbor.element == 'C'
                 and 2 not in neighbor.neighbors.values() and 3 not in neighbor.neighbors.values() and
-                len(neighbor.neighbors) <= 3)]
+                neighbor.neighborCount() <= 3)]
             if len(neighborCs) == 0:
                 continue
             #Screw it, let's just try all of them.  Whee, itertools!
@@ -492,9 +486,19 @@ def tertButoxide(molecules):
     
     def reactAtPlace(molecule, bigListOfPlaces):
         candidates = []
-        for things in bigListOfPlaces:
-            #Clone inputs, get on with it.
-            Xmolecule, (ClCarbon, HCarbon, Cl) = listClone(molecule, things)
+        #The input may be shared (a cached or constant molecule), so edit a
+        #private copy of it instead.
+        molecule, atomMap = molecule.clone()
+
+        def keep(c1, c2):
+            #Copy the edited molecule out as a product.
+            Xmolecule, (Xc1, Xc2) = listClone(molecule, (c1, c2))
+            candidates.append((Xmolecule, Xc1, Xc2))
+
+        for ClCarbon, HCarbon, Cl in bigListOfPlaces:
+            ClCarbon, HCarbon, Cl = atomMap[ClCarbon], atomMap[HCarbon], atomMap[Cl]
+            #Edit the copy in place, keep a copy of each product, then roll
+            #back.  Rejected places never cost a copy.
             #Test for epoxides.  We don't deal with epoxides for now.  In reality, attacking an epoxide
             #with KO-tBu results in addition and creation of an ether.
             stop = False
@@ -503,114 +507,117 @@ def tertButoxide(molecules):
                     stop = True
             if stop:
                 continue
-            #Test for chirality.
-            if HCarbon.is_chiral and ClCarbon.is_chiral:
-                #Chiral.  We need to consider anti-periplanar.
-                #Looking down from the Cl to the other carbon,
-                ClsubA, ClsubB = ClCarbon.chiralRingList(Cl, HCarbon)
-                #Looking up from the H to the first carbon,
-                HsubB, HsubA = HCarbon.chiralRingList(None, ClCarbon)
-                #Rings?
-                ringList = isInRing(ClCarbon, HCarbon)
-                if ringList != None:
-                    #The ring carbons must be cis.
-                    #ringList: [HCarbon, ..., ClCarbon]
-                    if (ClsubA == ringList[-2] and HsubB == ringList[1]) or\
-                       (ClsubB == ringList[-2] and HsubA == ringList[1]):
-                        pass
-                    else:
-                        continue
-                #Remove chirality, remove XCl, change bond order
-                ClCarbon.eliminateChiral()
-                HCarbon.eliminateChiral()
-                Xmolecule.removeAtom(Cl)
-                Xmolecule.changeBond(ClCarbon, HCarbon, 2)
-                #Add CTstereo
-                try:
-                    ClCarbon.newCTCenter(HCarbon, ClsubA, ClsubB)
-                    HCarbon.newCTCenter(ClCarbon, HsubA, HsubB)
-                except AlleneError:
-                    print "Allene error in chiral"
-                    continue
-                candidates.append((Xmolecule, HCarbon, ClCarbon))
-            else:
-                #No chirality.
-                #May as well set up the double bond now.
-                ClCarbon.eliminateChiral()
-                HCarbon.eliminateChiral()
-                Xmolecule.removeAtom(Cl)
-                Xmolecule.changeBond(ClCarbon, HCarbon, 2)
-                #Rings?
-                ringList = isInRing(ClCarbon, HCarbon)
-                if ringList != None:
-                    #Make rings cis.
-                    ClsubA = ringList[-2]
-                    ClsubB = None
-                    for neighbor in ClCarbon.neighbors:
-                        if neighbor != ClsubA and neighbor != HCarbon:
-                            ClsubB = neighbor
-                    HsubB = ringList[1]
-                    HsubA = None
-                    for neighbor in HCarbon.neighbors:
-                        if neighbor != HsubB and neighbor != ClCarbon:
-                            HsubA = neighbor
+            molecule.begin()
+            try:
+                molecule.touchAtom(ClCarbon)
+                molecule.touchAtom(HCarbon)
+                #Test for chirality.
+                if HCarbon.is_chiral and ClCarbon.is_chiral:
+                    #Chiral.  We need to consider anti-periplanar.
+                    #Looking down from the Cl to the other carbon,
+                    ClsubA, ClsubB = ClCarbon.chiralRingList(Cl, HCarbon)
+                    #Looking up from the H to the first carbon,
+                    HsubB, HsubA = HCarbon.chiralRingList(None, ClCarbon)
+                    #Rings?
+                    ringList = isInRing(ClCarbon, HCarbon, molecule)
+                    if ringList != None:
+                        #The ring carbons must be cis.
+                        #ringList: [HCarbon, ..., ClCarbon]
+                        if (ClsubA == ringList[-2] and HsubB == ringList[1]) or\
+                           (ClsubB == ringList[-2] and HsubA == ringList[1]):
+                            pass
+                        else:
+                            continue
+                    #Remove chirality, remove XCl, change bond order
+                    ClCarbon.eliminateChiral()
+                    HCarbon.eliminateChiral()
+                    molecule.removeAtom(Cl)
+                    molecule.changeBond(ClCarbon, HCarbon, 2)
+                    #Add CTstereo
                     try:
                         ClCarbon.newCTCenter(HCarbon, ClsubA, ClsubB)
                         HCarbon.newCTCenter(ClCarbon, HsubA, HsubB)
                     except AlleneError:
-                        print "Allene error in ring, no chiral"
+                        print "Allene error in chiral"
                         continue
-                    candidates.append((Xmolecule, HCarbon, ClCarbon))
+                    keep(HCarbon, ClCarbon)
                 else:
-                    #No rings.  Make both cases.
-                    Clsubs = []
-                    for neighbor in ClCarbon.neighbors:
-                        if neighbor != HCarbon:
-                            Clsubs.append(neighbor)
-                    while len(Clsubs) < 2:
-                        Clsubs.append(None)
-                    Hsubs = []
-                    for neighbor in HCarbon.neighbors:
-                        if neighbor != ClCarbon:
-                            Hsubs.append(neighbor)
-                    while len(Hsubs) < 2:
-                        Hsubs.append(None)
-                    Clsubs2 = [[],[]]
-                    Hsubs2 = [[],[]]
-                    #Does each carbon have exactly one other substituent?  If so, cis/trans stereochem
-                    #becomes important.
-                    if len(ClCarbon.neighbors) == 2 and len(HCarbon.neighbors) == 2:
-                        #Return only the trans molecule.
+                    #No chirality.
+                    #May as well set up the double bond now.
+                    ClCarbon.eliminateChiral()
+                    HCarbon.eliminateChiral()
+                    molecule.removeAtom(Cl)
+                    molecule.changeBond(ClCarbon, HCarbon, 2)
+                    #Rings?
+                    ringList = isInRing(ClCarbon, HCarbon, molecule)
+                    if ringList != None:
+                        #Make rings cis.
+                        ClsubA = ringList[-2]
+                        ClsubB = None
+                        for neighbor in ClCarbon.neighbors:
+                            if neighbor != ClsubA and neighbor != HCarbon:
+                                ClsubB = neighbor
+                        HsubB = ringList[1]
+                        HsubA = None
+                        for neighbor in HCarbon.neighbors:
+                            if neighbor != HsubB and neighbor != ClCarbon:
+                                HsubA = neighbor
                         try:
-                            ClCarbon.newCTCenter(HCarbon, Clsubs[0], Clsubs[1])
-                            HCarbon.newCTCenter(ClCarbon, Hsubs[0], Hsubs[1])
+                            ClCarbon.newCTCenter(HCarbon, ClsubA, ClsubB)
+                            HCarbon.newCTCenter(ClCarbon, HsubA, HsubB)
                         except AlleneError:
-                            print "Allene error in noring"
+                            print "Allene error in ring, no chiral"
                             continue
-                        candidates.append((Xmolecule, HCarbon, ClCarbon))
+                        keep(HCarbon, ClCarbon)
                     else:
-                        Xmolecule2, (ClCarbon2, HCarbon2, Clsubs2[0], Clsubs2[1], Hsubs2[0], Hsubs2[1]) = listClone(Xmolecule, (ClCarbon, HCarbon, Clsubs[0], Clsubs[1], Hsubs[0], Hsubs[1]))
-                        try:
-                            ClCarbon.newCTCenter(HCarbon, Clsubs[0], Clsubs[1])
-                            HCarbon.newCTCenter(ClCarbon, Hsubs[0], Hsubs[1])
-                            candidates.append((Xmolecule, HCarbon, ClCarbon))
-                        except AlleneError:
-                            print "Allene error in noringc/t"
-                        try:
-                            ClCarbon2.newCTCenter(HCarbon2, Clsubs2[1], Clsubs2[0])
-                            HCarbon2.newCTCenter(ClCarbon2, Hsubs2[0], Hsubs2[1])
-                            candidates.append((Xmolecule2, HCarbon2, ClCarbon2))
-                        except AlleneError:
-                            print "Allene error in noringc/t"
+                        #No rings.  Make both cases.
+                        Clsubs = []
+                        for neighbor in ClCarbon.neighbors:
+                            if neighbor != HCarbon:
+                                Clsubs.append(neighbor)
+                        while len(Clsubs) < 2:
+                            Clsubs.append(None)
+                        Hsubs = []
+                        for neighbor in HCarbon.neighbors:
+                            if neighbor != ClCarbon:
+                                Hsubs.append(neighbor)
+                        while len(Hsubs) < 2:
+                            Hsubs.append(None)
+                        #Does each carbon have exactly one other substituent?  If so, cis/trans stereochem
+                        #becomes important.
+                        if ClCarbon.neighborCount() == 2 and HCarbon.neighborCount() == 2:
+                            #Return only the trans molecule.
+                            try:
+                                ClCarbon.newCTCenter(HCarbon, Clsubs[0], Clsubs[1])
+                                HCarbon.newCTCenter(ClCarbon, Hsubs[0], Hsubs[1])
+                            except AlleneError:
+                                print "Allene error in noring"
+                                continue
+                            keep(HCarbon, ClCarbon)
+                        else:
+                            for ClOrder in ((0, 1), (1, 0)):
+                                molecule.begin()
+                                try:
+                                    molecule.touchAtom(ClCarbon)
+                                    molecule.touchAtom(HCarbon)
+                                    ClCarbon.newCTCenter(HCarbon, Clsubs[ClOrder[0]], Clsubs[ClOrder[1]])
+                                    HCarbon.newCTCenter(ClCarbon, Hsubs[0], Hsubs[1])
+                                    keep(HCarbon, ClCarbon)
+                                except AlleneError:
+                                    print "Allene error in noringc/t"
+                                finally:
+                                    molecule.rollback()
+            finally:
+                molecule.rollback()
 
         #Now, prune the products
         #Find the most substituted products, and keep only those.
         maxSub = 0
         for Xmolecule, c1, c2 in candidates:
-            maxSub = max(maxSub, len(c1.neighbors)+len(c2.neighbors))
+            maxSub = max(maxSub, c1.neighborCount()+c2.neighborCount())
         maxSubCandidates = []
         for Xmolecule, c1, c2 in candidates:
-            if len(c1.neighbors)+len(c2.neighbors) == maxSub:
+            if c1.neighborCount()+c2.neighborCount() == maxSub:
                 maxSubCandidates.append(Xmolecule)
         if debug:
             print maxSubCandidates
@@ -653,14 +660,14 @@ def tertButoxide(molecules):
     
     
 def listClone(molecule, atomList):
-    #Returns properly-connected deepcopies of molecule and list of atoms.
-    Xmolecule = copy.deepcopy(molecule)
+    #Returns a clone of molecule, and the clone's counterparts of atomList.
+    Xmolecule, atomMap = molecule.clone()
     newAtomList = []
     for atom in atomList:
         if atom == None:
             newAtomList.append(None)
         else:
-            newAtomList.append(Xmolecule.atoms[molecule.atoms.index(atom)])
+            newAtomList.append(atomMap[atom])
     return Xmolecule, newAtomList
 
 
@@ -710,7 +717,7 @@ def acidhydrate(molecules, others, alkynesOk = False):
             if debug:
                 print "Case 2: alkyne in acidhydrate"
             
-            if len(list(place2.neighbors)) == 0: #if adding water:
+            if place2.neighborCount() == 0: #if adding water:
                 if debug:
                     print "Case 3: ...with water"
                 #Going to need to write a custom function here, borrowed from allTripleAdd.
@@ -726,7 +733,7 @@ def acidhydrate(molecules, others, alkynesOk = False):
                 return newMolecules
 
                 
-            elif len(list(place2.neighbors)) == 1: #if is alcohol:
+            elif place2.neighborCount() == 1: #if is alcohol:
                 if debug:
                     print "Case 4: ...with alcohol"
                 #Not sure if chemically correct - FS.  Definitely not supposed to be
@@ -744,7 +751,7 @@ def acidhydrate(molecules, others, alkynesOk = False):
         
         
         
-    return twoReact(copy.deepcopy(molecules), copy.deepcopy(others), findPlaces1, findPlaces2, reactAtPlaces)
+    return twoReact(cloneMolecules(molecules), cloneMolecules(others), findPlaces1, findPlaces2, reactAtPlaces)
 
 
 #NOTE: findPlaces methods passed into this method MUST return lists
@@ -817,7 +824,7 @@ def halohydrate(molecules, others, halogen):
             newMolecules += antiAdd(molecule1, pairing[0], pairing[1], molecule2, atomicHalogen, place2)
         return newMolecules
         
-    return twoReact(copy.deepcopy(molecules), copy.deepcopy(others), findPlaces1, findPlaces2, reactAtPlaces)
+    return twoReact(cloneMolecules(molecules), cloneMolecules(others), findPlaces1, findPlaces2, reactAtPlaces)
 
 
 
@@ -903,15 +910,16 @@ def hydroborate2(molecules):
         
     def BtoO(molecule):
         assert type(molecule) is Molecule
-        hsToDelete = []
+        borons = []
         for atom in molecule.atoms:
             if atom.element == "B" and atom.neighborElements() == set(["H","H","C"]):
+                molecule.touchAtom(atom)
                 atom.element = "O"
-                hsToDelete.append(atom.selectNeighborWithElement("H"))
-        for h in hsToDelete:
-            molecule.removeAtom(h)
+                borons.append(atom)
+        for atom in borons:
+            molecule.removeHydrogen(atom)
         return molecule
-    newMolecules = copy.deepcopy(molecules)
+    newMolecules = cloneMolecules(molecules)
     return removeDuplicates([BtoO(molecule) for molecule in newMolecules])
 
 
@@ -960,7 +968,7 @@ def ozonolyse(molecules):
         place[1].eliminateChiral()
         #Splice the molecule
         return splice(molecule)
-    return react(copy.deepcopy(molecules), findAlkene, reactAtPlace)
+    return react(cloneMolecules(molecules), findAlkene, reactAtPlace)
 
 
 def lindlar(molecules):
@@ -1014,12 +1022,12 @@ def alkyneDeprotonate(molecules):
     def reactAtPlace(molecule, place):
         if place == None:
             return [] 
+        molecule.touchAtom(place)
         place.charge = -1
-        hToDelete = place.selectNeighborWithElement("H")
-        place.removeAtom(hToDelete)
+        molecule.removeHydrogen(place)
         return [molecule]
         
-    return react(copy.deepcopy(molecules), findPlace, reactAtPlace)
+    return react(cloneMolecules(molecules), findPlace, reactAtPlace)
 
 
 
@@ -1038,18 +1046,14 @@ def acetylideAdd(molecules, others):
     
     def findPlaces1(molecule):
         #findAlkyneCarbanions(molecule)
-        places = []
-        for atom in molecule.atoms:
-            if atom.charge == -1 and atom.element == "C" and (True in [other.neighbors[atom]==3 for other in list(atom.neighbors) if other.element == "C"]):
-                places += [atom]
-        return places
+        return molecule.groupAtoms('acetylide')
     def findPlaces2(molecule):
         #findHalogenCarbons(molecule)
         places = []
         countedOxygens = []
         for atom in molecule.atoms:
             #Primary alkyl halides
-            if atom.element == "C" and len(list(atom.neighbors))==2 and (True in [(other.element in HALOGENS) for other in list(atom.neighbors)]):
+            if atom.element == "C" and atom.neighborCount()==2 and (True in [(other.element in HALOGENS) for other in list(atom.neighbors)]):
                 places += [atom]
             #Epoxides
             if atom.element == 'C':
@@ -1069,15 +1073,11 @@ def acetylideAdd(molecules, others):
         (molecule1, place1, unused0, unused1, unused2, unused3, unused4) = duplicateInputs(molecule1, place1, place1, None, None, None, None)
         if isinstance(place2, tuple):
             #Epoxide.  I just realized that this can also be implemented with antiAdd, but oh well.
-            #Do some object acrobatics to make proper deepcopies.
-            oxIndex = molecule2.atoms.index(place2[2])
-            (molecule2, carbon, otherCarbon, unused0, unused1, unused3, unused2) = duplicateInputs(molecule2, place2[0], place2[1], None, None, None, None)
-            oxygen = molecule2.atoms[oxIndex]
+            molecule2, (carbon, otherCarbon, oxygen) = listClone(molecule2, place2)
             mkvPairs = markovnikov(carbon, otherCarbon)
             if len(mkvPairs) == 2:
-                (Xmolecule1, Xplace1, unused0, unused1, unused2, unused3, unused4) = duplicateInputs(molecule1, place1, place1, None, None, None, None)
-                (Xmolecule2, addingC, alcoholC, unused0, unused1, unused3, unused2) = duplicateInputs(molecule2, mkvPairs[1][0], mkvPairs[1][1], None, None, None, None)
-                Xoxygen = Xmolecule2.atoms[oxIndex]
+                Xmolecule1, (Xplace1,) = listClone(molecule1, [place1])
+                Xmolecule2, (addingC, alcoholC, Xoxygen) = listClone(molecule2, [mkvPairs[1][0], mkvPairs[1][1], oxygen])
                 stuff = ((molecule1, place1, molecule2, mkvPairs[0][0], mkvPairs[0][1], oxygen),
                      (Xmolecule1, Xplace1, Xmolecule2, addingC, alcoholC, Xoxygen))
             else:
@@ -1091,6 +1091,7 @@ def acetylideAdd(molecules, others):
                 addC.eliminateChiral()
                 #alcC keeps its stereochemistry
                 #Add the acetylene to the more substituted carbon.
+                aceMol.touchAtom(aceAtom)
                 aceAtom.charge = 0
                 epxMol.addMolecule(aceMol, aceAtom, addC, 1)
                 #Add new stereochemistry - inversion.
@@ -1110,6 +1111,7 @@ def acetylideAdd(molecules, others):
             (molecule2, place2, unused0, unused1, unused2, unused3, unused4) = duplicateInputs(molecule2, place2, place2, None, None, None, None)
            
             #Remove negative charge
+            molecule1.touchAtom(place1)
             place1.charge = 0
             #Find halogen
             halogen = None
@@ -1127,7 +1129,7 @@ def acetylideAdd(molecules, others):
         return [molecule1]
         
         
-    return twoReact(copy.deepcopy(molecules), copy.deepcopy(others), findPlaces1, findPlaces2, reactAtPlaces)
+    return twoReact(cloneMolecules(molecules), cloneMolecules(others), findPlaces1, findPlaces2, reactAtPlaces)
 
 
 
@@ -5,11 +5,21 @@ Contains the function render(smiles), which takes in a string in SMILES format
 and outputs a SVG representation (as a string) of that molecule. Uses the
 OpenBabel Python library:
 http://openbabel.org/wiki/Python
+
+renderMolecule does the same for Molecule objects, handing them to OpenBabel
+directly (see obBridge) where it can.
 """
 
-import openbabel
 import re
 
+try:
+    import openbabel
+except ImportError:
+    openbabel = None
+
+from obBridge import toOBMol
+from toSmiles import smilesify
+
 VERBOSE = False
 
 #Set up input and output formats
@@ -19,7 +29,11 @@ def render(smiles, hydrogens=False):
     smiles :: str. In SMILES format.
     hydrogens :: bool. Currently, the hydrogens option does nothing.
     return :: str. In SVG format.
+
+    Raises a StandardError if OpenBabel isn't installed.
     """
+    if openbabel is None:
+        raise StandardError("Rendering SVG needs OpenBabel")
     print "Rendering...",smiles
     obConversion = openbabel.OBConversion()
     # obConversion.AddOption("U", obConversion.OUTOPTIONS, "1") 
@@ -28,8 +42,31 @@ def render(smiles, hydrogens=False):
     if VERBOSE:
         print "SVGing: %s" % str(smiles)
     obConversion.ReadString(outMol, str(smiles))
+    return _writeSVG(obConversion, outMol)
+
+
+def renderMolecule(molecule):
+    """
+    molecule :: Molecule or [Molecule].
+    return :: str. In SVG format.
+
+    Raises a StandardError if OpenBabel isn't installed.
+    """
+    outMol = toOBMol(molecule)
+    if outMol is None:
+        ## Aromatic or stereo: let OpenBabel read it from SMILES.
+        return render(smilesify(molecule, canonical=True))
+    obConversion = openbabel.OBConversion()
+    obConversion.SetOutFormat("svg")
+    return _writeSVG(obConversion, outMol)
 
 
+def _writeSVG(obConversion, outMol):
+    """
+    obConversion :: OBConversion. Set up to write SVG.
+    outMol :: OBMol.
+    return :: str. In SVG format.
+    """
     ans = obConversion.WriteString(outMol)
     
     ## Make the svg background transparent:
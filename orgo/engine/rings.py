@@ -0,0 +1,198 @@
+"""
+rings.py
+Ring perception: the smallest set of smallest rings (SSSR) of a molecule,
+and which rings each bond and atom belong to.
+
+Molecule.rings() caches a RingInfo until the molecule's ring structure
+changes. Public-facing:
+    `findRings`, `RingInfo`
+"""
+
+from collections import deque
+
+
+def findRings(atoms, neighbors=None):
+    """
+    Perceives the rings among atoms, following bonds to atoms outside the
+    list as well.
+    atoms :: iterable of Atom.
+    neighbors :: function or None. Given an atom, returns the atoms bonded
+        to it. None means Atom.neighbors; with a function, atoms can be
+        anything hashable, e.g. atom numbers.
+    return :: RingInfo.
+    """
+    if neighbors is None:
+        neighbors = _neighbors
+    return RingInfo(_cycleBasis(_component(atoms, neighbors), neighbors))
+
+
+def _neighbors(atom):
+    return atom.neighbors
+
+
+def _component(atoms, neighbors):
+    "return :: [Atom]. atoms, plus every atom reachable from them."
+    output = list(atoms)
+    seen = set(output)
+    i = 0
+    while i < len(output):
+        for neighbor in neighbors(output[i]):
+            if neighbor not in seen:
+                seen.add(neighbor)
+                output.append(neighbor)
+        i += 1
+    return output
+
+
+def _shortestPaths(root, neighbors):
+    """
+    Breadth-first search from root.
+    return :: {Atom: Atom or None}. Each reachable atom's parent on one
+        shortest path back to root.
+    """
+    parents = {root: None}
+    queue = deque([root])
+    while queue:
+        atom = queue.popleft()
+        for neighbor in neighbors(atom):
+            if neighbor not in parents:
+                parents[neighbor] = atom
+                queue.append(neighbor)
+    return parents
+
+
+def _pathToRoot(parents, atom):
+    output = []
+    while atom is not None:
+        output.append(atom)
+        atom = parents[atom]
+    return output
+
+
+def _cycleBasis(atoms, neighbors):
+    """
+    Finds a minimum cycle basis (Horton): every cycle made of a shortest
+    path root..x, the bond x-y and a shortest path y..root is a candidate,
+    and the shortest candidates that are independent of each other (as
+    sets of bonds) make up the basis.
+    atoms :: [Atom]. Closed under bonds.
+    return :: [[Atom]]. Each ring in cyclic order, smallest rings first.
+    """
+    bondBits = {}
+    for atom in atoms:
+        for neighbor in neighbors(atom):
+            bond = frozenset((atom, neighbor))
+            if bond not in bondBits:
+                bondBits[bond] = 1 << len(bondBits)
+
+    ## Every component with n atoms and m bonds has m - n + 1 rings.
+    ringCount = len(bondBits) - len(atoms)
+    seen = set()
+    for atom in atoms:
+        if atom not in seen:
+            seen.update(_shortestPaths(atom, neighbors))
+            ringCount += 1
+    if ringCount == 0:
+        return []
+
+    candidates = {}
+    for root in atoms:
+        parents = _shortestPaths(root, neighbors)
+        for x in parents:
+            for y in neighbors(x):
+                if parents[x] == y or parents[y] == x:
+                    continue
+                pathX = _pathToRoot(parents, x)
+                pathY = _pathToRoot(parents, y)
+                if set(pathX[:-1]) & set(pathY[:-1]):
+                    continue # the paths meet before root: not a simple cycle
+                ring = pathX + pathY[-2::-1]
+                bits = 0
+                for i in xrange(len(ring)):
+                    bits |= bondBits[frozenset((ring[i], ring[i - 1]))]
+                if bits not in candidates:
+                    candidates[bits] = ring
+
+    ## Greedy Gaussian elimination over GF(2), shortest cycles first.
+    basis = {} # leading bit -> reduced bond set
+    output = []
+    for bits, ring in sorted(candidates.iteritems(),
+                             key=lambda item: len(item[1])):
+        reduced = bits
+        while reduced:
+            lead = reduced & -reduced
+            if lead not in basis:
+                break
+            reduced ^= basis[lead]
+        if not reduced:
+            continue
+        basis[reduced & -reduced] = reduced
+        output.append(ring)
+        if len(output) == ringCount:
+            break
+    return output
+
+
+class RingInfo(object):
+    """
+    The rings of a molecule, as perceived by findRings.
+        self.rings :: [[Atom]]. The SSSR, smallest rings first, each ring's
+            atoms in cyclic order.
+    """
+
+    def __init__(self, rings):
+        self.rings = rings
+        self._atomRings = {}
+        self._bondRings = {}
+        for i, ring in enumerate(rings):
+            for j in xrange(len(ring)):
+                self._atomRings.setdefault(ring[j], []).append(i)
+                bond = frozenset((ring[j], ring[j - 1]))
+                self._bondRings.setdefault(bond, []).append(i)
+
+    def atomRings(self, atom):
+        """
+        atom :: Atom.
+        return :: [[Atom]]. The rings atom is in, smallest first.
+        """
+        return [self.rings[i] for i in self._atomRings.get(atom, ())]
+
+    def bondRings(self, atom1, atom2):
+        """
+        atom1 :: Atom.
+        atom2 :: Atom.
+        return :: [[Atom]]. The rings the bond atom1-atom2 is in, smallest
+            first. The first one is the smallest ring through that bond.
+        """
+        return [self.rings[i]
+                for i in self._bondRings.get(frozenset((atom1, atom2)), ())]
+
+    def inRing(self, atom1, atom2=None):
+        """
+        atom1 :: Atom.
+        atom2 :: Atom or None.
+        return :: bool. Whether atom1, or the bond atom1-atom2, is in a ring.
+        """
+        if atom2 is None:
+            return atom1 in self._atomRings
+        return frozenset((atom1, atom2)) in self._bondRings
+
+    def ringPath(self, start, current):
+        """
+        The smallest ring through the bond start-current, walked from current
+        the long way round to start.
+        start :: Atom.
+        current :: Atom. Bonded to start.
+        return :: [Atom] or None. [current, ..., start], or None if the bond
+            isn't in a ring.
+        """
+        rings = self.bondRings(start, current)
+        if not rings:
+            return None
+        ring = rings[0]
+        i = ring.index(current)
+        if ring[i - 1] is start:
+            ## start comes just before current: walk forwards.
+            return ring[i:] + ring[:i]
+        ## start comes just after current: walk backwards.
+        return ring[i::-1] + ring[:i:-1]
@@ -0,0 +1,224 @@
+"""
+smilesStream.py
+Reads and writes .smi files, one molecule per line, for building banks of
+starting materials bigger than anything we could hard-code.
+
+Each line of a .smi file is a SMILES string, optionally followed by
+whitespace and a name. Blank lines and lines starting with '#' are
+skipped. Both directions stream: lines are read, parsed and written
+BATCH_SIZE at a time, so memory use doesn't grow with the file. A line
+that can't be read or written comes through as a Record with an error,
+rather than stopping the rest.
+
+Public-facing:
+    `moleculify_stream`, `smilesify_stream`, `Record`
+"""
+
+from collections import deque
+from itertools import islice
+import multiprocessing
+
+from rply.errors import LexingError, ParsingError
+
+from compactMolecule import CompactMolecule, compactify
+from molecularStructure import Molecule
+import toCanonical
+from toMolecule import moleculify
+from toSmiles import smilesify
+
+BATCH_SIZE = 256 # lines
+
+## Batches waiting on each worker process, at most.
+QUEUED_PER_PROCESS = 2
+
+
+class Record(object):
+    """
+    One line of a .smi file.
+        self.lineno :: int. The line it was read from, counting from 1.
+        self.smiles :: str or None. As read, or as written.
+        self.name :: str or None.
+        self.molecules :: [Molecule] or [CompactMolecule] or None. None if
+            the line couldn't be read.
+        self.error :: str or None. Why the line couldn't be read or written.
+    """
+
+    def __init__(self, lineno, smiles, name, molecules=None, error=None):
+        self.lineno = lineno
+        self.smiles = smiles
+        self.name = name
+        self.molecules = molecules
+        self.error = error
+
+    def __repr__(self):
+        return "Record(%r, %r, %r, error=%r)" % (self.lineno, self.smiles,
+                                                 self.name, self.error)
+
+
+def moleculify_stream(source, implicitHydrogens=False, compact=False,
+                      processes=1, batchSize=BATCH_SIZE):
+    """
+    Reads a .smi file.
+    source :: str or iterable of str. A path, or the lines of an open file.
+    implicitHydrogens :: bool. As for moleculify.
+    compact :: bool. If True, molecules come as CompactMolecules, which are
+        much smaller than Molecules.
+    processes :: int. If more than 1, lines are parsed on this many worker
+        processes, which hand their results back as CompactMolecules.
+    batchSize :: int. Lines read at a time.
+    return :: iterator of Record. One per SMILES line, in file order.
+    """
+    if isinstance(source, basestring):
+        with open(source) as lines:
+            for record in moleculify_stream(lines, implicitHydrogens, compact,
+                                            processes, batchSize):
+                yield record
+        return
+
+    batches = _batches(source, batchSize)
+    if processes > 1:
+        results = _inParallel(_readBatchInWorker, processes,
+                              ((batch, implicitHydrogens, True)
+                               for batch in batches))
+    else:
+        results = (_readBatch(batch, implicitHydrogens, compact)
+                   for batch in batches)
+    expand = processes > 1 and not compact
+    for records in results:
+        for record in records:
+            if expand and record.molecules is not None:
+                record.molecules = [molecule.toMolecule()[0]
+                                    for molecule in record.molecules]
+            yield record
+
+
+def smilesify_stream(records, sink, canonical=True):
+    """
+    Writes a .smi file, a line at a time, as records come in.
+    records :: iterable of Record, Molecule, CompactMolecule or [Molecule].
+        Records that already carry an error are passed along unwritten.
+    sink :: str or file. A path, or an open file to write to.
+    canonical :: bool. As for smilesify.
+    return :: iterator of Record. Each record once it is written, with the
+        SMILES that went into the file, or with an error. Nothing is
+        written until this is iterated.
+    """
+    if isinstance(sink, basestring):
+        with open(sink, 'w') as out:
+            for record in smilesify_stream(records, out, canonical):
+                yield record
+        return
+
+    lines = []
+    for lineno, record in enumerate(records, 1):
+        if not isinstance(record, Record):
+            if isinstance(record, (Molecule, CompactMolecule)):
+                record = [record]
+            record = Record(lineno, None, None, record)
+        if record.error is None:
+            try:
+                record.smiles = smilesify(record.molecules, canonical)
+            except Exception as e:
+                record.error = _describe(e)
+        if record.error is None:
+            if record.name:
+                lines.append("%s %s\n" % (record.smiles, record.name))
+            else:
+                lines.append(record.smiles + "\n")
+            if len(lines) >= BATCH_SIZE:
+                sink.writelines(lines)
+                lines = []
+        yield record
+    sink.writelines(lines)
+
+
+def _batches(lines, size):
+    """
+    lines :: iterable of str.
+    return :: iterator of [(int, str)]. The SMILES lines and their numbers,
+        size at a time.
+    """
+    numbered = ((lineno, line) for lineno, line in enumerate(lines, 1)
+                if line.strip() and not line.startswith('#'))
+    while True:
+        batch = list(islice(numbered, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _readBatch(batch, implicitHydrogens, compact):
+    """
+    batch :: [(int, str)]. From _batches.
+    return :: [Record].
+    """
+    output = []
+    for lineno, line in batch:
+        fields = line.split(None, 1)
+        smiles = fields[0]
+        name = fields[1].strip() if len(fields) > 1 else None
+        try:
+            molecules = moleculify(smiles, implicitHydrogens)
+        except Exception as e:
+            ## The parser reports most malformed input by failing asserts.
+            output.append(Record(lineno, smiles, name, error=_describe(e)))
+            continue
+        if not isinstance(molecules, list):
+            ## moleculify's stand-in for what it couldn't parse
+            output.append(Record(lineno, smiles, name,
+                                 error="Could not parse %s" % smiles))
+            continue
+        if compact:
+            molecules = [compactify(molecule) for molecule in molecules]
+        output.append(Record(lineno, smiles, name, molecules))
+    return output
+
+
+def _readBatchInWorker(batch, implicitHydrogens, compact):
+    """
+    _readBatch, on a worker process. The pool is terminated rather than
+    shut down, so the worker never runs its exit handlers: what its store
+    buffered is written out here, before the records go back.
+    """
+    output = _readBatch(batch, implicitHydrogens, compact)
+    toCanonical._flush_store()
+    return output
+
+
+def _describe(error):
+    "return :: str. What went wrong, for Record.error."
+    if isinstance(error, (LexingError, ParsingError)) and \
+            error.getsourcepos() is not None:
+        return "%s at character %d" % (type(error).__name__,
+                                       error.getsourcepos().idx + 1)
+    return "%s: %s" % (type(error).__name__, error)
+
+
+def _inParallel(function, processes, arguments):
+    """
+    Runs function on each tuple of arguments in a pool of processes.
+    Arguments are only taken as workers are ready for them, so that a long
+    input isn't read into memory up front (as Pool.imap would).
+    return :: iterator. function's results, in order.
+    """
+    pool = multiprocessing.Pool(processes, _startWorker)
+    try:
+        pending = deque()
+        for args in arguments:
+            pending.append(pool.apply_async(function, args))
+            if len(pending) >= processes * QUEUED_PER_PROCESS:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+
+def _startWorker():
+    ## A forked worker can't use its parent's SQLite connection, so it opens
+    ## its own store, and flushes it after every batch (see
+    ## _readBatchInWorker). The parent flushes what it had buffered.
+    store = toCanonical._store
+    if store is not None:
+        toCanonical._store = None
+        toCanonical.open_store(store.path)
@@ -0,0 +1,71 @@
+"""
+Unit Tests for canonicalStore.py
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import canonicalStore
+from canonicalStore import CanonicalStore
+
+
+######################
+##### UNIT TESTS #####
+######################
+
+class TestCanonicalStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "canonical.sqlite3")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pending(self):
+        store = CanonicalStore(self.path)
+        store.putMany([("OCC", "CCO")])
+        self.assertEqual(store.getMany(["OCC", "CCN"]), {"OCC": "CCO"})
+        self.assertEqual(CanonicalStore(self.path).getMany(["OCC"]), {})
+
+    def test_flush(self):
+        store = CanonicalStore(self.path)
+        store.putMany([("OCC", "CCO"), ("CCO", "CCO")])
+        store.flush()
+        other = CanonicalStore(self.path)
+        self.assertEqual(other.getMany(["OCC", "CCO", "CCN"]),
+                         {"OCC": "CCO", "CCO": "CCO"})
+
+    def test_flush_size(self):
+        store = CanonicalStore(self.path)
+        pairs = [("C" * i, "C" * i)
+                 for i in xrange(1, canonicalStore.FLUSH_SIZE + 1)]
+        store.putMany(pairs)
+        self.assertEqual(len(CanonicalStore(self.path).getMany(
+            [smiles for smiles, _ in pairs])), len(pairs))
+
+    def test_threads(self):
+        store = CanonicalStore(self.path)
+        store.putMany([("OCC", "CCO")])
+        store.flush()
+        found = []
+        thread = threading.Thread(
+            target=lambda: found.append(store.getMany(["OCC"])))
+        thread.start()
+        thread.join()
+        self.assertEqual(found, [{"OCC": "CCO"}])
+
+    def test_unusable(self):
+        "A store that can't be opened is empty, and doesn't raise."
+        path = os.path.join(self.directory, "missing", "canonical.sqlite3")
+        store = CanonicalStore(path)
+        store.putMany([("OCC", "CCO")])
+        store.flush()
+        self.assertEqual(store.getMany(["OCC"]), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
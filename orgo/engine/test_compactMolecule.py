@@ -0,0 +1,166 @@
+"""
+Unit Tests for compactMolecule.py
+"""
+
+import unittest
+
+from molecularStructure import Atom, Molecule
+from compactMolecule import CompactMolecule, compactify, ELEMENTS
+import helperFunctions
+from toMolecule import moleculify
+from toSmiles import smilesify
+
+
+######################
+##### UNIT TESTS #####
+######################
+
+def allylAlcohol():
+    "Returns (molecule, atoms) for OCC=C, with hydrogens."
+    atoms = [Atom(element) for element in ("O", "C", "C", "C")]
+    molecule = Molecule(atoms[0])
+    molecule.addAtom(atoms[1], atoms[0])
+    molecule.addAtom(atoms[2], atoms[1])
+    molecule.addAtom(atoms[3], atoms[2], 2)
+    molecule.addHydrogens()
+    return molecule, atoms
+
+
+class TestRoundTrip(unittest.TestCase):
+
+    def test_arrays(self):
+        molecule, atoms = allylAlcohol()
+        compact = compactify(molecule)
+        self.assertEqual(len(compact), len(molecule.atoms))
+        self.assertEqual(compact.element(0), "O")
+        self.assertEqual(ELEMENTS[compact.elements[1]], "C")
+        self.assertEqual(compact.bondOrder(2, 3), 2)
+        self.assertEqual(compact.bondOrder(0, 3), None)
+        self.assertEqual(compact.offsets[-1], len(compact.targets))
+
+    def test_back(self):
+        molecule, atoms = allylAlcohol()
+        molecule.oneEqvAdded = True
+        output, atomList = compactify(molecule).toMolecule()
+        self.assertEqual(len(output.atoms), len(molecule.atoms))
+        self.assertTrue(output.oneEqvAdded)
+        self.assertEqual(atomList[3].neighbors[atomList[2]], 2)
+        self.assertTrue(type(atomList[3].neighbors[atomList[2]]) is int)
+        self.assertEqual([atom.element for atom in output.atoms],
+                         [atom.element for atom in molecule.atoms])
+
+    def test_implicit(self):
+        molecule, atoms = allylAlcohol()
+        molecule.collapseHydrogens()
+        output, atomList = compactify(molecule).toMolecule()
+        self.assertTrue(output.implicitHydrogens)
+        self.assertEqual(atomList[3].implicit_h, 2)
+        self.assertEqual(output.countElement('H'), 6)
+
+    def test_chirality(self):
+        center = Atom("C")
+        molecule = Molecule(center)
+        others = [Atom(element) for element in ("F", "Cl", "Br", "I")]
+        for atom in others:
+            molecule.addAtom(atom, center)
+        center.newChiralCenter(others[0], (others[1], others[2], others[3]))
+        center.clss = 2
+        output, atomList = compactify(molecule).toMolecule()
+        self.assertTrue(atomList[0].is_chiral)
+        self.assertTrue(atomList[0].chiralA is atomList[1])
+        self.assertTrue(atomList[0].chiralD is atomList[4])
+        self.assertEqual(atomList[0].clss, 2)
+        self.assertFalse(atomList[1].is_chiral)
+
+    def test_outside_atoms(self):
+        "Atoms bonded to the molecule but not listed in it stay outside."
+        molecule = Molecule(Atom("O"))
+        outside = Atom("H")
+        molecule.atoms[0].neighbors[outside] = 1
+        outside.neighbors[molecule.atoms[0]] = 1
+        output, atomList = compactify(molecule).toMolecule()
+        self.assertEqual(len(output.atoms), 1)
+        self.assertEqual(len(atomList), 2)
+        self.assertTrue(atomList[1] in atomList[0].neighbors)
+
+    def test_other_elements(self):
+        "Symbols outside the table are kept per molecule."
+        molecule = Molecule(Atom("c"))
+        molecule.addAtom(Atom("Xx"), molecule.atoms[0])
+        compact = compactify(molecule)
+        self.assertEqual(compact.otherElements, ["c", "Xx"])
+        self.assertEqual(compact.elements[0], len(ELEMENTS))
+        self.assertEqual(compact.element(1), "Xx")
+        self.assertEqual(compactify(Molecule(Atom("Xx"))).elements[0],
+                         len(ELEMENTS))
+        output, atomList = compact.toMolecule()
+        self.assertEqual([atom.element for atom in atomList], ["c", "Xx"])
+        self.assertEqual(len(ELEMENTS), 119)
+
+
+class TestFinders(unittest.TestCase):
+
+    def test_same_as_molecule(self):
+        for implicit in (False, True):
+            molecule, atoms = allylAlcohol()
+            if implicit:
+                molecule.collapseHydrogens()
+            compact = compactify(molecule)
+            index = dict((atom, i) for i, atom in enumerate(molecule.atoms))
+            self.assertEqual(
+                compact.findAlkenes(),
+                [tuple(sorted((index[a], index[b]))) for a, b in
+                 helperFunctions.findAlkenes(molecule)])
+            self.assertEqual(
+                compact.findHydroxyls(),
+                [index[atom] for atom in helperFunctions.findHydroxyls(molecule)])
+            self.assertEqual(compact.findAlkyne(), None)
+
+    def test_dispatch(self):
+        molecule, atoms = allylAlcohol()
+        compact = compactify(molecule)
+        self.assertEqual(helperFunctions.findAlkene(compact), (2, 3))
+        self.assertEqual(helperFunctions.findAlkynes(compact), [])
+        water = compactify(Molecule(Atom("O")))
+        self.assertEqual(helperFunctions.findHydroxyls(water), [0])
+
+
+
+class TestOnArrays(unittest.TestCase):
+    "Writing and comparing don't expand CompactMolecules into Atoms."
+
+    def setUp(self):
+        self.toMolecule = CompactMolecule.toMolecule
+        def fail(compact):
+            raise AssertionError("expanded a CompactMolecule")
+        CompactMolecule.toMolecule = fail
+
+    def tearDown(self):
+        CompactMolecule.toMolecule = self.toMolecule
+
+    def test_smilesify(self):
+        for smiles in ["OCC=C", "F[C@H](Cl)Br", "F/C=C/F", "C1=CC=CC=C1",
+                       "[13CH3][O-]", "CC.O"]:
+            for implicit in (False, True):
+                molecules = moleculify(smiles, implicitHydrogens=implicit)
+                self.assertEqual(
+                    smilesify([compactify(m) for m in molecules]),
+                    smilesify(molecules))
+
+    def test_element_counts(self):
+        molecule, atoms = allylAlcohol()
+        compact = compactify(molecule)
+        self.assertEqual(compact.elementCounts(), molecule.elementCounts())
+        molecule.collapseHydrogens()
+        self.assertEqual(compactify(molecule).elementCounts(),
+                         {'C': 3, 'O': 1, 'H': 6})
+
+    def test_compare(self):
+        propanol = compactify(moleculify("CCCO")[0])
+        ethanol = compactify(moleculify("CCO")[0])
+        self.assertEqual(helperFunctions.makeCompareDict(propanol, ethanol),
+                         None)
+
+
+if __name__ == '__main__':
+    unittest.main()
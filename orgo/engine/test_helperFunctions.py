@@ -0,0 +1,54 @@
+"""
+Unit Tests for helperFunctions.py
+"""
+
+import unittest
+
+from molecularStructure import Atom, Molecule
+from helperFunctions import splice
+
+
+######################
+##### UNIT TESTS #####
+######################
+
+class TestSplice(unittest.TestCase):
+    "splice splits molecules into connected components."
+
+    def test_two_parts(self):
+        carbon = Atom("C")
+        molecule = Molecule(carbon)
+        oxygen = Atom("O")
+        molecule.addAtom(oxygen, carbon, 2)
+        otherCarbon = Atom("C")
+        molecule.addAtom(otherCarbon, carbon)
+        otherOxygen = Atom("O")
+        molecule.addAtom(otherOxygen, otherCarbon, 2)
+        molecule.removeBond(carbon, otherCarbon)
+        parts = splice(molecule)
+        self.assertEqual([part.atoms for part in parts],
+                         [[carbon, oxygen], [otherCarbon, otherOxygen]])
+
+    def test_lone_atom(self):
+        molecule = Molecule(Atom("O"))
+        molecule.implicitHydrogens = True
+        parts = splice([molecule, molecule])
+        self.assertEqual(len(parts), 2)
+        self.assertEqual(parts[0].atoms, molecule.atoms)
+        self.assertTrue(parts[0].implicitHydrogens)
+
+    def test_stereo_kept(self):
+        center = Atom("C")
+        molecule = Molecule(center)
+        others = [Atom(element) for element in ("F", "Cl", "Br", "I")]
+        for atom in others:
+            molecule.addAtom(atom, center)
+        center.newChiralCenter(others[0], (others[1], others[2], others[3]))
+        molecule.addAtom(Atom("Na"), others[0])
+        parts = splice(molecule)
+        self.assertEqual(len(parts), 1)
+        self.assertTrue(parts[0].atoms[0].chiralA is others[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
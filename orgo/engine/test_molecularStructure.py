@@ -0,0 +1,490 @@
+"""
+Unit Tests for molecularStructure.py
+"""
+
+import sys
+import threading
+import unittest
+
+from molecularStructure import Atom, Molecule
+import functionalGroups
+
+
+######################
+##### UNIT TESTS #####
+######################
+
+def ethene():
+    "Returns (molecule, carbon, otherCarbon) for C=C."
+    carbon = Atom("C")
+    molecule = Molecule(carbon)
+    otherCarbon = Atom("C")
+    molecule.addAtom(otherCarbon, carbon, 2)
+    return molecule, carbon, otherCarbon
+
+
+class TestClone(unittest.TestCase):
+    "Molecule.clone should behave like copy.deepcopy, plus an atom map."
+
+    def test_atom_map(self):
+        molecule, carbon, otherCarbon = ethene()
+        clone, atomMap = molecule.clone()
+        self.assertEqual(len(clone.atoms), 2)
+        self.assertTrue(atomMap[carbon] in clone.atoms)
+        self.assertFalse(carbon in clone.atoms)
+        self.assertEqual(atomMap[carbon].neighbors, {atomMap[otherCarbon]: 2})
+
+    def test_independent(self):
+        "Edits to the clone must not leak back into the original."
+        molecule, carbon, otherCarbon = ethene()
+        clone, atomMap = molecule.clone()
+        clone.addAtom(Atom("Br"), atomMap[carbon])
+        clone.changeBond(atomMap[carbon], atomMap[otherCarbon], 1)
+        self.assertEqual(len(molecule.atoms), 2)
+        self.assertEqual(carbon.neighbors, {otherCarbon: 2})
+
+    def test_chirality(self):
+        center = Atom("C")
+        molecule = Molecule(center)
+        others = [Atom(element) for element in ("F", "Cl", "Br", "I")]
+        for atom in others:
+            molecule.addAtom(atom, center)
+        center.newChiralCenter(others[0], (others[1], others[2], others[3]))
+        clone, atomMap = molecule.clone()
+        newCenter = atomMap[center]
+        self.assertTrue(newCenter.is_chiral)
+        self.assertTrue(newCenter.chiralA is atomMap[center.chiralA])
+        self.assertTrue(newCenter.chiralD is atomMap[center.chiralD])
+
+    def test_tags(self):
+        "Molecule-level attributes carry over."
+        molecule, carbon, otherCarbon = ethene()
+        molecule.oneEqvAdded = True
+        clone, atomMap = molecule.clone()
+        self.assertTrue(clone.oneEqvAdded)
+
+
+class TestAtomIndex(unittest.TestCase):
+    "Membership and removal go through the molecule's atom index."
+
+    def test_contains(self):
+        molecule, carbon, otherCarbon = ethene()
+        self.assertTrue(carbon in molecule)
+        self.assertFalse(Atom("C") in molecule)
+
+    def test_remove_keeps_order(self):
+        molecule, carbon, otherCarbon = ethene()
+        bromine = Atom("Br")
+        chlorine = Atom("Cl")
+        molecule.addAtom(bromine, otherCarbon)
+        molecule.addAtom(chlorine, carbon)
+        molecule.removeAtom(bromine)
+        self.assertFalse(bromine in molecule)
+        self.assertEqual(molecule.atoms, [carbon, otherCarbon, chlorine])
+        self.assertFalse(bromine in otherCarbon.neighbors)
+
+    def test_readd(self):
+        molecule, carbon, otherCarbon = ethene()
+        bromine = Atom("Br")
+        molecule.addAtom(bromine, carbon)
+        molecule.removeAtom(bromine)
+        molecule.addAtom(bromine, otherCarbon)
+        self.assertEqual(molecule.atoms, [carbon, otherCarbon, bromine])
+
+
+class TestImplicitHydrogens(unittest.TestCase):
+    "Hydrogens carried as counts instead of atoms."
+
+    def test_round_trip(self):
+        molecule, carbon, otherCarbon = ethene()
+        molecule.addHydrogens()
+        self.assertEqual(len(molecule.atoms), 6)
+        molecule.collapseHydrogens()
+        self.assertTrue(molecule.implicitHydrogens)
+        self.assertEqual(len(molecule.atoms), 2)
+        self.assertEqual(carbon.implicit_h, 2)
+        self.assertEqual(carbon.hydrogenCount(), 2)
+        self.assertEqual(carbon.neighborCount(), 3)
+        self.assertEqual(molecule.countElement('H'), 4)
+        molecule.expandHydrogens()
+        self.assertEqual(len(molecule.atoms), 6)
+        self.assertEqual(carbon.implicit_h, 0)
+        self.assertEqual(carbon.hydrogenCount(), 2)
+
+    def test_stereo_hydrogen_stays(self):
+        center = Atom("C")
+        molecule = Molecule(center)
+        others = [Atom(element) for element in ("F", "Cl", "Br", "H")]
+        for atom in others:
+            molecule.addAtom(atom, center)
+        center.newChiralCenter(others[3], (others[0], others[1], others[2]))
+        molecule.collapseHydrogens()
+        self.assertTrue(others[3] in molecule)
+        self.assertEqual(center.implicit_h, 0)
+
+    def test_add_remove(self):
+        molecule, carbon, otherCarbon = ethene()
+        molecule.collapseHydrogens()
+        self.assertEqual(molecule.addHydrogen(carbon), None)
+        self.assertEqual(carbon.implicit_h, 1)
+        self.assertEqual(str(carbon), "[CH]")
+        molecule.removeHydrogen(carbon)
+        self.assertEqual(carbon.implicit_h, 0)
+        self.assertRaises(StandardError, molecule.removeHydrogen, carbon)
+
+
+class TestCompactAtom(unittest.TestCase):
+    "Slotted atoms keep stereo fields and tags out of the way until used."
+
+    def test_no_dict(self):
+        atom = Atom("C")
+        self.assertFalse(hasattr(atom, '__dict__'))
+        self.assertRaises(AttributeError, setattr, atom, 'flag', 1)
+
+    def test_stereo_record(self):
+        center = Atom("C")
+        self.assertEqual(center._stereo, None)
+        self.assertFalse(center.is_chiral)
+        others = [Atom(element) for element in ("F", "Cl", "Br", "I")]
+        center.newChiralCenter(others[0], (others[1], others[2], others[3]))
+        self.assertTrue(center.is_chiral)
+        self.assertTrue(center.chiralC is others[2])
+        center.eliminateChiral()
+        self.assertEqual(center._stereo, None)
+        self.assertEqual(center.chiralA, None)
+
+    def test_tags(self):
+        atom = Atom("C")
+        self.assertFalse(hasattr(atom, 'clss'))
+        self.assertEqual(str(atom), "[C]")
+        atom.clss = 3
+        self.assertEqual(atom.clss, 3)
+        self.assertEqual(atom.tags, {'clss': 3})
+        self.assertEqual(str(atom), "[C:3]")
+        self.assertEqual(atom.copy().clss, 3)
+
+
+class TestJournal(unittest.TestCase):
+    "Speculative edits between begin() and rollback()/commit()."
+
+    def test_rollback(self):
+        molecule, carbon, otherCarbon = ethene()
+        bromine = Atom("Br")
+        molecule.addAtom(bromine, carbon)
+        molecule.begin()
+        molecule.removeAtom(bromine)
+        molecule.changeBond(carbon, otherCarbon, 1)
+        chlorine = Atom("Cl")
+        molecule.addAtom(chlorine, otherCarbon)
+        self.assertEqual(molecule.atoms, [carbon, otherCarbon, chlorine])
+        molecule.rollback()
+        self.assertEqual(molecule.atoms, [carbon, otherCarbon, bromine])
+        self.assertEqual(carbon.neighbors, {otherCarbon: 2, bromine: 1})
+        self.assertEqual(otherCarbon.neighbors, {carbon: 2})
+        self.assertFalse(chlorine in molecule)
+
+    def test_touch_atom(self):
+        center = Atom("C")
+        molecule = Molecule(center)
+        others = [Atom(element) for element in ("F", "Cl", "Br", "I")]
+        for atom in others:
+            molecule.addAtom(atom, center)
+        center.newChiralCenter(others[0], (others[1], others[2], others[3]))
+        molecule.begin()
+        molecule.touchAtom(center)
+        center.eliminateChiral()
+        center.charge = 1
+        molecule.rollback()
+        self.assertTrue(center.is_chiral)
+        self.assertTrue(center.chiralB is others[1])
+        self.assertEqual(center.charge, 0)
+
+    def test_nested(self):
+        molecule, carbon, otherCarbon = ethene()
+        molecule.begin()
+        molecule.changeBond(carbon, otherCarbon, 3)
+        molecule.begin()
+        molecule.changeBond(carbon, otherCarbon, 1)
+        snapshot, atomMap = molecule.clone()
+        molecule.rollback()
+        self.assertEqual(carbon.neighbors[otherCarbon], 3)
+        self.assertEqual(atomMap[carbon].neighbors[atomMap[otherCarbon]], 1)
+        molecule.commit()
+        self.assertEqual(carbon.neighbors[otherCarbon], 3)
+        self.assertEqual(molecule._journal, None)
+
+
+class TestGroupIndex(unittest.TestCase):
+    "The functional-group index follows edits made through the molecule."
+
+    def test_alkene(self):
+        molecule, carbon, otherCarbon = ethene()
+        self.assertEqual(molecule.groupAtoms('alkene'), [carbon, otherCarbon])
+        molecule.changeBond(carbon, otherCarbon, 3)
+        self.assertEqual(molecule.groupAtoms('alkene'), [])
+        self.assertEqual(molecule.groupAtoms('alkyne'), [carbon, otherCarbon])
+        self.assertEqual(molecule.groupAtoms('hydrogenAlkyne'),
+                         [carbon, otherCarbon])
+
+    def test_enol(self):
+        molecule, carbon, otherCarbon = ethene()
+        self.assertEqual(molecule.groupAtoms('enol'), [])
+        oxygen = Atom("O")
+        molecule.addAtom(oxygen, carbon)
+        self.assertEqual(molecule.groupAtoms('enol'), [carbon])
+        self.assertEqual(molecule.groupAtoms('hydroxyl'), [oxygen])
+        molecule.addAtom(Atom("C"), oxygen)
+        self.assertEqual(molecule.groupAtoms('enol'), [])
+        self.assertEqual(molecule.groupAtoms('hydroxyl'), [])
+
+    def test_remove_neighbor(self):
+        "Removing an atom reclassifies the atoms two bonds away too."
+        molecule, carbon, otherCarbon = ethene()
+        oxygen = Atom("O")
+        hydrogen = Atom("H")
+        molecule.addAtom(oxygen, carbon)
+        molecule.addAtom(hydrogen, oxygen)
+        self.assertEqual(molecule.groupAtoms('enol'), [])
+        molecule.begin()
+        molecule.removeAtom(hydrogen)
+        self.assertEqual(molecule.groupAtoms('enol'), [carbon])
+        molecule.rollback()
+        self.assertEqual(molecule.groupAtoms('enol'), [])
+        molecule.removeAtom(hydrogen)
+        self.assertEqual(molecule.groupAtoms('enol'), [carbon])
+
+    def test_touch_atom(self):
+        molecule, carbon, otherCarbon = ethene()
+        molecule.changeBond(carbon, otherCarbon, 3)
+        self.assertEqual(molecule.groupAtoms('acetylide'), [])
+        molecule.touchAtom(carbon)
+        carbon.charge = -1
+        self.assertEqual(molecule.groupAtoms('acetylide'), [carbon])
+        self.assertEqual(molecule.groupAtoms('hydrogenAlkyne'), [])
+
+    def test_rollback_and_clone(self):
+        molecule, carbon, otherCarbon = ethene()
+        bromine = Atom("Br")
+        molecule.addAtom(bromine, carbon)
+        self.assertEqual(molecule.groupAtoms('halideCarbon'), [carbon])
+        molecule.begin()
+        molecule.removeAtom(bromine)
+        self.assertEqual(molecule.groupAtoms('halideCarbon'), [])
+        molecule.rollback()
+        self.assertEqual(molecule.groupAtoms('halideCarbon'), [carbon])
+        clone, atomMap = molecule.clone()
+        self.assertEqual(clone.groupAtoms('halideCarbon'), [atomMap[carbon]])
+        self.assertEqual(clone.groupAtoms('alkene'),
+                         [atomMap[carbon], atomMap[otherCarbon]])
+
+
+class TestElementCounts(unittest.TestCase):
+    "The element histogram follows edits made through the molecule."
+
+    def test_formula(self):
+        molecule, carbon, otherCarbon = ethene()
+        molecule.addHydrogens()
+        self.assertEqual(molecule.elementCounts(), {'C': 2, 'H': 4})
+        self.assertEqual(molecule.formula(), "C2H4")
+        self.assertAlmostEqual(molecule.molecularWeight(), 28.054)
+        molecule.addAtom(Atom("O"), carbon)
+        molecule.removeAtom(carbon.selectNeighborWithElement('H'))
+        self.assertEqual(molecule.formula(), "C2H3O")
+        self.assertEqual(molecule.countElement('O'), 1)
+
+    def test_implicit(self):
+        molecule, carbon, otherCarbon = ethene()
+        molecule.addHydrogens()
+        self.assertEqual(molecule.countElement('H'), 4)
+        molecule.collapseHydrogens()
+        self.assertEqual(molecule.countElement('H'), 4)
+        molecule.removeHydrogen(carbon)
+        self.assertEqual(molecule.elementCounts(), {'C': 2, 'H': 3})
+
+    def test_rollback_and_clone(self):
+        molecule, carbon, otherCarbon = ethene()
+        self.assertEqual(molecule.formula(), "C2")
+        molecule.begin()
+        molecule.touchAtom(carbon)
+        carbon.element = "N"
+        molecule.addAtom(Atom("Br"), otherCarbon)
+        self.assertEqual(molecule.formula(), "CBrN")
+        clone, atomMap = molecule.clone()
+        molecule.rollback()
+        self.assertEqual(molecule.formula(), "C2")
+        self.assertEqual(clone.formula(), "CBrN")
+
+    def test_no_carbon(self):
+        oxygen = Atom("O")
+        oxygen.implicit_h = 2
+        self.assertEqual(Molecule(oxygen).formula(), "H2O")
+
+
+class TestMemo(unittest.TestCase):
+    "Remembered values last until the molecule is edited."
+
+    def test_version(self):
+        molecule, carbon, otherCarbon = ethene()
+        version = molecule.version
+        molecule.addAtom(Atom("Br"), carbon)
+        self.assertTrue(molecule.version > version)
+        version = molecule.version
+        molecule.touchAtom(otherCarbon)
+        self.assertTrue(molecule.version > version)
+        version = molecule.version
+        molecule.begin()
+        molecule.changeBond(carbon, otherCarbon, 1)
+        molecule.rollback()
+        self.assertTrue(molecule.version > version)
+
+    def test_memo(self):
+        molecule, carbon, otherCarbon = ethene()
+        self.assertEqual(molecule.memo('key'), None)
+        self.assertEqual(molecule.remember('key', 'value'), 'value')
+        self.assertEqual(molecule.memo('key'), 'value')
+        clone, atomMap = molecule.clone()
+        self.assertEqual(clone.memo('key'), 'value')
+        molecule.addAtom(Atom("Br"), carbon)
+        self.assertEqual(molecule.memo('key'), None)
+        self.assertEqual(clone.memo('key'), 'value')
+
+    def test_smiles(self):
+        from toSmiles import smilesify
+        molecule, carbon, otherCarbon = ethene()
+        molecule.addHydrogens()
+        smiles = smilesify(molecule)
+        self.assertEqual(smiles, "C=C")
+        self.assertTrue(smilesify(molecule) is smiles)
+        molecule.touchAtom(carbon)
+        carbon.charge = -1
+        self.assertEqual(smilesify(molecule), "[CH2-]=C")
+
+    def test_stereo(self):
+        "Atom-level stereo edits bump the atom's own molecule's version."
+        from toMolecule import moleculify
+        from toSmiles import smilesify
+        molecule = moleculify("F[C@H](Cl)Br")[0]
+        center = [atom for atom in molecule.atoms if atom.is_chiral][0]
+        self.assertEqual(smilesify(molecule), "Br[C@@H](Cl)F")
+        center.eliminateChiral()
+        self.assertEqual(molecule.clone()[0].memo(('smiles', True)), None)
+        self.assertEqual(smilesify(molecule), "BrC(Cl)F")
+        center.is_chiral = True
+        self.assertEqual(molecule.memo(('smiles', True)), None)
+
+    def test_stereo_elsewhere(self):
+        "Stereo edits to another molecule's atoms leave the memo alone."
+        from toMolecule import moleculify
+        from toSmiles import smilesify
+        molecule, other = moleculify(["CC=CC", "F[C@H](Cl)Br"])
+        smiles = smilesify(molecule)
+        version = molecule.version
+        center = [atom for atom in other.atoms if atom.is_chiral][0]
+        otherVersion = other.version
+        center.eliminateChiral()
+        self.assertTrue(other.version > otherVersion)
+        self.assertEqual(molecule.version, version)
+        self.assertTrue(smilesify(molecule) is smiles)
+        ## A clone's atoms belong to the clone.
+        clone, atomMap = other.clone()
+        cloneVersion = clone.version
+        otherVersion = other.version
+        atomMap[center].is_chiral = True
+        self.assertTrue(clone.version > cloneVersion)
+        self.assertEqual(other.version, otherVersion)
+
+
+class TestReentrant(unittest.TestCase):
+    """
+    A lookup made while a cache is being built (e.g. by another thread
+    reading the same molecule) never sees it half-built.
+    """
+
+    def test_group_index(self):
+        molecule, carbon, otherCarbon = ethene()
+        molecule.addAtom(Atom("O"), carbon)
+        molecule.addHydrogens()
+        nested = []
+        classify = functionalGroups.classify
+
+        def classifyAndLook(atom):
+            if not nested:
+                nested.append(None)
+                nested[0] = molecule.groupAtoms('alkene')
+            return classify(atom)
+
+        functionalGroups.classify = classifyAndLook
+        try:
+            outer = molecule.groupAtoms('alkene')
+        finally:
+            functionalGroups.classify = classify
+        self.assertEqual(outer, [carbon, otherCarbon])
+        self.assertEqual(nested, [outer])
+
+
+
+class TestThreads(unittest.TestCase):
+    """
+    A second thread reading a molecule while the first brings a cache up to
+    date gets the up-to-date answer, wherever the first thread is.
+    """
+
+    def assertReadsAgree(self, build, function):
+        """
+        build :: function returning (expected result, lookup function). Sets
+            up a molecule with an out-of-date cache.
+        function :: str. The method that brings the cache up to date.
+        For each line of function in turn, builds a fresh molecule, starts
+        lookup() on this thread, and stops it at that line to call lookup()
+        to the end on another thread.
+        """
+        line = 0
+        while True:
+            expected, lookup = build()
+            seen = []
+            count = [0]
+            def read():
+                seen.append(lookup())
+            def trace(frame, event, arg):
+                if frame.f_code.co_name != function:
+                    return None
+                if event == 'line':
+                    if count[0] == line:
+                        thread = threading.Thread(target=read)
+                        thread.start()
+                        thread.join()
+                    count[0] += 1
+                return trace
+            sys.settrace(trace)
+            try:
+                output = lookup()
+            finally:
+                sys.settrace(None)
+            self.assertEqual(output, expected)
+            if not seen:
+                break
+            self.assertEqual(seen, [expected], "stopped at line %d" % line)
+            line += 1
+        self.assertTrue(line > 0)
+
+    def test_element_counts(self):
+        def build():
+            molecule, carbon, otherCarbon = ethene()
+            molecule.addHydrogens()
+            molecule.elementCounts()
+            molecule.removeAtom(carbon.selectNeighborWithElement('H'))
+            molecule.addAtom(Atom("O"), carbon)
+            return {'C': 2, 'H': 3, 'O': 1}, molecule.elementCounts
+        self.assertReadsAgree(build, 'elementCounts')
+
+    def test_group_index(self):
+        def build():
+            molecule, carbon, otherCarbon = ethene()
+            molecule.groupAtoms('alkene')
+            molecule.changeBond(carbon, otherCarbon, 3)
+            return ([carbon, otherCarbon],
+                    lambda: molecule.groupAtoms('alkyne'))
+        self.assertReadsAgree(build, '_refreshGroups')
+
+if __name__ == '__main__':
+    unittest.main()
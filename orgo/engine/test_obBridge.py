@@ -0,0 +1,62 @@
+"""
+Unit Tests for obBridge.py
+"""
+
+import unittest
+
+from obBridge import openbabel, readSmiles, fromOBMol, toOBMol
+from toCanonical import to_canonical
+from toMolecule import _parse
+from toSmiles import smilesify
+
+
+######################
+##### UNIT TESTS #####
+######################
+
+@unittest.skipIf(openbabel is None, "OpenBabel is not installed")
+class TestBridge(unittest.TestCase):
+
+    def assertSameAsParsed(self, smiles):
+        "Reading smiles directly gives what the SMILES text route gives."
+        self.assertEqual(smilesify(readSmiles(smiles)),
+                         smilesify(_parse(to_canonical(smiles))))
+
+    def test_read(self):
+        for smiles in ["CCO", "CC(=O)O", "C1CCCCC1Br", "O=C=O", "C#N",
+                       "CC(C)(C)C", "C=CC"]:
+            self.assertSameAsParsed(smiles)
+
+    def test_read_brackets(self):
+        for smiles in ["C[NH3+]", "[OH-]", "[13CH4]", "[NH4+]", "[Na+].[Cl-]"]:
+            self.assertSameAsParsed(smiles)
+
+    def test_read_aromatic(self):
+        for smiles in ["c1ccccc1", "Cc1ccccc1", "c1cc[nH]c1"]:
+            self.assertSameAsParsed(smiles)
+
+    def test_parts(self):
+        self.assertEqual(len(readSmiles("CC.O")), 2)
+
+    def test_stereo(self):
+        self.assertEqual(readSmiles("C[C@H](N)O"), None)
+        self.assertEqual(readSmiles("F/C=C/F"), None)
+
+    def test_round_trip(self):
+        for smiles in ["CCO", "C[NH3+]", "CC.O", "C1CC2CCC1C2"]:
+            molecules = _parse(smiles)
+            self.assertEqual(smilesify(fromOBMol(toOBMol(molecules))),
+                             smilesify(molecules))
+
+    def test_implicit_hydrogens(self):
+        molecules = _parse("CC(=O)O")
+        for molecule in molecules:
+            molecule.collapseHydrogens()
+        self.assertEqual(smilesify(fromOBMol(toOBMol(molecules))), "CC(=O)O")
+
+    def test_aromatic_not_built(self):
+        self.assertEqual(toOBMol(_parse("c1ccccc1")), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
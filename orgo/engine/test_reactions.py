@@ -4,16 +4,16 @@ import unittest
 
 from toMolecule import moleculify
 from toSmiles import smilesify
-from toCanonical import to_canonical
+from toCanonical import to_canonical_batch
 from reaction_functions import *
 
 class TestReactions(unittest.TestCase):
 
     def assertReaction(self, reaction_function, input_smiles, output_smiles):
-        self.assertEqual(
-            to_canonical(smilesify(moleculify(output_smiles))),
-            to_canonical(smilesify(reaction_function(moleculify(input_smiles))))
-        )
+        expected, actual = to_canonical_batch([
+            smilesify(moleculify(output_smiles)),
+            smilesify(reaction_function(moleculify(input_smiles)))])
+        self.assertEqual(expected, actual)
 
     def test1(self):
         self.assertReaction(hydrobrominate_it, "CC=C", "CC(Br)C")
@@ -38,3 +38,43 @@ class TestReactions(unittest.TestCase):
         self.assertReaction(hydrochlorinate_it, "C1CC=CCC1", "C1CCC(Cl)CC1")
         self.assertReaction(hydrochlorinate_it, "C1CC(C)=CCC1", "C1CCC(Cl)(C)CC1")
         self.assertReaction(hydrochlorinate_it, "CCC", "CCC")
+
+    def assertProducts(self, reaction_function, input_smiles, output_smiles):
+        "Compares products one molecule at a time, in no particular order."
+        expected = to_canonical_batch(output_smiles)
+        actual = [smilesify(molecule, True) for molecule in
+                  reaction_function(moleculify(input_smiles))]
+        self.assertEqual(sorted(expected), sorted(actual))
+
+    def test_ozonolysis(self):
+        "Every carbonyl survives the dedupe, whatever order the atoms come in."
+        self.assertProducts(ozonolyse_it, "C=CC", ["C=O", "CC=O"])
+        self.assertProducts(ozonolyse_it, "CC=C", ["C=O", "CC=O"])
+        self.assertProducts(ozonolyse_it, "CC=C(C)CC", ["CC=O", "CCC(C)=O"])
+        self.assertProducts(ozonolyse_it, "CCC(C)=CC", ["CC=O", "CCC(C)=O"])
+        self.assertProducts(ozonolyse_it, "C=C1CCCCC1", ["C=O", "O=C1CCCCC1"])
+        ## Symmetric alkenes give one product, once.
+        self.assertProducts(ozonolyse_it, "CCC=CCC", ["CCC=O"])
+        self.assertProducts(ozonolyse_it, "C1CC=CCC1", ["O=CCCCCC=O"])
+
+    def test_tert_butoxide_leaves_input(self):
+        "E2 works on a copy; the input comes back as it went in."
+        ## A radical neighbor: only carbons with at most three neighbors,
+        ## hydrogens included, give up a hydrogen here.
+        molecules = moleculify("[CH2]C(Cl)C", implicitHydrogens=True)
+        before = smilesify(molecules)
+        products = tert_butoxide_it(molecules)
+        self.assertEqual(smilesify(molecules), before)
+        self.assertFalse(hasattr(molecules[0], '_savepoints'))
+        self.assertEqual(smilesify(products), "C=CC")
+
+    def test_reagent_hydrogen_mode(self):
+        "Water and ethanol come in the same hydrogen mode as the substrate."
+        for implicit in (False, True):
+            substrate = moleculify("CC=C", implicitHydrogens=implicit)
+            for smiles in ("O", "CCO"):
+                molecule, = reagent(smiles, substrate)
+                self.assertEqual(molecule.implicitHydrogens, implicit)
+                self.assertEqual(
+                    any(atom.element == 'H' for atom in molecule.atoms),
+                    not implicit)
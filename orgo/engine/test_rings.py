@@ -0,0 +1,103 @@
+"""
+Unit Tests for rings.py
+"""
+
+import unittest
+
+from molecularStructure import Atom, Molecule
+from rings import findRings
+from helperFunctions import isInRing
+
+
+######################
+##### UNIT TESTS #####
+######################
+
+def chain(n):
+    "Returns (molecule, atoms) for an n-carbon chain."
+    atoms = [Atom("C") for _ in xrange(n)]
+    molecule = Molecule(atoms[0])
+    for i in xrange(1, n):
+        molecule.addAtom(atoms[i], atoms[i - 1])
+    return molecule, atoms
+
+
+def decalin():
+    "Returns (molecule, atoms) for two fused six-membered rings."
+    molecule, atoms = chain(10)
+    molecule.addBond(atoms[0], atoms[5])
+    molecule.addBond(atoms[5], atoms[9])
+    molecule.addBond(atoms[0], atoms[6]) # atoms 0 and 5 are shared
+    molecule.removeBond(atoms[5], atoms[6])
+    return molecule, atoms
+
+
+class TestSSSR(unittest.TestCase):
+
+    def test_chain(self):
+        molecule, atoms = chain(5)
+        self.assertEqual(findRings(molecule.atoms).rings, [])
+
+    def test_cyclohexane(self):
+        molecule, atoms = chain(6)
+        molecule.addBond(atoms[0], atoms[5])
+        ringInfo = findRings(molecule.atoms)
+        self.assertEqual(len(ringInfo.rings), 1)
+        self.assertEqual(set(ringInfo.rings[0]), set(atoms))
+        self.assertTrue(ringInfo.inRing(atoms[2], atoms[3]))
+
+    def test_fused(self):
+        molecule, atoms = decalin()
+        ringInfo = findRings(molecule.atoms)
+        self.assertEqual(sorted(len(ring) for ring in ringInfo.rings), [6, 6])
+        self.assertEqual(len(ringInfo.atomRings(atoms[0])), 2)
+        self.assertEqual(len(ringInfo.bondRings(atoms[0], atoms[5])), 2)
+        self.assertEqual(len(ringInfo.bondRings(atoms[0], atoms[1])), 1)
+
+    def test_pendant(self):
+        molecule, atoms = chain(4)
+        molecule.addBond(atoms[0], atoms[2])
+        ringInfo = findRings(molecule.atoms)
+        self.assertTrue(ringInfo.inRing(atoms[1]))
+        self.assertFalse(ringInfo.inRing(atoms[3]))
+        self.assertFalse(ringInfo.inRing(atoms[2], atoms[3]))
+
+    def test_numbers(self):
+        "Atoms can be numbers, with their bonds given by a function."
+        bonds = {0: [1, 300], 1: [0, 300], 300: [0, 1, 4], 4: [300]}
+        ringInfo = findRings([0], bonds.__getitem__)
+        self.assertEqual(sorted(ringInfo.rings[0]), [0, 1, 300])
+        self.assertFalse(ringInfo.inRing(4))
+
+
+class TestIsInRing(unittest.TestCase):
+
+    def test_ring_path(self):
+        molecule, atoms = chain(6)
+        molecule.addBond(atoms[0], atoms[5])
+        path = isInRing(atoms[0], atoms[1], molecule)
+        self.assertEqual(path, atoms[1:] + atoms[:1])
+        path = isInRing(atoms[1], atoms[0])
+        self.assertEqual(path, [atoms[0]] + atoms[:0:-1])
+
+    def test_not_in_ring(self):
+        molecule, atoms = chain(4)
+        self.assertEqual(isInRing(atoms[1], atoms[2], molecule), None)
+
+    def test_cache(self):
+        molecule, atoms = chain(6)
+        ringInfo = molecule.rings()
+        molecule.addAtom(Atom("Br"), atoms[2])
+        molecule.touchAtom(atoms[3])
+        self.assertTrue(molecule.rings() is ringInfo)
+        molecule.addBond(atoms[0], atoms[5])
+        self.assertEqual(len(molecule.rings().rings), 1)
+        molecule.begin()
+        molecule.removeBond(atoms[2], atoms[3])
+        self.assertEqual(molecule.rings().rings, [])
+        molecule.rollback()
+        self.assertEqual(len(molecule.rings().rings), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+Unit Tests for smilesStream.py
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from canonicalStore import CanonicalStore
+from compactMolecule import CompactMolecule
+from smilesStream import moleculify_stream, smilesify_stream, Record
+import toCanonical
+from toMolecule import moleculify
+from toSmiles import smilesify
+
+
+LINES = [
+    "# alkenes\n",
+    "CC=CC but-2-ene\n",
+    "\n",
+    "C=C1CCCCC1\tmethylenecyclohexane\n",
+    "C~C\n",
+    "OCC\n",
+]
+
+
+######################
+##### UNIT TESTS #####
+######################
+
+class TestMoleculifyStream(unittest.TestCase):
+
+    def test_records(self):
+        records = list(moleculify_stream(LINES))
+        self.assertEqual([record.lineno for record in records], [2, 4, 5, 6])
+        self.assertEqual([record.name for record in records],
+                         ["but-2-ene", "methylenecyclohexane", None, None])
+        self.assertEqual(records[0].smiles, "CC=CC")
+        self.assertEqual(smilesify(records[3].molecules),
+                         smilesify(moleculify("CCO")))
+
+    def test_errors(self):
+        "A bad line gives an error record, and the rest carry on."
+        records = list(moleculify_stream(LINES))
+        self.assertEqual([record.error is None for record in records],
+                         [True, True, False, True])
+        self.assertEqual(records[2].molecules, None)
+        self.assertEqual(records[2].error, "LexingError at character 2")
+
+    def test_lazy(self):
+        "Lines are only read a batch ahead."
+        def lines():
+            yield "CC\n"
+            yield "CCC\n"
+            raise AssertionError("read past the first batch")
+        stream = moleculify_stream(lines(), batchSize=1)
+        self.assertEqual(next(stream).smiles, "CC")
+
+    def test_compact(self):
+        records = list(moleculify_stream(LINES, compact=True))
+        self.assertTrue(isinstance(records[0].molecules[0], CompactMolecule))
+
+    def test_processes(self):
+        serial = [smilesify(record.molecules) for record
+                  in moleculify_stream(LINES * 5) if record.error is None]
+        parallel = list(moleculify_stream(LINES * 5, processes=2, batchSize=3))
+        self.assertEqual([smilesify(record.molecules) for record in parallel
+                          if record.error is None], serial)
+        self.assertEqual(len(parallel), 20)
+
+    def test_worker_store(self):
+        "What the workers canonicalize reaches the store they share."
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "canonical.sqlite3")
+        toCanonical.open_store(path)
+        toCanonical.clear_cache()
+        try:
+            lines = ["S%sF\n" % ("C" * n) for n in xrange(1, 9)]
+            records = list(moleculify_stream(lines, processes=2,
+                                             batchSize=2))
+            self.assertEqual(len(records), 8)
+            store = CanonicalStore(path, toCanonical.backend())
+            known = store.getMany([line.strip() for line in lines])
+            self.assertEqual(sorted(known), sorted(line.strip()
+                                                   for line in lines))
+        finally:
+            toCanonical.open_store(None)
+            shutil.rmtree(directory)
+
+
+class TestSmilesifyStream(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        source = os.path.join(self.directory, "in.smi")
+        sink = os.path.join(self.directory, "out.smi")
+        with open(source, 'w') as out:
+            out.writelines(LINES)
+        written = list(smilesify_stream(moleculify_stream(source), sink))
+        self.assertEqual(len(written), 4)
+        with open(sink) as lines:
+            lines = lines.readlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0], "%s but-2-ene\n" % written[0].smiles)
+        self.assertEqual([smilesify(record.molecules) for record
+                          in moleculify_stream(lines)],
+                         [record.smiles for record in written
+                          if record.error is None])
+
+    def test_molecules(self):
+        sink = os.path.join(self.directory, "out.smi")
+        records = list(smilesify_stream(
+            [moleculify("CCO")[0], moleculify("CC.O")], sink))
+        self.assertEqual([record.lineno for record in records], [1, 2])
+        self.assertTrue(isinstance(records[0], Record))
+        with open(sink) as lines:
+            self.assertEqual(lines.read(), "%s\n%s\n" % (records[0].smiles,
+                                                       records[1].smiles))
+        self.assertEqual(records[1].smiles, smilesify(moleculify("O.CC")))
@@ -0,0 +1,125 @@
+"""
+Unit Tests for toCanonical.py
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+import unittest
+
+import toCanonical
+from toCanonical import to_canonical, to_canonical_batch, cache_info, \
+                        resize_cache, clear_cache, open_store, \
+                        use_backend, backend
+
+
+######################
+##### UNIT TESTS #####
+######################
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        resize_cache(toCanonical.CACHE_SIZE)
+        clear_cache()
+
+    def tearDown(self):
+        resize_cache(toCanonical.CACHE_SIZE)
+
+    def test_hits(self):
+        canonical = to_canonical("OCC")
+        self.assertEqual(to_canonical("OCC"), canonical)
+        info = cache_info()
+        self.assertEqual((info['hits'], info['misses']), (1, 1))
+
+    def test_fixed_point(self):
+        canonical = to_canonical("OCC")
+        self.assertEqual(to_canonical(canonical), canonical)
+        self.assertEqual(cache_info()['hits'], 1)
+
+    def test_batch(self):
+        output = to_canonical_batch(["OCC", "CCN", "OCC"])
+        self.assertEqual(output[0], output[2])
+        self.assertEqual(to_canonical("OCC"), output[0])
+        info = cache_info()
+        self.assertEqual(info['misses'], 3)
+        self.assertEqual(info['hits'], 1)
+
+    def test_evictions(self):
+        resize_cache(2)
+        to_canonical("OCC")
+        to_canonical("CCN")
+        info = cache_info()
+        self.assertEqual(info['size'], 2)
+        self.assertTrue(info['evictions'] >= 1)
+        to_canonical("NCC")
+        self.assertEqual(cache_info()['misses'], 3)
+        clear_cache()
+        self.assertEqual(cache_info()['size'], 0)
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        clear_cache()
+        self.directory = tempfile.mkdtemp()
+        open_store(os.path.join(self.directory, "canonical.sqlite3"))
+
+    def tearDown(self):
+        open_store(None)
+        shutil.rmtree(self.directory)
+
+    def test_shared(self):
+        canonical = to_canonical("OCC")
+        toCanonical._store.flush()
+        clear_cache()
+        convert = toCanonical._convert
+        toCanonical._convert = None # any conversion would fail
+        try:
+            self.assertEqual(to_canonical("OCC"), canonical)
+            self.assertEqual(to_canonical(canonical), canonical)
+        finally:
+            toCanonical._convert = convert
+
+    def test_reopen(self):
+        "Opening stores, even ones that can't be used, adds no exit handlers."
+        handlers = len(atexit._exithandlers)
+        for _ in xrange(3):
+            open_store(os.path.join(self.directory, "canonical.sqlite3"))
+        open_store(os.path.join(self.directory, "missing", "x.sqlite3"))
+        self.assertEqual(to_canonical("OCC"), to_canonical("CCO"))
+        self.assertEqual(len(atexit._exithandlers), handlers)
+
+
+class TestBackends(unittest.TestCase):
+
+    def setUp(self):
+        self.previous = backend()
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def test_native(self):
+        use_backend('native')
+        canonical = to_canonical("OCC")
+        self.assertEqual(canonical, "CCO")
+        self.assertEqual(to_canonical("C(C)O"), canonical)
+        self.assertEqual(to_canonical("CC(N)CC(O)=O"),
+                         to_canonical("OC(=O)CC(N)C"))
+        self.assertEqual(to_canonical("C1CC"), "C1CC") # can't be parsed
+        self.assertEqual(to_canonical("C1=CC=CC=C1"), "c1ccccc1")
+        self.assertEqual(to_canonical("C:1:C:C:C:C:C1"), "c1ccccc1")
+
+    def test_switch_clears(self):
+        to_canonical("OCC")
+        use_backend('native')
+        self.assertEqual(cache_info()['size'], 0)
+
+    def test_unknown(self):
+        self.assertRaises(StandardError, use_backend, 'rdkit')
+        self.assertEqual(backend(), self.previous)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,16 +3,27 @@ Unit Tests for toMolecule.py
 """
 
 import itertools
+import os
 from random import random, randrange
+import shutil
+import tempfile
 import unittest
 
+import buildParseTable
 from molecularStructure import Atom, Molecule
+import toMolecule
 from toMolecule import moleculify, BASIC_BONDS
-from toSmiles import smilesify, to_canonical
+from toSmiles import smilesify
+import toCanonical
+from toCanonical import to_canonical
 
 
 DEBUG = True
 
+def openbabel_canonical(smiles):
+    "OpenBabel's canonical form of smiles, whichever backend is in use."
+    return toCanonical._convert_openbabel([smiles])[0]
+
 ######################
 ##### UNIT TESTS #####
 ######################
@@ -124,16 +135,24 @@ class TestToMolecule(unittest.TestCase):
     "Test ALL the features!"
 
     def assertOne(self, smi):
-        "Assert that a single smiles is OK."
+        """
+        Assert that a single smiles is OK: its canonical form doesn't depend
+        on how it was written, and reads back as itself. With OpenBabel
+        installed, OpenBabel also has to read it as the same molecule.
+        """
         try:
+            canonical = smilesify(moleculify(smi), canonical=True)
             self.assertEqual(
-                to_canonical(smi),
-                smilesify(moleculify(smi), canonical=True)
+                canonical,
+                smilesify(moleculify(to_canonical(smi)), canonical=True)
             )
             self.assertEqual(
-                to_canonical(smi),
-                smilesify(moleculify(to_canonical(smi)), canonical=True)
+                canonical,
+                smilesify(moleculify(canonical), canonical=True)
             )
+            if toCanonical.openbabel is not None:
+                self.assertEqual(openbabel_canonical(canonical),
+                                 openbabel_canonical(smi))
         except AssertionError, StandardError:
             if DEBUG:
                 print "\n%s\n" % smi
@@ -150,10 +169,7 @@ class TestToMolecule(unittest.TestCase):
             smilesify(moleculify(smiles1), canonical=True),
             smilesify(moleculify(smiles2), canonical=True)
         )
-        self.assertEqual(
-            to_canonical(smiles1),
-            smilesify(moleculify(smiles1), canonical=True)
-        )
+        self.assertOne(smiles1)
 
     def assertSameMany(self, smileses):
         "Assert that each in a list of smiles are identical."
@@ -271,7 +287,7 @@ class TestToMolecule(unittest.TestCase):
             (r"C(CC.CCC)CCC.CCCC", [r"CCC", r"C(CC)CCC", r"CCCC"])
         ]
         for (dotted, split) in smiles_groups:
-            first = to_canonical('.'.join([to_canonical(i) for i in split]))
+            first = '.'.join(sorted([smilesify(moleculify(i)) for i in split]))
             second = smilesify(moleculify(dotted))
             self.assertEqual(first, second)
 
@@ -480,3 +496,171 @@ class TestToMolecule(unittest.TestCase):
     #     self.assertSame("C1CCC", "CCCC")
     #     self.assertSame("D[CH3]", "[2H][CH3]")
     #     self.assertSame("T[CH3]", "[3H][CH3]")
+
+
+@unittest.skipIf(toCanonical.openbabel is None, "OpenBabel is not installed")
+class TestAgainstOpenBabel(unittest.TestCase):
+    "Our canonical SMILES, checked against OpenBabel's."
+
+    def test_dotted(self):
+        for smiles in [r"CCC.CCCC", r"C(CC.CCC)CCC.CCCC", r"O.CC(=O)O"]:
+            self.assertEqual(
+                openbabel_canonical(smilesify(moleculify(smiles))),
+                openbabel_canonical(smiles))
+
+    def test_aromatic(self):
+        "Kekule rings come out as OpenBabel reads them: aromatic."
+        for smiles in [r'C1=CC=CC=C1', r'C:1:C:C:C:C:C1',
+                       r'C1=CC=CC(CCC2)=C12', r'C1OC=CC=1', r'C1=CNC=C1']:
+            ours = smilesify(moleculify(smiles, canonical=True))
+            self.assertEqual(openbabel_canonical(ours),
+                             openbabel_canonical(smiles))
+            self.assertEqual(ours, smilesify(moleculify(smiles)))
+
+
+class TestPaths(unittest.TestCase):
+    """
+    A molecule writes the same canonical SMILES whether OpenBabel or our
+    own parser read it, since the writer aromatizes Kekule rings itself.
+    urls.py compares strings from both.
+    """
+
+    def test_aromatic(self):
+        for kekule, aromatic in [(r'C1=CC=CC=C1', r'c1ccccc1'),
+                                 (r'C1=CNC=C1', r'c1cc[nH]c1'),
+                                 (r'C1=CC=CC(CCC2)=C12', r'c1ccc2CCCc2c1')]:
+            written = set()
+            for smiles in (kekule, aromatic):
+                written.add(smilesify(moleculify(smiles)))
+                written.add(smilesify(moleculify(smiles, canonical=True)))
+                written.add(smilesify(moleculify(smiles,
+                                                 implicitHydrogens=True)))
+            self.assertEqual(len(written), 1, written)
+
+
+class TestTrustedCanonical(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (toMolecule.to_canonical, toMolecule.to_canonical_batch,
+                      toMolecule._moleculify_direct)
+
+    def tearDown(self):
+        (toMolecule.to_canonical, toMolecule.to_canonical_batch,
+         toMolecule._moleculify_direct) = self.saved
+
+    def forbidCanonicalizing(self):
+        def fail(*args):
+            raise AssertionError("canonicalized a trusted string")
+        toMolecule.to_canonical = toMolecule.to_canonical_batch = fail
+        toMolecule._moleculify_direct = fail
+
+    def test_round_trip(self):
+        smileses = [smilesify(moleculify(smiles)) for smiles in
+                    ["OCC", "CC(=O)O", "C1CCCCC1Br", "c1ccccc1", "CC.O"]]
+        self.forbidCanonicalizing()
+        for smiles in smileses:
+            self.assertEqual(smilesify(moleculify(smiles, canonical=True)),
+                             smiles)
+        self.assertEqual(
+            len(moleculify(smileses, implicitHydrogens=True, canonical=True)),
+            6)
+
+
+class TestParseTables(unittest.TestCase):
+
+    def test_committed(self):
+        "The saved tables are for the current grammar."
+        path = toMolecule._tablePath(toMolecule._grammar())
+        self.assertTrue(os.path.exists(path))
+
+    def test_rebuild(self):
+        "Missing tables are built in memory, and nothing is written."
+        directory = tempfile.mkdtemp()
+        saved = toMolecule.PARSE_TABLE_DIR
+        toMolecule.PARSE_TABLE_DIR = directory
+        try:
+            built = toMolecule._buildParser()
+            self.assertEqual(os.listdir(directory), [])
+            buildParseTable.save(directory)
+            self.assertEqual(len(os.listdir(directory)), 1)
+            loaded = toMolecule._buildParser()
+            self.assertEqual(loaded.lr_table.lr_action,
+                             built.lr_table.lr_action)
+        finally:
+            toMolecule.PARSE_TABLE_DIR = saved
+            shutil.rmtree(directory)
+
+    def test_replace(self):
+        "The build script leaves only the current grammar's tables."
+        directory = tempfile.mkdtemp()
+        try:
+            open(os.path.join(directory, "molparser-1-old.json"), 'w').close()
+            path = buildParseTable.save(directory)
+            self.assertEqual(os.listdir(directory), [os.path.basename(path)])
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestTokenize(unittest.TestCase):
+
+    def names(self, smiles):
+        return [token.gettokentype() for token in toMolecule.tokenize(smiles)]
+
+    def test_bonds(self):
+        "Bonds straight before an atom get the tilde tokens."
+        self.assertEqual(self.names("C=C1"), ['C', '~=~', 'C', 'DIGIT'])
+        self.assertEqual(self.names("C1=CC=1"),
+                         ['C', 'DIGIT', '~=~', 'C', 'C', '=', 'DIGIT'])
+        self.assertEqual(self.names("C(:[n])"),
+                         ['C', '(', '~colon~', '[', 'n', ']', ')'])
+        self.assertEqual(self.names("C%12/C"),
+                         ['C', '%', 'DIGIT', 'DIGIT', '~/~', 'C'])
+
+    def test_whitespace(self):
+        self.assertEqual(self.names(" C= C\n"), ['C', '=', 'C'])
+
+    def test_error(self):
+        with self.assertRaises(toMolecule.LexingError) as context:
+            list(toMolecule.tokenize("CC~C"))
+        self.assertEqual(context.exception.getsourcepos().idx, 2)
+
+
+class TestTemplates(unittest.TestCase):
+
+    def setUp(self):
+        toMolecule._templates.clear()
+        self.parse = toMolecule._parse
+        self.parsed = []
+
+        def parse(smiles):
+            self.parsed.append(smiles)
+            return self.parse(smiles)
+        toMolecule._parse = parse
+
+    def tearDown(self):
+        toMolecule._parse = self.parse
+
+    def test_parsed_once(self):
+        moleculify("CCO")
+        moleculify(["O", "CCO"])
+        parsed = len(self.parsed)
+        for _ in xrange(3):
+            moleculify("CCO")
+            moleculify(["O", "CCO"])
+        self.assertEqual(len(self.parsed), parsed)
+        self.assertTrue(toMolecule._templates.info()['hits'] >= 9)
+
+    def test_copies(self):
+        "Changing what moleculify returns doesn't change the next result."
+        first = moleculify("CCO")[0]
+        first.addAtom(Atom("Cl"), first.atoms[0], 1)
+        second = moleculify("CCO")[0]
+        self.assertFalse(set(first.atoms) & set(second.atoms))
+        self.assertEqual(smilesify(second), smilesify(moleculify("OCC")))
+        self.assertNotEqual(smilesify(first), smilesify(second))
+
+    def test_hydrogen_modes(self):
+        explicit = moleculify("CC")[0]
+        implicit = moleculify("CC", implicitHydrogens=True)[0]
+        self.assertEqual(len(explicit.atoms), 8)
+        self.assertEqual(len(implicit.atoms), 2)
@@ -0,0 +1,191 @@
+"""
+Unit Tests for toSmiles.py
+"""
+
+import unittest
+
+from molecularStructure import Atom, Molecule
+from toSmiles import smilesify
+
+
+######################
+##### UNIT TESTS #####
+######################
+
+def build(elements, bonds, hydrogens=True):
+    """
+    Returns (molecule, atoms): atoms made from elements, bonded by bonds,
+    a list of (i, j, order) where atom i is already in the molecule.
+    Atoms go into the molecule in the order bonds reach them.
+    """
+    atoms = [Atom(element) for element in elements]
+    molecule = Molecule(atoms[bonds[0][0]] if bonds else atoms[0])
+    for i, j, order in bonds:
+        if atoms[j] in molecule.atoms:
+            molecule.addBond(atoms[i], atoms[j], order)
+        else:
+            molecule.addAtom(atoms[j], atoms[i], order)
+    if hydrogens:
+        molecule.addHydrogens()
+    return molecule, atoms
+
+
+class TestCanonical(unittest.TestCase):
+    "Canonical SMILES are written natively."
+
+    def test_atom_order(self):
+        "The same molecule, stored two ways, gives the same string."
+        first, _ = build(['C', 'C', 'O', 'C'],
+                         [(0, 1, 1), (1, 2, 2), (1, 3, 1)])
+        second, _ = build(['O', 'C', 'C', 'C'],
+                          [(0, 2, 2), (2, 1, 1), (2, 3, 1)])
+        self.assertEqual(smilesify(first), "CC(C)=O")
+        self.assertEqual(smilesify(second), "CC(C)=O")
+
+    def test_hydrogens(self):
+        "Explicit and implicit hydrogens write the same."
+        explicit, _ = build(['C', 'O'], [(0, 1, 1)])
+        implicit, _ = build(['C', 'O'], [(0, 1, 1)])
+        implicit.collapseHydrogens()
+        self.assertEqual(smilesify(explicit), "CO")
+        self.assertEqual(smilesify(implicit), "CO")
+
+    def test_rings(self):
+        molecule, atoms = build(['C'] * 6, [(i, (i + 1) % 6, 1)
+                                             for i in xrange(6)])
+        self.assertEqual(smilesify(molecule), "C1CCCCC1")
+
+    def test_charge_and_isotope(self):
+        molecule, atoms = build(['C', 'O'], [(0, 1, 1)], hydrogens=False)
+        atoms[1].charge = -1
+        atoms[1].hcount = 0
+        atoms[0].isotope = 13
+        molecule.addHydrogens()
+        self.assertEqual(smilesify(molecule), "[13CH3][O-]")
+
+    def test_chirality(self):
+        "Mirror images differ; a center with two equal groups isn't chiral."
+        def bromochlorofluoromethane(flip):
+            molecule, atoms = build(['C', 'F', 'Cl', 'Br', 'H'],
+                                    [(0, i, 1) for i in xrange(1, 5)])
+            others = atoms[2:] if not flip else atoms[3:1:-1] + atoms[4:]
+            atoms[0].newChiralCenter(atoms[1], others)
+            return smilesify(molecule)
+        self.assertNotEqual(bromochlorofluoromethane(False),
+                            bromochlorofluoromethane(True))
+        self.assertTrue('@' in bromochlorofluoromethane(False))
+
+        molecule, atoms = build(['C', 'F', 'Cl', 'Cl', 'H'],
+                                [(0, i, 1) for i in xrange(1, 5)])
+        atoms[0].newChiralCenter(atoms[1], atoms[2:])
+        self.assertEqual(smilesify(molecule), "ClC(Cl)F")
+
+    def test_ring_stereo(self):
+        """
+        Ring cis-trans isomers differ, though each center has two equal
+        ring branches; and writing either one from elsewhere changes nothing.
+        """
+        from toMolecule import moleculify
+        ## Two isomers, and the first written differently
+        isomers = [
+            ("C[C@H]1CC[C@@H](O)CC1", "C[C@H]1CC[C@H](O)CC1",
+             "O[C@H]1CC[C@@H](C)CC1"),
+            ("Br[C@H]1CC[C@H](Br)CC1", "Br[C@H]1CC[C@@H](Br)CC1",
+             "C1[C@H](Br)CC[C@@H](Br)C1"),
+            ("C[C@H]1C[C@@H](O)C1", "C[C@H]1C[C@H](O)C1",
+             "O[C@H]1C[C@@H](C)C1"),
+        ]
+        for smileses in isomers:
+            first, second, rewritten = [smilesify(moleculify(smiles))
+                                        for smiles in smileses]
+            self.assertNotEqual(first, second)
+            self.assertTrue('@' in first and '@' in second)
+            self.assertEqual(rewritten, first)
+        self.assertEqual(smilesify(moleculify("OC1CC[C@H](O)CC1")),
+                         "OC1CCC(O)CC1")
+
+    def test_aromatic(self):
+        "Aromatic rings written in Kekule form come out aromatic."
+        from toMolecule import moleculify
+        kekule, atoms = build(['C'] * 6, [(i, (i + 1) % 6, 1 + i % 2)
+                                          for i in xrange(6)])
+        self.assertEqual(smilesify(kekule), "c1ccccc1")
+        self.assertEqual(atoms[0].is_aromatic, False)
+        self.assertEqual(atoms[0].neighbors[atoms[1]], 1)
+        for first, second in [("C1=CNC=C1", "c1cc[nH]c1"),
+                              ("C1=CC=NC=C1", "c1ccncc1"),
+                              ("C1=CC=C2C=CC=CC2=C1", "c1ccc2ccccc2c1"),
+                              ("C1=CC=C2C=CC=C2C=C1", "c1ccc2cccc2cc1"),
+                              ("O=C1C=CNC=C1", "O=c1cc[nH]cc1"),
+                              ("C:1:C:C:C:C:C1", "c1ccccc1")]:
+            self.assertEqual(smilesify(moleculify(first)),
+                             smilesify(moleculify(second)))
+        ## Not aromatic: 8 pi electrons, or an sp3 carbon in the ring.
+        self.assertEqual(smilesify(moleculify("C1=CC=CC=CC=C1")),
+                         "C=1C=CC=CC=CC1")
+        self.assertEqual(smilesify(moleculify("C1=CCC=C1")), "C=1C=CCC1")
+
+    def test_orphan_hydrogen(self):
+        "A hydrogen left behind by a removed atom isn't written."
+        molecule, atoms = build(['C', 'C', 'O'], [(0, 1, 1), (1, 2, 1)])
+        hydrogen = [atom for atom in atoms[2].neighbors
+                    if atom.element == 'H'][0]
+        molecule.removeAtom(atoms[2])
+        self.assertTrue(hydrogen in molecule.atoms)
+        self.assertEqual(smilesify(molecule), "[CH2]C")
+        self.assertEqual(smilesify(Molecule(Atom('H'))), "[H]")
+
+    def test_random_molecules(self):
+        "Random molecules read back as they were written."
+        import random
+        from randomGenerator import random_molecule
+        from toMolecule import moleculify
+        random.seed(0)
+        for _ in xrange(100):
+            try:
+                molecule = random_molecule()
+            except StandardError:
+                continue # the generator gives up now and then
+            smiles = smilesify(molecule)
+            self.assertFalse('[H]' in smiles)
+            self.assertEqual(
+                smilesify(moleculify(smilesify(molecule, canonical=False))),
+                smiles)
+
+    def test_list(self):
+        "Lists come out sorted, whatever order they came in."
+        water, _ = build(['O'], [])
+        ethane, _ = build(['C', 'C'], [(0, 1, 1)])
+        self.assertEqual(smilesify([water, ethane]), "CC.O")
+        self.assertEqual(smilesify([ethane, water]), "CC.O")
+
+
+class TestWriter(unittest.TestCase):
+    "The plain (non-canonical) writer."
+
+    def test_leaves_molecule_alone(self):
+        molecule, atoms = build(['O', 'C', 'C', 'Br'],
+                                [(0, 1, 1), (1, 2, 1), (2, 3, 1)])
+        before = list(molecule.atoms)
+        first = smilesify(molecule, canonical=False)
+        self.assertEqual(molecule.atoms, before)
+        self.assertEqual(smilesify(molecule, canonical=False), first)
+
+    def test_branch_order(self):
+        "Branches are ordered by the atoms, not by how they were added."
+        first, _ = build(['C', 'O', 'N'], [(0, 1, 1), (0, 2, 1)])
+        second, _ = build(['C', 'N', 'O'], [(0, 1, 1), (0, 2, 1)])
+        self.assertEqual(smilesify(first, canonical=False),
+                         smilesify(second, canonical=False))
+
+    def test_long_chain(self):
+        "Far longer than the recursion limit."
+        molecule, atoms = build(['C'] * 3000,
+                                [(i, i + 1, 1) for i in xrange(2999)])
+        self.assertEqual(smilesify(molecule, canonical=False).count('[C]'),
+                         3000)
+        self.assertEqual(smilesify(molecule), 'C' * 3000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,30 +4,302 @@ Convert any SMILES string into a canonical SMILES string.
 Refer to:
 http://openbabel.org/dev-api/canonical_code_algorithm.shtml
 
+Canonical forms are memoized in a size-bounded LRU shared by all threads,
+keyed by the input string; each output is stored as its own canonical form
+too. See cache_info. Behind that, open_store adds a table on disk that
+every worker on the host shares and that outlives restarts.
+
+Two canonicalizers are available (see use_backend):
+    'openbabel' :: OpenBabel's canonical SMILES. The default, if OpenBabel
+        is installed.
+    'native' :: Our own parser and canonical writer (toMolecule, toSmiles),
+        in pure Python, for processes that can't or don't want to load
+        OpenBabel. Like OpenBabel, it writes aromatic rings given in Kekule
+        form as aromatic (see toSmiles._aromatize), but its canonical
+        strings differ from OpenBabel's.
+
 Public-facing methods:
     `to_canonical`
+    `to_canonical_batch`
+    `cache_info`, `resize_cache`, `clear_cache`
+    `open_store`
+    `use_backend`, `backend`
 """
 
-import openbabel
+import atexit
+from collections import OrderedDict
+import threading
+
+try:
+    import openbabel
+except ImportError:
+    openbabel = None
+
+from canonicalStore import CanonicalStore
 
 VERBOSE = False
 
+BACKENDS = ('openbabel', 'native')
+
+CACHE_SIZE = 4096 # SMILES strings, inputs and outputs both
+
+# Each thread's OpenBabel converter, made the first time that thread needs
+# one. OBConversion keeps state between calls, so threads can't share one.
+_local = threading.local()
+
+# The CanonicalStore opened by open_store, if any.
+_store = None
+
+_backend = 'openbabel' if openbabel is not None else 'native'
+
+
 def to_canonical(smiles):
     """
-    Uses OpenBabel.
     Converts a SMILES string to a canonical SMILES string.
     smiles :: str.
     return :: str.
     """
-    obConversion = openbabel.OBConversion()
-    obConversion.SetInAndOutFormats("smi", "can")
-    outMol = openbabel.OBMol()
-    if VERBOSE:
-        print "Canonicalizing: %s" % str(smiles)
-    obConversion.ReadString(outMol, str(smiles))
-    ans = obConversion.WriteString(outMol)
-    if len(ans.strip()) == 0:
-        # TODO: Something is grievously wrong
-        return smiles
-        raise StandardError("%s %s" % (smiles, ans.strip()))
-    return ans.strip()
+    return to_canonical_batch([smiles])[0]
+
+
+def to_canonical_batch(smileses):
+    """
+    Converts SMILES strings to canonical SMILES strings in one pass. With
+    OpenBabel, this thread's converter and a single OBMol are reused for all
+    of them.
+    smileses :: [str].
+    return :: [str]. In the same order.
+    """
+    output = [_memo.get(smiles) for smiles in smileses]
+    missing = [smiles for smiles, canonical in zip(smileses, output)
+               if canonical is None]
+    if not missing:
+        return output
+    store = _store
+    converted = store.getMany(missing) if store is not None else {}
+    for smiles, canonical in converted.iteritems():
+        _memo.put(smiles, canonical)
+    missing = [smiles for smiles in set(missing) if smiles not in converted]
+    if missing:
+        fresh = zip(missing, _convert(missing))
+        for smiles, canonical in fresh:
+            _memo.put(smiles, canonical)
+        if store is not None:
+            store.putMany(fresh + [(canonical, canonical)
+                                   for smiles, canonical in fresh])
+        converted.update(fresh)
+    return [canonical if canonical is not None else converted[smiles]
+            for smiles, canonical in zip(smileses, output)]
+
+
+def cache_info():
+    """
+    return :: {str: int}. 'hits', 'misses' and 'evictions' since the last
+        clear_cache(), and the cache's current 'size' and 'maxsize'.
+    """
+    return _memo.info()
+
+
+def resize_cache(maxsize):
+    """
+    Bounds the cache at maxsize strings, evicting the least recently used
+    ones if it is over. 0 turns it off.
+    maxsize :: int.
+    """
+    _memo.resize(maxsize)
+
+
+def clear_cache():
+    "Empties the cache and zeroes its statistics."
+    _memo.clear()
+
+
+def open_store(path):
+    """
+    Backs the cache with the CanonicalStore at path, creating it if need be.
+    path :: str or None. None closes the store.
+    """
+    global _store
+    if _store is not None:
+        _store.flush()
+    _store = CanonicalStore(path, _backend) if path is not None else None
+
+
+def use_backend(name):
+    """
+    Switches canonicalizer, emptying the cache, since each writes its own
+    canonical forms. A store, if open, is switched to the new backend's
+    table.
+    name :: str. One of BACKENDS.
+    """
+    global _backend
+    if name not in BACKENDS:
+        raise StandardError("Unknown canonicalizer %r; expected one of %r"
+                            % (name, BACKENDS))
+    if name == 'openbabel' and openbabel is None:
+        raise StandardError("OpenBabel is not installed")
+    _backend = name
+    clear_cache()
+    if _store is not None:
+        open_store(_store.path)
+
+
+def backend():
+    "return :: str. The canonicalizer in use, one of BACKENDS."
+    return _backend
+
+
+def _flush_store():
+    "Writes out what the open store has buffered, if there is one."
+    store = _store
+    if store is not None:
+        store.flush()
+
+## Once for the process, rather than once per store opened.
+atexit.register(_flush_store)
+
+
+def _convert(smileses):
+    """
+    Runs smileses through the current backend, uncached.
+    smileses :: [str].
+    return :: [str].
+    """
+    if _backend == 'native':
+        return _convert_native(smileses)
+    return _convert_openbabel(smileses)
+
+
+def _convert_native(smileses):
+    """
+    Parses each of smileses as written and writes it back out with our own
+    canonical SMILES writer. Strings that can't be parsed come back as they
+    are, as with OpenBabel.
+    smileses :: [str].
+    return :: [str].
+    """
+    ## Imported here: toMolecule imports this module.
+    from rply.errors import LexingError, ParsingError
+    from toMolecule import _parse
+    from toSmiles import smilesify
+    output = []
+    for smiles in smileses:
+        if VERBOSE:
+            print "Canonicalizing: %s" % str(smiles)
+        try:
+            output.append(smilesify(_parse(smiles)) or smiles)
+        except (LexingError, ParsingError, AssertionError):
+            ## The parser reports most malformed input by failing asserts.
+            output.append(smiles)
+    return output
+
+
+def _convert_openbabel(smileses):
+    """
+    Runs smileses through OpenBabel.
+    smileses :: [str].
+    return :: [str].
+    """
+    obConversion, outMol = _converter()
+    output = []
+    for smiles in smileses:
+        if VERBOSE:
+            print "Canonicalizing: %s" % str(smiles)
+        outMol.Clear()
+        obConversion.ReadString(outMol, str(smiles))
+        ans = obConversion.WriteString(outMol)
+        if len(ans.strip()) == 0:
+            # TODO: Something is grievously wrong
+            output.append(smiles)
+            continue
+            raise StandardError("%s %s" % (smiles, ans.strip()))
+        output.append(ans.strip())
+    return output
+
+
+def _converter():
+    """
+    return :: (OBConversion, OBMol). This thread's, set up for SMILES in and
+        canonical SMILES out.
+    """
+    try:
+        return _local.converter
+    except AttributeError:
+        obConversion = openbabel.OBConversion()
+        obConversion.SetInAndOutFormats("smi", "can")
+        _local.converter = (obConversion, openbabel.OBMol())
+        return _local.converter
+
+
+class _LRU(object):
+    """
+    A size-bounded map that forgets the least recently used entries first.
+    Safe to share between threads. Here it maps SMILES to canonical SMILES;
+    toMolecule keeps its parsed templates in one too.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, smiles):
+        """
+        smiles :: str.
+        return :: str or None. The canonical form, if cached.
+        """
+        with self._lock:
+            try:
+                canonical = self._entries.pop(smiles)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries[smiles] = canonical
+            self.hits += 1
+            return canonical
+
+    def put(self, smiles, canonical):
+        """
+        Caches canonical as the canonical form of smiles, and of itself.
+        smiles :: str.
+        canonical :: str.
+        """
+        self.putAll((canonical, smiles), canonical)
+
+    def putAll(self, keys, value):
+        """
+        Caches value under each of keys.
+        keys :: iterable of hashable.
+        """
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                self._entries[key] = value
+            self._evict()
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'size': len(self._entries),
+                    'maxsize': self.maxsize}
+
+    def _evict(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+_memo = _LRU(CACHE_SIZE)
@@ -19,13 +19,19 @@ Refer to:
     http://www.opensmiles.org/opensmiles.html
 """
 import itertools
-import re
+import json
+import os
+import threading
 
-from rply import ParserGenerator, LexerGenerator, ParsingError
-from rply.token import BaseBox
+from rply import ParserGenerator, ParsingError, Token
+from rply.errors import LexingError
+from rply.parser import LRParser
+from rply.parsergenerator import Grammar, LRTable
+from rply.token import BaseBox, SourcePosition
 
 from molecularStructure import Molecule, Atom, DEBUG
-from toCanonical import to_canonical
+from obBridge import readSmiles
+from toCanonical import to_canonical, to_canonical_batch, backend, _LRU
 
 #### TODO ----
 # Tetrahedral Allene-like Systems
@@ -39,31 +45,157 @@ from toCanonical import to_canonical
 ##### PUBLIC FUNCTIONS #####
 ############################
 
-def moleculify(smiles):
+def moleculify(smiles, implicitHydrogens=False, canonical=False):
     """
     smiles :: str or [str]. SMILES string(s) e.g. "CC(CN)CCC(O)O"
+    implicitHydrogens :: bool. If True, the molecules come back in
+        implicit-hydrogen mode (see Molecule.collapseHydrogens).
+    canonical :: bool. If True, smiles is trusted to be canonical already,
+        as smilesify(..., canonical=True) writes it, and goes straight to
+        our parser without OpenBabel. Don't pass True for anything the
+        engine didn't write itself.
     return :: [Molecule].
 
     Raises a StandardError if the SMILES string contains
     as-yet-unsupported features (like delocalization).
+
+    With OpenBabel canonicalizing (see toCanonical.backend), whatever it can
+    hand over directly (see obBridge.readSmiles) skips the canonical SMILES
+    text and our parser. Strings read before are copied from the templates
+    kept for them (see TEMPLATES below) instead of being read again.
     """
     #return example_molecule()
     if isinstance(smiles, list):
-        return [m for i in smiles for m in moleculify(i)]
+        for i in smiles:
+            assert len(i) != 0
+        found = [_recall(i, implicitHydrogens) for i in smiles]
+        if canonical:
+            output = []
+            for i, molecules in zip(smiles, found):
+                if molecules is None:
+                    molecules = _moleculify_canonical(i, implicitHydrogens)
+                output += molecules
+            return output
+        direct = [molecules if molecules is not None
+                  else _moleculify_direct(i, implicitHydrogens)
+                  for i, molecules in zip(smiles, found)]
+        ## Canonicalize the rest in one go, then parse each.
+        rest = iter(to_canonical_batch(
+            [i for i, molecules in zip(smiles, direct) if molecules is None]))
+        output = []
+        for i, molecules in zip(smiles, direct):
+            if molecules is None:
+                molecules = _moleculify_canonical(next(rest), implicitHydrogens,
+                                                  i)
+            output += molecules
+        return output
     else:
-        try:
-            assert len(smiles) != 0
-            smiles = to_canonical(smiles)
-            assert len(smiles) != 0
-            smiles = preprocess(smiles)
-            assert len(smiles) != 0
-            lexed = LEXER.lex(smiles)
-            return PARSER.parse(lexed)
-        except ParsingError as e:
-            if DEBUG:
-                raise StandardError(e.getsourcepos())
+        assert len(smiles) != 0
+        molecules = _recall(smiles, implicitHydrogens)
+        if molecules is None and not canonical:
+            molecules = _moleculify_direct(smiles, implicitHydrogens)
+        if molecules is None:
+            if not canonical:
+                smiles, original = to_canonical(smiles), smiles
             else:
-                return Molecule(Atom("*"))
+                original = None
+            molecules = _moleculify_canonical(smiles, implicitHydrogens,
+                                              original)
+        return molecules
+
+
+def _moleculify_direct(smiles, implicitHydrogens):
+    """
+    moleculify through obBridge, without canonicalizing.
+    return :: [Molecule] or None. None if it has to go the long way round.
+    """
+    if backend() != 'openbabel':
+        return None
+    molecules = readSmiles(smiles)
+    if molecules is not None:
+        _finish(molecules, implicitHydrogens)
+        _remember([smiles], molecules, implicitHydrogens)
+    return molecules
+
+
+def _moleculify_canonical(smiles, implicitHydrogens, original=None):
+    """
+    moleculify, for a single SMILES string that has been through
+    to_canonical already.
+    original :: str or None. What smiles was canonicalized from, to be
+        remembered as well.
+    """
+    molecules = _recall(smiles, implicitHydrogens)
+    if molecules is not None:
+        if original not in (None, smiles):
+            _remember([original], molecules, implicitHydrogens)
+        return molecules
+    try:
+        molecules = _parse(smiles)
+        _finish(molecules, implicitHydrogens)
+    except ParsingError as e:
+        if DEBUG:
+            raise StandardError(e.getsourcepos())
+        else:
+            return Molecule(Atom("*"))
+    _remember(set([smiles, original or smiles]), molecules, implicitHydrogens)
+    return molecules
+
+
+def _finish(molecules, implicitHydrogens):
+    "Puts freshly read molecules in the hydrogen mode asked for."
+    if implicitHydrogens:
+        for molecule in molecules:
+            molecule.collapseHydrogens()
+
+
+def _parse(smiles):
+    """
+    Parses a SMILES string as written, without canonicalizing it first.
+    smiles :: str.
+    return :: [Molecule].
+    Raises LexingError or ParsingError if smiles can't be parsed.
+    """
+    assert len(smiles) != 0
+    return _parser().parse(tokenize(smiles))
+
+
+#####################
+##### TEMPLATES #####
+#####################
+
+## Every molecule moleculify makes is kept, as a template, under the string
+## it was asked for and under that string's canonical form, so a reagent
+## like "O" is parsed once per process. Callers change what they get back,
+## so they only ever get copies (Molecule.clone) of a template.
+
+TEMPLATE_CACHE_SIZE = 512 # SMILES strings
+
+_templates = _LRU(TEMPLATE_CACHE_SIZE)
+
+
+def _recall(smiles, implicitHydrogens):
+    """
+    return :: [Molecule] or None. Fresh copies of the template for smiles,
+        if there is one.
+    """
+    template = _templates.get(_templateKey(smiles, implicitHydrogens))
+    if template is None:
+        return None
+    return [molecule.clone()[0] for molecule in template]
+
+
+def _remember(smileses, molecules, implicitHydrogens):
+    "Keeps copies of molecules as the template for each of smileses."
+    _templates.putAll([_templateKey(smiles, implicitHydrogens)
+                       for smiles in smileses],
+                      [molecule.clone()[0] for molecule in molecules])
+
+
+def _templateKey(smiles, implicitHydrogens):
+    ## The backends read some strings differently (OpenBabel aromatizes
+    ## Kekule rings; we don't), so each gets its own templates.
+    return (backend(), smiles, implicitHydrogens)
 
 
 ############################
@@ -161,88 +293,61 @@ def int_from_digit(digit):
 ##### LEXER #####
 #################
 
-## Create a Lexer, which splits up a string into tokens.
-## Tokens may be, for example, SYMBOLs or LETTERs or TERMINATORs or DIGITs
-## Whitespace will be ignored.
-
-LG = LexerGenerator()
-LG.ignore(r"\s+")
-
-SYMBOLS = { ## key (name of token)
-    '@': r'@',   ##  : value (regex for lexer to search)
-    '%': r'%',
-    '*': r'\*',
-    '(': r'\(',
-    ')': r'\)',
-    '[': r'\[',
-    ']': r'\]',
-    '+': r'\+',
-    '.': r'\.',
-}
-for token_name, regex in SYMBOLS.iteritems():
-    LG.add(token_name, regex)
+## tokenize splits a string into the tokens the parser reads, in one pass.
+## Every token is a single character: a symbol, a letter (two-letter
+## elements are put together by the grammar), a bond or a DIGIT.
+## Whitespace is skipped.
+
+SYMBOLS = '@%*()[]+.' ## each its own token name
 
 ATOM_MATCHER = r'ABCDEFGHIKLMNOPRSTUVWXYZabcdefghiklmnoprstuvy'
 LETTERS = [letter for letter in ATOM_MATCHER]
-for token_name in LETTERS:
-    LG.add(token_name, token_name)
-
-BOND_SYMBOLS = { ## key (name of token)
-    '-': r'\-',       ##  : value (regex for lexer to search)
-    '=': r'=',
-    '#': r'#',
-    '$': r'\$',
-    'colon': r':',
-    '/': r'/',
-    '\\': r'\\',
-}
-for token_name, regex in BOND_SYMBOLS.iteritems():
-    LG.add(token_name, regex)
-
-BOND_SYMBOLS_TILDE = { ## key (name of token)
-    '~-~': r'~\-~',         ##  : value (regex for lexer to search)
-    '~=~': r'~=~',
-    '~#~': r'~#~',
-    '~$~': r'~\$~',
-    '~colon~': r'~:~',
-    '~/~': r'~/~',
-    '~\\~': r'~\\~',
-}
-for token_name, regex in BOND_SYMBOLS_TILDE.iteritems():
-    LG.add(token_name, regex)
-
-LG.add('DIGIT', r'[0-9]')
-LG.add('TERMINATOR', r'[ \t\r\n]')
-
-FOR_PREPROCESSOR = { ## key (regex for preprocessor to search)
-    r'\-': '~-~',    ##  : value (text to replace it with)
-    r'=': '~=~',
-    r'#': '~#~',
-    r'\$': '~$~',
-    r':': '~:~',
-    r'/': '~/~',
-    r'\\': '~\\~',
+
+BOND_SYMBOLS = { ## key (bond character)
+    '-': '-',    ##  : value (name of token)
+    '=': '=',
+    '#': '#',
+    '$': '$',
+    ':': 'colon',
+    '/': '/',
+    '\\': '\\',
 }
 
+## Okay, here's the deal. We can't have double bonds to rings and double
+## bonds to atoms at the same time, because problems. So, all double bonds
+## (or single bonds, or / bonds, or ...) which directly precede an atom (a
+## letter or '[') get their own tokens: the same name, but surrounded by
+## tildes.
+BOND_SYMBOLS_TILDE = dict((char, '~%s~' % name)
+                          for char, name in BOND_SYMBOLS.iteritems())
+
+WHITESPACE = ' \t\n\r\f\v'
+
+## Token name for every character that can start a token.
+TOKEN_NAMES = dict([(char, char) for char in SYMBOLS] +
+                   [(letter, letter) for letter in LETTERS] +
+                   [(digit, 'DIGIT') for digit in '0123456789'] +
+                   BOND_SYMBOLS.items())
+
+ATOM_STARTS = frozenset(LETTERS + ['['])
+
 
-def preprocess(smiles):
+def tokenize(smiles):
     """
-    Okay, here's the deal. We can't have double bonds to rings and 
-    double bonds to atoms at the same time, because problems. So,
-    all double bonds (or single bonds, or / bonds, or ...) which precede
-    a letter shall be replaced with a SPECIAL UNIQUE SEQUENCE.
-    For now, that unique sequence is "the same thing, but surrounded by
-    tildes". See the BOND_SYMBOLS_TILDE and FOR_PREPROCESSOR stuff above.
+    smiles :: str.
+    return :: iterator of Token, for the parser.
+    Raises LexingError at a character that isn't part of any token.
     """
-    output = smiles
-    for key, val in FOR_PREPROCESSOR.items():
-        output = re.sub(
-            key + r'([\[' + ATOM_MATCHER + r'])',
-            val + r'\1',
-            output
-        )
-
-    return output
+    last = len(smiles) - 1
+    for i, char in enumerate(smiles):
+        if char in WHITESPACE:
+            continue
+        name = TOKEN_NAMES.get(char)
+        if name is None:
+            raise LexingError(None, SourcePosition(i, 1, i + 1))
+        if char in BOND_SYMBOLS and i < last and smiles[i + 1] in ATOM_STARTS:
+            name = BOND_SYMBOLS_TILDE[char]
+        yield Token(name, char, SourcePosition(i, 1, i + 1))
 
 
 ##################
@@ -250,10 +355,9 @@ def preprocess(smiles):
 ##################
 
 PG = ParserGenerator(
-    SYMBOLS.keys() + LETTERS + ['DIGIT', 'TERMINATOR'] + BOND_SYMBOLS.keys() \
-        + BOND_SYMBOLS_TILDE.keys(),
+    list(SYMBOLS) + LETTERS + ['DIGIT', 'TERMINATOR'] + BOND_SYMBOLS.values() \
+        + BOND_SYMBOLS_TILDE.values(),
     precedence=[],
-    cache_id='molparser',
 )
 
 # main :: [Molecule].
@@ -959,5 +1063,82 @@ def error_handler(token, expected=None):
         print "Warning: parser error"
 
 
-LEXER = LG.build()
-PARSER = PG.build()
+## Building the parser's LALR tables takes longer than everything else in
+## this module put together, so nothing is built until the first SMILES
+## string is parsed, and the tables are loaded from PARSE_TABLE_DIR, named by
+## a hash of the grammar. Nothing is written there at runtime: the package
+## directory may be read-only, and workers would race on it. After changing
+## the grammar, run buildParseTable.py and commit the new file in place of
+## the old one; until then, each process builds the tables in memory.
+## Grammar, LRTable and LRParser are rply internals, used as they are in the
+## version requirements.txt pins (0.7.3); check them again when raising it.
+PARSE_TABLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'parsetab')
+
+_built = None # the LRParser, once _parser has made it
+_buildLock = threading.Lock()
+
+
+def _parser():
+    """
+    return :: LRParser. Made the first time it is needed.
+    """
+    global _built
+    built = _built
+    if built is None:
+        with _buildLock:
+            if _built is None:
+                _built = _buildParser()
+            built = _built
+    return built
+
+
+def _buildParser():
+    """
+    PG.build(), except that the tables are loaded from PARSE_TABLE_DIR if
+    they are there for this grammar, and never written anywhere.
+    return :: LRParser.
+    """
+    grammar = _grammar()
+    table = _loadTable(grammar)
+    if table is None:
+        table = _buildTable(grammar)
+    return LRParser(table, PG.error_handler)
+
+
+def _loadTable(grammar):
+    "return :: LRTable, or None if PARSE_TABLE_DIR has none for grammar."
+    try:
+        with open(_tablePath(grammar)) as f:
+            data = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if not PG.data_is_valid(grammar, data):
+        return None
+    return LRTable.from_cache(grammar, data)
+
+
+def _buildTable(grammar):
+    "return :: LRTable. Worked out from grammar, which it fills in."
+    grammar.build_lritems()
+    grammar.compute_first()
+    grammar.compute_follow()
+    return LRTable.from_grammar(grammar)
+
+
+def _grammar():
+    "return :: Grammar. PG's, without the tables worked out."
+    grammar = Grammar(PG.tokens)
+    for level, (assoc, terms) in enumerate(PG.precedence, 1):
+        for term in terms:
+            grammar.set_precedence(term, assoc, level)
+    for name, symbols, func, precedence in PG.productions:
+        grammar.add_production(name, symbols, func, precedence)
+    grammar.set_start()
+    return grammar
+
+
+def _tablePath(grammar):
+    "return :: str. Where grammar's tables are kept."
+    return os.path.join(PARSE_TABLE_DIR, "molparser-%s-%s.json" %
+                        (PG.VERSION, PG.compute_grammar_hash(grammar)))
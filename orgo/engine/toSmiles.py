@@ -7,79 +7,129 @@ http://en.wikipedia.org/wiki/SMILES
 Once a Molecule has been converted to a SMILES string, we can render it as an
 SVG using renderSVG.py.
 
+Canonical SMILES are written natively, without OpenBabel: atoms are ranked
+by graph invariants refined over their neighbors (as in Weininger's CANON),
+and the SMILES is written in one traversal in rank order. See
+_canonical_smiles.
+
 PROCEED CAUTIOUSLY -- THIS CODE IS FINICKY
 
 Public-facing methods:
     `smilesify`
 
 Does not yet support:
-- charge :( :( 
 - radicals :( :( 
-- isotopes
 """
 
 from molecularStructure import Molecule, Atom
+from compactMolecule import CompactMolecule, NONE, IS_CHIRAL, IS_CISTRANS
+from compactMolecule import bondOrder as storedBondOrder
 import copy
-from toCanonical import to_canonical
+import rings
 
 
 def smilesify(molecule, canonical=True):
     """
-    molecule :: Molecule or [Molecule]
+    molecule :: Molecule, CompactMolecule or a list of them
     (in the latter case, smilesify(mol) is applied for mol in the list)
 
-    Converts Molecule objects to SMILES strings. Traverses the molecule to
-    detect and mark rings or cycles. Uses a convoluted system of flags to 
-    do this. Then, passes it on to _subsmiles, which operates on a molecule
-    with rings already flagged, and performs tree traversal.
+    Converts Molecule objects to SMILES strings.
+
+    If canonical, every way of building the same molecule gives the same
+    string; plain hydrogens are folded into their heavy atoms, and
+    disconnected parts come out sorted. See _canonical_smiles.
+
+    Otherwise, traverses the molecule to detect and mark rings or cycles.
+    Uses a convoluted system of flags to do this. Then, passes it on to
+    _subsmiles, which operates on a molecule with rings already flagged, and
+    performs tree traversal.
+
+    Either way, the output is kept with the molecule (see Molecule.remember)
+    until it is next edited, so smilesifying it again costs nothing.
 
     return :: str.
     """
+    if isinstance(molecule, CompactMolecule):
+        if canonical:
+            return _canonical_smiles(molecule)
+        ## The plain writer works on Atoms.
+        molecule, _ = molecule.toMolecule()
     if isinstance(molecule, list):
         try:
             _assertMolecule(molecule[0])
         except IndexError:
             return ""
-        output = '.'.join(
-            [smilesify(molec, canonical=canonical) for molec in molecule]
-        )
+        output = [smilesify(molec, canonical=canonical) for molec in molecule]
         if canonical:
-            return to_canonical(output)
+            return '.'.join(sorted(
+                part for smiles in output for part in smiles.split('.')
+                if part))
         else:
-            return output
+            return '.'.join(output)
 
     if len(molecule.atoms) == 0:
         return ""
 
-    _initialize_non_h_neighbors(molecule)
-    _flag_rings(molecule)
-    
-    output = _get_generated_smiles(molecule)
-    _resetflags(molecule)
+    output = molecule.memo(('smiles', canonical))
+    if output is not None:
+        return output
 
-    
     if canonical:
-        output = to_canonical(output)
-        
-    return output
+        output = _canonical_smiles(molecule)
+    else:
+        state = _TraversalState(molecule)
+        _initialize_non_h_neighbors(molecule, state)
+        _flag_rings(molecule, state)
+        output = _get_generated_smiles(molecule, state)
+
+    return molecule.remember(('smiles', canonical), output)
 
 BOND_SYMBOLS = {0: '0', 1: '-', 2: '=', 3: '#', 4: '$', 1.5: ':'}
 
-def _subsmiles(molecule, start_atom, parent_atom):
+
+class _TraversalState(object):
+    """
+    Scratch space for a single smilesify call. Atoms don't carry any
+    traversal state themselves; it all lives in these side tables, keyed by
+    Atom, and is thrown away with the state once the SMILES is written.
+        self.flag :: {Atom: int}. 1 once ring-flagged, 2 once written.
+        self.rflag :: {Atom: [(int, Atom)]}. Ring bonds at each atom.
+        self.n_read :: {Atom: int}. Neighbors already read.
+        self.parent_atom :: {Atom: Atom}. Atom right before this one.
+        self.non_h_neighbors :: {Atom: {Atom: int}}.
+        self.neighbor_order :: {Atom: [Atom]}. non_h_neighbors, by rank.
+        self.atoms :: [Atom]. The molecule's atoms in writing order.
+        self.rank :: {Atom: int}. Each atom's position in self.atoms; what
+            branches are sorted by.
+    """
+    def __init__(self, molecule):
+        self.atoms, self.rank = _atom_ranks(molecule.atoms)
+        self.flag = {}
+        self.rflag = {}
+        self.n_read = {}
+        self.parent_atom = {}
+        self.non_h_neighbors = {}
+        self.neighbor_order = {}
+
+
+def _subsmiles(molecule, start_atom, parent_atom, state):
     """
     Precondition: molecule has been flagged for ring positioning (some rflag 
-        values on atoms might != 0). This is done by smilesify().
-    Creates and returns a SMILES string for unflagged (!atom.flag==2) atoms
+        values in state might be set). This is done by smilesify().
+    Creates and returns a SMILES string for unflagged (flag != 2) atoms
         within a molecule, starting with the given atom.
 
     molecule :: Molecule.
     start_atom :: Atom.
     parent_atom :: Atom or 0.
+    state :: _TraversalState.
 
     Traverses the molecule from the given starting atom, returning the SMILES
      representation.
-    Can be called recursively -- hence start_atom and parent_atom. This is a
-     tree traversal, after all!
+    A tree traversal, but without recursion, so chains of any length are fine:
+     each atom on the stack has an _atom_pieces generator, which yields its
+     bits of the string and pauses wherever a branch's subtree goes. The bits
+     are joined once, at the end.
 
     return :: a SMILES substring
     """
@@ -93,14 +143,40 @@ def _subsmiles(molecule, start_atom, parent_atom):
     except AssertionError:
         assert parent_atom == 0, \
             "parent_atom invalid: %s" % str(parent_atom)
-    
+
+    pieces = []
+    stack = [_atom_pieces(start_atom, parent_atom, state)]
+    while stack:
+        for piece in stack[-1]:
+            if isinstance(piece, tuple):
+                #A branch: write the child's subtree before going on.
+                stack.append(_atom_pieces(piece[0], piece[1], state))
+                break
+            pieces.append(piece)
+        else:
+            stack.pop()
+    return ''.join(pieces)
+
+def _atom_pieces(start_atom, parent_atom, state):
+    """
+    Generator for one atom's part of the SMILES, as _subsmiles walks the tree.
+    Yields strings, and a (child, start_atom) pair wherever the child's
+     subtree goes.
+
+    start_atom :: Atom.
+    parent_atom :: Atom or 0.
+    state :: _TraversalState.
+    """
     #Flag the current atom.
-    start_atom.flag = 2
+    state.flag[start_atom] = 2
+    non_h_neighbors = state.non_h_neighbors.get(start_atom, {})
     
     output = str(start_atom)
 
     if start_atom.is_cistrans:
-        return _get_subsmiles_ct(output, molecule, start_atom, parent_atom)
+        for piece in _cistrans_pieces(output, start_atom, parent_atom, state):
+            yield piece
+        return
     
     #Check if the atom is a chiral center. If so:
     if start_atom.is_chiral:
@@ -110,7 +186,8 @@ def _subsmiles(molecule, start_atom, parent_atom):
                      for a in list(start_atom.neighbors)]) or \
                (None in \
                     [start_atom.chiralA, start_atom.chiralB,
-                     start_atom.chiralC, start_atom.chiralD])
+                     start_atom.chiralC, start_atom.chiralD]) or \
+               (start_atom.implicit_h > 0)
         #If the atom has a hydrogen:
         #Add [ and @@H] to the current output. (e.g. [C@@H]
         #If the atom does not have a hydrogen:
@@ -128,103 +205,125 @@ def _subsmiles(molecule, start_atom, parent_atom):
                     to_add = [i if (i is not None) else Atom("H") for i in to_add]
                     ## TODO: This error happens sometimes???
                     ## raise StandardError("%s is chiral, but has two hydrogens." % start_atom.element)
-                sort_atoms(to_add)
+                sort_atoms(to_add, state.rank)
                 for atom in to_add:
-                    assert atom in start_atom.non_h_neighbors, "%s, %s" % (str([str(i) for i in to_add]), str([str(i) for i in start_atom.non_h_neighbors]))
+                    assert atom in non_h_neighbors, "%s, %s" % (str([str(i) for i in to_add]), str([str(i) for i in non_h_neighbors]))
             else:
                 #to_add should have three elements
                 to_add = start_atom.chiralCWlist(None) #list of three atoms
                 if None in to_add:
                     raise StandardError("%s is chiral, but has two hydrogens." \
                         % start_atom.element)
-                sort_atoms(to_add)
+                sort_atoms(to_add, state.rank)
                 for atom in to_add:
-                    assert atom in start_atom.non_h_neighbors, "%s, %s" % (str(to_add), str(start_atom.non_h_neighbors))
+                    assert atom in non_h_neighbors, "%s, %s" % (str(to_add), str(non_h_neighbors))
         else:
             # output = "[" + output + "@@]"
             if has_parent:
                 #to_add should have three elements
                 to_add = start_atom.chiralCWlist(parent_atom)
-                sort_atoms(to_add)
+                sort_atoms(to_add, state.rank)
                 for atom in to_add:
-                    assert atom in start_atom.non_h_neighbors
+                    assert atom in non_h_neighbors
             else:
                 #to_add should have four elements
                 arbitraryRef = list(start_atom.neighbors)[0]
                 l = start_atom.chiralCWlist(arbitraryRef)
                 to_add = [arbitraryRef] + l
-                sort_atoms(to_add)
+                sort_atoms(to_add, state.rank)
                 for atom in to_add:
-                    assert atom in start_atom.non_h_neighbors
+                    assert atom in non_h_neighbors
 
     # Prepare to add new groups for all neighbor atoms which are not the parent
     # atom and not the rAtom.
     else:
-        to_add = [atom for atom in list(start_atom.non_h_neighbors) if not \
+        to_add = [atom for atom in list(non_h_neighbors) if not \
             (atom == parent_atom or atom == None)]
-        sort_atoms(to_add)
+        sort_atoms(to_add, state.rank)
 
-    added = ""
-    sort_atoms(to_add)
+    #Ring closures numbered 1-9 go right after the atom, last one first.
+    #Branches, and closures numbered 10 and up, follow in order.
+    closures = []
+    branches = []
+    rflag = state.rflag.get(start_atom, [])
+    sort_atoms(to_add, state.rank)
     for atom in to_add:
         assert isinstance(atom, Atom), "to_add has invalid: %s" % str(atom)
-        add = _get_next_subsmiles(atom, start_atom, molecule)
         try:
-            key = start_atom.non_h_neighbors[atom]
+            key = non_h_neighbors[atom]
         except:
             raise StandardError("%s, %s, %s, %s" % \
                 (
                     str(atom),
                     str(start_atom),
-                    str(start_atom.non_h_neighbors),
+                    str(non_h_neighbors),
                     str([
-                        (str(k), v) for (k, v) in start_atom.non_h_neighbors.iteritems()
+                        (str(k), v) for (k, v) in non_h_neighbors.iteritems()
                     ]),
                 ))
-        try:
-            int(add)
-            added = BOND_SYMBOLS[key]+add + added
-        except:
-            added = added + "("+BOND_SYMBOLS[key]+add+")"
+        ring = _ring_number(rflag, atom)
+        if ring is None:
+            branches.append((BOND_SYMBOLS[key], atom))
+        elif ring <= 9:
+            closures.append(BOND_SYMBOLS[key] + _rflag_to_str(ring))
+        else:
+            branches.append((BOND_SYMBOLS[key] + _rflag_to_str(ring), None))
 
-    return output + added
+    yield output
+    for closure in reversed(closures):
+        yield closure
+    for bond, atom in branches:
+        yield "(" + bond
+        if atom is not None:
+            yield (atom, start_atom)
+        yield ")"
 
-def _initialize_non_h_neighbors(molecule):
+def _initialize_non_h_neighbors(molecule, state):
     "Create the dictionary non_h_neighbors for each atom."
-    sort_atoms(molecule.atoms)
-    for atom in molecule.atoms:
-        atom.non_h_neighbors = copy.copy(atom.neighbors)
+    for atom in state.atoms:
+        state.non_h_neighbors[atom] = copy.copy(atom.neighbors)
+        order = list(atom.neighbors)
+        sort_atoms(order, state.rank)
+        state.neighbor_order[atom] = order
 
-def _flag_rings(molecule):
+def _flag_rings(molecule, state):
     "Traverse the molecule once, to hunt down and flag rings."
     ringsfound = 0
-    atom = molecule.atoms[0] ## current atom
-    home = molecule.atoms[0] ## home atom
+    atom = state.atoms[0] ## current atom
+    home = state.atoms[0] ## home atom
+    flag = state.flag
+    rflag = state.rflag
+    n_read = state.n_read
+    parent_atom = state.parent_atom
+    non_h_neighbors = state.non_h_neighbors
+    neighbor_order = state.neighbor_order
 
     #Each iteration: (...while we aren't back to the home atom, or if we are,
                     #while the home atom still has neighbors to read)
-    while atom != home or home.n_read < len(home.non_h_neighbors):
+    while atom != home or \
+            n_read.get(home, 0) < len(non_h_neighbors.get(home, ())):
     
         #flag current atom as "read" (flag = 1)
-        atom.flag = 1
+        flag[atom] = 1
+        read = n_read.get(atom, 0)
         
         #if there are neighbors left to read from this atom:
-        if atom.n_read < len(atom.non_h_neighbors):
+        if read < len(non_h_neighbors.get(atom, ())):
             
-            neighbors = list(atom.non_h_neighbors)
+            neighbors = neighbor_order[atom]
 
             #if the next atom is the parent atom:
-            if neighbors[atom.n_read] == atom.parent_atom:
+            if neighbors[read] == parent_atom.get(atom, 0):
                 #don't do anything but incrementing nRead
-                atom.n_read += 1
+                n_read[atom] = read + 1
                 
             #else,
             else:
-                if neighbors[atom.n_read].n_read == 0:
+                if n_read.get(neighbors[read], 0) == 0:
                 #if the next atom has not been traversed already:
-                    atom.n_read += 1
-                    neighbors[atom.n_read - 1].parent_atom = atom
-                    atom = neighbors[atom.n_read - 1]
+                    n_read[atom] = read + 1
+                    parent_atom[neighbors[read]] = atom
+                    atom = neighbors[read]
                     #increment current atom's nRead counter
                     #make the next atom the current atom:
                     #make the old atom the next atom's parent
@@ -233,14 +332,14 @@ def _flag_rings(molecule):
                 #if the next atom has been traversed already:
                     #it's a ring!
                     ringsfound += 1
-                    atom.rflag.append((
+                    rflag.setdefault(atom, []).append((
                         ringsfound,
-                        neighbors[atom.n_read]
+                        neighbors[read]
                     ))
-                    neighbors[atom.n_read].rflag.append((
+                    rflag.setdefault(neighbors[read], []).append((
                         ringsfound, atom
                     ))
-                    atom.n_read += 1
+                    n_read[atom] = read + 1
                     #increment ringsfound
                     #set rflag on both atoms to ringsfound
                     #increment current atom's nRead counter
@@ -250,24 +349,13 @@ def _flag_rings(molecule):
         else:
             #go backwards to parent atom:
             #set atom to its parent atom
-            atom = atom.parent_atom
+            atom = parent_atom.get(atom, 0)
 
-def _get_generated_smiles(molecule):
+def _get_generated_smiles(molecule, state):
     """Precondition: Molecule has been flagged for rings already,
     using _flag_rings. Traverses a second time to generate SMILES."""
-    atoms = [i for i in molecule.atoms]
-    sort_atoms(atoms)
-    start_atom = atoms[0]
-    return _subsmiles(molecule, start_atom, 0)
-
-def _resetflags(molecule):
-    "Reset all old flags."
-    for atom in molecule.atoms:
-        atom.flag = 0
-        atom.rflag = []
-        atom.n_read = 0
-        atom.parent_atom = 0
-        atom.non_h_neighbors = []
+    start_atom = state.atoms[0]
+    return _subsmiles(molecule, start_atom, 0, state)
 
 
 def _rflag_to_str(rflag):
@@ -287,72 +375,993 @@ def _rflag_to_str(rflag):
         raise StandardError("Too many rings in molecule. 100 is too many.")
 
 
-def _get_subsmiles_ct(output, molecule, start_atom, parent_atom):
+def _cistrans_pieces(output, start_atom, parent_atom, state):
     """
-    Check if the atom is a cis-trans center. Output correctly if so.
+    _atom_pieces, for an atom that is a cis-trans center.
     Remember to worry about cis-trans centers that might be in a ring system.
     Remember to worry about whether or not an atom has a parent atom.
     Adds ring labels.
     """
-    # raise StandardError(output)
     atomsToLink = [start_atom.CTotherC, start_atom.CTa, start_atom.CTb]
+    rflag = state.rflag.get(start_atom, [])
+    non_h_neighbors = state.non_h_neighbors.get(start_atom, {})
     begin = ["", "/", "\\"]
-    if start_atom.CTotherC.flag == 2:
+    if state.flag.get(start_atom.CTotherC, 0) == 2:
         begin = ["", "\\", "/"]
     if start_atom.CTa == parent_atom:
         output = begin[2] + output
     elif start_atom.CTb == parent_atom:
         output = begin[1] + output
+    yield output
     for ind in range(3):
         atom = atomsToLink[ind]
         if (atom != None) and (atom != parent_atom):
-            if atom in [rf[1] for rf in start_atom.rflag]:
-                output += ''.join([
+            ring = _ring_number(rflag, atom)
+            if ring is not None:
+                yield ''.join([
                     "(",
                     begin[ind],
-                    BOND_SYMBOLS[start_atom.non_h_neighbors[atom]],
-                    _rflag_to_str(start_atom.rflag[
-                        [rf[1] for rf in start_atom.rflag].index(atom)][0]),
+                    BOND_SYMBOLS[non_h_neighbors[atom]],
+                    _rflag_to_str(ring),
                     ")",
                 ])
-            elif atom.flag == 1:
-                output += ''.join([
-                    "(",
-                    begin[ind],
-                    BOND_SYMBOLS[start_atom.non_h_neighbors[atom]],
-                    _subsmiles(molecule, atom, start_atom),
-                    ")",
-                ])
-    return output
+            elif state.flag.get(atom, 0) == 1:
+                yield "(" + begin[ind] + BOND_SYMBOLS[non_h_neighbors[atom]]
+                yield (atom, start_atom)
+                yield ")"
 
 
-def _get_next_subsmiles(atom, start_atom, molecule):
+def _ring_number(rflag, atom):
     """
-    Recursion is your friend.
-    Be sure to specify the base case (when zero non-parent non-ring atoms are 
-        available to bond to).
-    In the base case, this loop won't even be entered.
+    rflag :: [(int, Atom)]. An atom's ring bonds, from _flag_rings.
+    atom :: Atom.
+    return :: int or None. The first ring number on the bond to atom, if any.
     """
-    if (start_atom.rflag != []) and (atom in [r[1] for r in start_atom.rflag]):
-        return _rflag_to_str(start_atom.rflag[
-            [r[1] for r in start_atom.rflag].index(atom)][0])
-    else:
-        return _subsmiles(molecule, atom, start_atom)
+    for number, partner in rflag:
+        if partner is atom:
+            return number
+    return None
 
 
 def _assertMolecule(molecule):
-    "Assert that molecule is a Molecule."
+    "Assert that molecule is a Molecule or CompactMolecule."
     try:
-        assert isinstance(molecule, Molecule)
+        assert isinstance(molecule, (Molecule, CompactMolecule))
     except AssertionError:
         raise StandardError("Not a molecule: %s is a %s, not %s" % \
             (repr(molecule), type(molecule), Molecule))
 
 
-def sort_atoms(atoms):
+def sort_atoms(atoms, rank):
     """
     In-place sort atoms.
     atoms :: list<Atom>.
+    rank :: {Atom: int}. From _atom_ranks. Atoms without a rank go last.
     return :: None.
     """
-    atoms.sort(key=lambda x: x.sort_by())
+    last = len(rank)
+    atoms.sort(key=lambda atom: rank.get(atom, last))
+
+
+def _atom_ranks(atoms):
+    """
+    Orders atoms once per smilesify call: by element, isotope, charge,
+    chirality and implicit hydrogens, then by the same of each neighbor
+    along with its bond order. Ties keep their order in atoms, so every
+    atom gets its own rank.
+    atoms :: list<Atom>.
+    return :: (list<Atom>, {Atom: int}). atoms sorted, and the position
+        of each one.
+    """
+    own = {}
+    for atom in atoms:
+        own[atom] = (atom.element, atom.isotope, atom.charge,
+                     bool(atom.is_chiral), atom.implicit_h)
+    keys = {}
+    for atom in atoms:
+        keys[atom] = (own[atom], sorted((own[neighbor], order)
+                      for neighbor, order in atom.neighbors.iteritems()))
+    ordered = sorted(atoms, key=keys.__getitem__)
+    return ordered, dict((atom, i) for i, atom in enumerate(ordered))
+
+
+############################
+##### CANONICAL WRITER #####
+############################
+
+## Hydrogens an unbracketed organic-subset atom gets, as toMolecule adds them
+## (see Molecule.addHydrogens): MAX_VALENCE minus its bond orders. Anything
+## else in the organic subset gets none.
+MAX_VALENCE = {'C': 4, 'N': 3, 'P': 3, 'O': 2, 'S': 2,
+               'F': 1, 'Cl': 1, 'Br': 1, 'I': 1}
+ORGANIC_SUBSET = set(MAX_VALENCE) | set(['B', '*'])
+
+## Bond orders as written in canonical SMILES. Single and aromatic bonds are
+## left implicit where the parser would infer them anyway.
+CANONICAL_BOND_SYMBOLS = {1: '', 2: '=', 3: '#', 4: '$', 1.5: ':'}
+
+## Elements that can be in an aromatic ring written in Kekule form, and the
+## ones among them that give it a lone pair when they have no double bond.
+AROMATIC_ELEMENTS = set(['B', 'C', 'N', 'O', 'P', 'S', 'As', 'Se'])
+LONE_PAIR_VALENCE = {'N': 3, 'P': 3, 'As': 3, 'O': 2, 'S': 2, 'Se': 2}
+
+
+def _canonical_smiles(molecule):
+    """
+    Writes a canonical SMILES string for molecule, without OpenBabel.
+
+    Plain hydrogens are folded into their heavy atoms' H counts, and rings
+    written in Kekule form that are aromatic are written as aromatic (see
+    _aromatize), so that both ways of writing a ring come out the same.
+    The other atoms are ranked (see _canonical_ranks), and each connected part is
+    written depth-first from its lowest-ranked atom, with branches in rank
+    order. Chirality and cis-trans marks are only written for centers that
+    really are stereogenic, so meaningless stereochemistry left behind by a
+    reaction doesn't make two equal molecules look different.
+
+    molecule :: Molecule or CompactMolecule. Atoms bonded to it but not
+        listed in it count too.
+    return :: str. Parts separated by '.', in sorted order.
+    """
+    graph = _HeavyGraph(molecule)
+    if not len(graph):
+        return ""
+    ranks, stereo = _canonical_ranks(graph)
+
+    output = []
+    written = set()
+    for start in sorted(xrange(len(graph)), key=ranks.__getitem__):
+        if start not in written:
+            output.append(
+                _write_component(graph, ranks, stereo, start, written))
+    return '.'.join(sorted(output))
+
+
+class _HeavyGraph(object):
+    """
+    The atoms a canonical SMILES writes, numbered 0..n-1, and their bonds.
+    Plain hydrogens on a heavy atom are not atoms here, only counted.
+        self.elements :: [str]. Each atom's element, as the atom has it
+            (e.g. 'c' for an aromatic carbon).
+        self.charges :: [int].
+        self.isotopes :: [int or None].
+        self.bonds :: [[(int, number)]]. Each atom's neighbors, and the bond
+            orders to them.
+        self.hydrogens :: [int]. Each atom's hydrogens, implicit or folded.
+        self.aromatic :: [bool]. Whether each atom is aromatic, as given
+            (lowercase or with aromatic bonds) or as perceived by _aromatize.
+        self.chiral :: {int: [int or None]}. For each atom marked chiral,
+            its chiralA-D: None for a hydrogen, OUTSIDE for an atom that
+            isn't bonded to the molecule.
+        self.cistrans :: {int: (int or None, [int or None])}. For each atom
+            marked cis-trans, its CTotherC and its CTa and CTb; None for a
+            hydrogen, or an atom that isn't here.
+    """
+    def __init__(self, molecule):
+        """
+        molecule :: Molecule or CompactMolecule. A CompactMolecule is read
+            straight from its arrays.
+        """
+        if isinstance(molecule, CompactMolecule):
+            table = _compactTable(molecule)
+        else:
+            table = _moleculeTable(molecule)
+        count = len(table.elements)
+
+        folded = set()
+        orphans = []
+        for r in xrange(count):
+            if table.elements[r] != 'H' or table.isotopes[r] is not None or \
+               table.charges[r] or table.tagged[r]:
+                continue # not a plain hydrogen
+            neighbors = table.bonds[r]
+            if len(neighbors) == 1:
+                parent, bondOrder = neighbors[0]
+                if table.elements[parent] != 'H' and bondOrder == 1:
+                    folded.add(r)
+            elif not neighbors:
+                orphans.append(r)
+        ## Hydrogens left behind when the atom they were on was removed
+        ## aren't part of the molecule any more; a lone one still is.
+        if len(orphans) < count:
+            folded.update(orphans)
+
+        kept = [r for r in xrange(count) if r not in folded]
+        index = dict((r, i) for i, r in enumerate(kept))
+        self.elements = [table.elements[r] for r in kept]
+        self.charges = [table.charges[r] for r in kept]
+        self.isotopes = [table.isotopes[r] for r in kept]
+        self.bonds = []
+        self.hydrogens = []
+        for r in kept:
+            bonds = []
+            hydrogens = table.implicitH[r]
+            for neighbor, bondOrder in table.bonds[r]:
+                if neighbor in folded:
+                    hydrogens += 1
+                else:
+                    bonds.append((index[neighbor], bondOrder))
+            self.bonds.append(bonds)
+            self.hydrogens.append(hydrogens)
+
+        self.chiral = {}
+        for r, references in table.chiral.iteritems():
+            if r in index:
+                self.chiral[index[r]] = [
+                    index.get(reference, None if reference in folded
+                              else reference)
+                    for reference in references]
+        self.cistrans = {}
+        for r, (other, references) in table.cistrans.iteritems():
+            if r in index:
+                self.cistrans[index[r]] = (
+                    index.get(other), [index.get(k) for k in references])
+
+        ## Atoms with aromatic bonds are aromatic, even if they were
+        ## written uppercase (e.g. C:1:C:C:C:C:C1).
+        self.aromatic = [table.aromatic[r] or
+                         any(order == 1.5 for _, order in bonds)
+                         for r, bonds in zip(kept, self.bonds)]
+        _aromatize(self)
+
+    def __len__(self):
+        return len(self.elements)
+
+
+## Stands for a stereo reference to an atom outside the molecule.
+OUTSIDE = -1
+
+
+class _AtomTable(object):
+    """
+    What _HeavyGraph reads, before hydrogens are folded: every atom of a
+    molecule, numbered, including the atoms bonded to it but not listed in
+    it. Each field is a list indexed by those numbers, except for chiral
+    and cistrans, which are as in _HeavyGraph.
+    """
+    def __init__(self):
+        self.elements = []
+        self.charges = []
+        self.isotopes = []
+        self.aromatic = []
+        self.implicitH = []
+        self.tagged = []
+        self.bonds = []
+        self.chiral = {}
+        self.cistrans = {}
+
+
+def _moleculeTable(molecule):
+    """
+    molecule :: Molecule.
+    return :: _AtomTable.
+    """
+    atoms = list(molecule.atoms)
+    index = dict((atom, r) for r, atom in enumerate(atoms))
+    r = 0
+    while r < len(atoms):
+        for neighbor in atoms[r].neighbors:
+            if neighbor not in index:
+                index[neighbor] = len(atoms)
+                atoms.append(neighbor)
+        r += 1
+
+    table = _AtomTable()
+    for r, atom in enumerate(atoms):
+        table.elements.append(atom.element)
+        table.charges.append(atom.charge or 0)
+        table.isotopes.append(atom.isotope)
+        table.aromatic.append(atom.is_aromatic)
+        table.implicitH.append(atom.implicit_h)
+        table.tagged.append(bool(atom.tags))
+        table.bonds.append([(index[neighbor], bondOrder) for neighbor, bondOrder
+                            in atom.neighbors.iteritems()])
+        if atom.is_chiral:
+            table.chiral[r] = [None if reference is None
+                               else index.get(reference, OUTSIDE)
+                               for reference in (atom.chiralA, atom.chiralB,
+                                                 atom.chiralC, atom.chiralD)]
+        if atom.is_cistrans:
+            table.cistrans[r] = (index.get(atom.CTotherC),
+                                 [index.get(atom.CTa), index.get(atom.CTb)])
+    return table
+
+
+def _compactTable(compact):
+    """
+    compact :: CompactMolecule.
+    return :: _AtomTable.
+    """
+    table = _AtomTable()
+    count = len(compact.elements)
+    table.elements = [compact.element(r) for r in xrange(count)]
+    table.charges = list(compact.charges)
+    table.isotopes = [None if isotope == NONE else isotope
+                      for isotope in compact.isotopes]
+    table.aromatic = [bool(aromatic) for aromatic in compact.aromatic]
+    table.implicitH = list(compact.implicitH)
+    table.tagged = [r in compact.tags for r in xrange(count)]
+    offsets, targets, orders = compact.offsets, compact.targets, compact.orders
+    table.bonds = [[(targets[k], storedBondOrder(orders[k]))
+                    for k in xrange(offsets[r], offsets[r + 1])]
+                   for r in xrange(count)]
+
+    def reference(k):
+        return None if k == NONE else k
+
+    for n, r in enumerate(compact.stereoAtoms):
+        references = [reference(k) for k in compact.stereoRefs[7*n:7*n+7]]
+        if compact.stereoFlags[n] & IS_CHIRAL:
+            table.chiral[r] = references[:4]
+        if compact.stereoFlags[n] & IS_CISTRANS:
+            table.cistrans[r] = (references[4], references[5:7])
+    return table
+
+
+def _aromatize(graph):
+    """
+    Marks the aromatic rings that are written in Kekule form, as OpenBabel
+    does when it reads them: their atoms become aromatic, and the bonds
+    around them aromatic bonds. A ring is aromatic if each of its atoms
+    has a double bond or a lone pair to give it, and it has 4n + 2 pi
+    electrons (Hueckel). Rings fused along a bond are also tried as one,
+    for e.g. azulene. Rings with atoms given as aromatic are left as they
+    are.
+    graph :: _HeavyGraph. Changed in place.
+    """
+    electrons = [_pi_electrons(graph, i) for i in xrange(len(graph))]
+    ## Only rings through atoms that could be aromatic matter, so rings are
+    ## looked for among those alone, along single and double bonds.
+    candidates = [i for i, count in enumerate(electrons) if count is not None]
+    if not any(count == 1 for count in electrons):
+        return
+    neighbors = dict((i, [j for j, order in graph.bonds[i]
+                          if order in (1, 2) and electrons[j] is not None])
+                     for i in candidates)
+    cycles = rings.findRings(candidates, neighbors.__getitem__).rings
+    ringBonds = set()
+    for ring in cycles:
+        for k in xrange(len(ring)):
+            ringBonds.add(frozenset((ring[k], ring[k - 1])))
+
+    def give(i):
+        ## A double bond counts only if it is in the ring system; one
+        ## leading out of it (e.g. to the O of a pyridone) gives nothing.
+        if electrons[i] != 1:
+            return electrons[i]
+        for j, order in graph.bonds[i]:
+            if order == 2:
+                return 1 if frozenset((i, j)) in ringBonds else 0
+
+    systems = [(set(ring), set(frozenset((ring[k], ring[k - 1]))
+                               for k in xrange(len(ring))))
+               for ring in cycles]
+    for a in xrange(len(cycles)):
+        for b in xrange(a):
+            if systems[a][1] & systems[b][1]:
+                systems.append((systems[a][0] | systems[b][0],
+                                systems[a][1] | systems[b][1]))
+
+    aromaticBonds = set()
+    for atoms, bonds in systems:
+        if bonds <= aromaticBonds:
+            continue
+        total = sum(give(i) for i in atoms)
+        if total % 4 == 2:
+            aromaticBonds |= bonds
+    for bond in aromaticBonds:
+        i, j = bond
+        graph.aromatic[i] = graph.aromatic[j] = True
+        graph.bonds[i] = [(k, 1.5 if k == j else order)
+                          for k, order in graph.bonds[i]]
+        graph.bonds[j] = [(k, 1.5 if k == i else order)
+                          for k, order in graph.bonds[j]]
+
+
+def _pi_electrons(graph, i):
+    """
+    return :: int or None. What atom i of graph could give an aromatic ring
+        written in Kekule form: 1 for a double bond, 2 for a lone pair, 0
+        for an empty orbital (a cation or a boron), or None if it can't be
+        in one.
+    """
+    element = _element(graph.elements[i])
+    if graph.aromatic[i] or element not in AROMATIC_ELEMENTS:
+        return None
+    orders = [order for _, order in graph.bonds[i]]
+    if orders.count(2) == 1 and set(orders) <= set([1, 2]):
+        return 1
+    if set(orders) - set([1]):
+        return None
+    charge = graph.charges[i]
+    valence = len(orders) + graph.hydrogens[i]
+    if element == 'C':
+        if valence != 3 or charge == 0:
+            return None
+        return 2 if charge == -1 else 0
+    if element == 'B':
+        return 0 if valence == 3 and charge == 0 else None
+    if valence == LONE_PAIR_VALENCE[element] and charge == 0:
+        return 2
+    return None
+
+
+def _class_ranks(keys):
+    """
+    keys :: [comparable].
+    return :: [int]. How many keys are less than or equal to each key, minus
+        one: equal keys get equal ranks, and a tied class is ranked at its
+        last position, so splitting it leaves every other rank alone.
+    """
+    counts = {}
+    for key in keys:
+        counts[key] = counts.get(key, 0) + 1
+    position = {}
+    total = -1
+    for key in sorted(counts):
+        total += counts[key]
+        position[key] = total
+    return [position[key] for key in keys]
+
+
+def _refine(ranks, bonds, changed=None):
+    """
+    Splits ties between atoms whose neighbors are ranked differently, until
+    nothing more splits. Works in rounds, as if every atom were re-ranked by
+    its neighbors' ranks each time, but only tied atoms next to one that
+    split away from the rest of its class can split in turn, so only those
+    are looked at. (The rest of a class may get a new rank too, but all of
+    it together, which can't tell its neighbors apart.)
+    ranks :: [int]. As from _class_ranks.
+    bonds :: [[(int, number)]].
+    changed :: [int] or None. The atoms whose ranks were just changed, or
+        None to look at every tie.
+    return :: [int].
+    """
+    ranks = list(ranks)
+    classes = {}
+    for i, rank in enumerate(ranks):
+        classes.setdefault(rank, set()).add(i)
+    if changed is None:
+        touched = dict((rank, set(members))
+                       for rank, members in classes.iteritems()
+                       if len(members) > 1)
+    else:
+        touched = _touched(changed, ranks, classes, bonds)
+
+    def key(i):
+        return tuple(sorted((ranks[j], order) for j, order in bonds[i]))
+
+    while touched:
+        moves = []
+        changed = []
+        for rank, marked in touched.iteritems():
+            ## Unmarked members had equal keys last time, and none of their
+            ## neighbors have split away since: one speaks for all of them.
+            members = classes[rank]
+            keyed = [(key(i), i) for i in marked]
+            counts = {}
+            for k, _ in keyed:
+                counts[k] = counts.get(k, 0) + 1
+            unmarked = len(members) - len(marked)
+            if unmarked:
+                for first in members:
+                    if first not in marked:
+                        break
+                unmarkedKey = key(first)
+                counts[unmarkedKey] = counts.get(unmarkedKey, 0) + unmarked
+            if len(counts) == 1:
+                continue
+            ## The biggest part of the class is "the rest"; only the atoms
+            ## that split away from it count as changed.
+            restKey = max(counts, key=lambda k: (counts[k], k))
+            position = {}
+            total = rank - len(members)
+            for k in sorted(counts):
+                total += counts[k]
+                position[k] = total
+            for k, i in keyed:
+                if position[k] != rank:
+                    moves.append((i, position[k]))
+                if k != restKey:
+                    changed.append(i)
+            if unmarked and (position[unmarkedKey] != rank or
+                             unmarkedKey != restKey):
+                for i in members:
+                    if i not in marked:
+                        if position[unmarkedKey] != rank:
+                            moves.append((i, position[unmarkedKey]))
+                        if unmarkedKey != restKey:
+                            changed.append(i)
+        for i, rank in moves:
+            classes[ranks[i]].discard(i)
+            classes.setdefault(rank, set()).add(i)
+            ranks[i] = rank
+        touched = _touched(changed, ranks, classes, bonds)
+    return ranks
+
+
+def _touched(changed, ranks, classes, bonds):
+    """
+    return :: {int: set of int}. The tied classes, by rank, with a member
+        bonded to an atom in changed; and those members.
+    """
+    touched = {}
+    for i in changed:
+        for j, _ in bonds[i]:
+            if len(classes[ranks[j]]) > 1:
+                touched.setdefault(ranks[j], set()).add(j)
+    return touched
+
+
+def _canonical_ranks(graph):
+    """
+    Ranks the atoms of graph so that the ranking depends only on the
+    molecule, not on how its atoms happen to be stored.
+    Atoms start out ranked by element, bonds, hydrogens, charge and
+    isotope. Ties are split by neighbors' ranks, then by stereochemistry
+    (see _rank_by_stereo), and any left (between symmetric atoms) by
+    arbitrarily promoting one atom of the lowest tied rank and refining
+    again.
+
+    graph :: _HeavyGraph.
+    return :: [int], _StereoCenters. A different rank for every atom, and
+        the stereochemistry worth writing.
+    """
+    invariants = []
+    for i in xrange(len(graph)):
+        invariants.append((
+            len(graph.bonds[i]),
+            _element(graph.elements[i]),
+            graph.aromatic[i],
+            graph.isotopes[i] or 0,
+            graph.charges[i],
+            graph.hydrogens[i],
+            sum(order for _, order in graph.bonds[i]),
+        ))
+    ranks = _refine(_class_ranks(invariants), graph.bonds)
+
+    stereo = _stereo_centers(graph, ranks)
+    ranks = _rank_by_stereo(graph, ranks, stereo)
+
+    while len(set(ranks)) < len(ranks):
+        tied = min(rank for rank in ranks if ranks.count(rank) > 1)
+        ranks = _promote(graph, ranks, ranks.index(tied))
+    return ranks, stereo
+
+
+def _promote(graph, ranks, chosen):
+    """
+    Splits the atom chosen off from the rest of its tied class, ranking it
+    first, and refines again.
+    return :: [int].
+    """
+    tied = ranks[chosen]
+    ranks = list(ranks)
+    ranks[chosen] = tied - ranks.count(tied) + 1
+    return _refine(ranks, graph.bonds, [chosen])
+
+
+def _rank_by_stereo(graph, ranks, stereo):
+    """
+    Splits ties by stereochemistry, CANON-style. Each stereocenter's
+    descriptor (its parity, or cis or trans) splits ties around it. A
+    chiral center with two tied neighbors (see _StereoCenters.tied) only
+    counts if the rest of the stereochemistry tells those two apart: the
+    lowest-ranked one has its tie broken whichever way makes its own
+    parity even, and is kept if that tells apart the tied neighbors of
+    another. That is how the two centers of cis- and trans-1,4-disubstituted
+    cyclohexanes come to be written, relative to each other.
+
+    graph :: _HeavyGraph.
+    ranks :: [int]. From refinement.
+    stereo :: _StereoCenters. Gets the tied centers that count moved into
+        stereo.chiral.
+    return :: [int].
+    """
+    ranks = _split_by_descriptors(ranks, stereo, graph)
+    pending = stereo.tied
+    while pending:
+        told = [i for i, center in pending.iteritems()
+                if not _has_tie(center, ranks)]
+        if told:
+            for i in told:
+                stereo.chiral[i] = pending.pop(i)
+            ranks = _split_by_descriptors(ranks, stereo, graph)
+            continue
+        i = min(pending, key=ranks.__getitem__)
+        center = pending.pop(i)
+        oriented = _orient(graph, ranks, center)
+        if any(not _has_tie(other, oriented)
+               for other in pending.itervalues()):
+            stereo.chiral[i] = center
+            ranks = oriented
+    return ranks
+
+
+def _split_by_descriptors(ranks, stereo, graph):
+    "return :: [int]. ranks, with ties split by each center's descriptor."
+    descriptors = [0] * len(ranks)
+    for i, center in stereo.chiral.iteritems():
+        descriptors[i] = 1 + _parity(
+            center, sorted(center, key=lambda j: -1 if j is None else ranks[j]))
+    for (i, j), (left, right) in stereo.cistrans.iteritems():
+        ## Cis (1) or trans (2), between the higher-ranked substituents.
+        top = _top_substituent(left, ranks)
+        other = _top_substituent(right, ranks)
+        descriptors[i] = descriptors[j] = 1 + (left.index(top) ==
+                                               right.index(other))
+    if not any(descriptors):
+        return ranks
+    return _refine(_class_ranks(zip(ranks, descriptors)), graph.bonds)
+
+
+def _orient(graph, ranks, center):
+    """
+    Breaks the tie between the two tied neighbors of a chiral center by
+    promoting whichever of them puts the center's neighbors, in rank
+    order, in an even permutation of its chiralA-D order.
+    center :: [int or None]. As in _StereoCenters.chiral.
+    return :: [int].
+    """
+    def key(j):
+        return -1 if j is None else ranks[j]
+    first, second = [j for j in center
+                     if sum(key(k) == key(j) for k in center) == 2]
+    order = sorted(center, key=key)
+    if order.index(first) > order.index(second):
+        order[order.index(first)], order[order.index(second)] = second, first
+    if _parity(center, order) == 0:
+        return _promote(graph, ranks, first)
+    return _promote(graph, ranks, second)
+
+
+def _has_tie(center, ranks):
+    "return :: bool. Whether two of a chiral center's neighbors are tied."
+    neighborRanks = [-1 if j is None else ranks[j] for j in center]
+    return len(set(neighborRanks)) < 4
+
+
+def _top_substituent(substituents, ranks):
+    "return :: int. The highest-ranked of substituents, skipping None."
+    return max((k for k in substituents if k is not None),
+               key=ranks.__getitem__)
+
+
+def _element(element):
+    "return :: str. element, capitalized even if it is aromatic."
+    return element[:1].upper() + element[1:]
+
+
+def _parity(reference, order):
+    """
+    reference :: list.
+    order :: list. The same items as reference, in some order.
+    return :: int. 0 if order is an even permutation of reference, else 1.
+    """
+    position = [reference.index(item) for item in order]
+    parity = 0
+    for i in xrange(len(position)):
+        while position[i] != i:
+            j = position[i]
+            position[i], position[j] = position[j], position[i]
+            parity ^= 1
+    return parity
+
+
+class _StereoCenters(object):
+    """
+    The stereogenic centers of a _HeavyGraph.
+        self.chiral :: {int: [int or None]}. For each chiral center, its
+            neighbors in chiralA-D order (so that, looking from the first,
+            the other three are clockwise). None stands for a hydrogen.
+        self.cistrans :: {(int, int): ([int or None], [int or None])}.
+            For each cis-trans double bond, its two ends (the first one
+            ranked lower), and their substituents, each end's in CTa, CTb
+            order with None for a hydrogen. Substituents in matching
+            positions are trans to each other.
+        self.tied :: {int: [int or None]}. Chiral centers, as in
+            self.chiral, with exactly two neighbors tied by refinement.
+            Whether they are stereogenic depends on the other centers;
+            see _rank_by_stereo.
+    """
+    def __init__(self):
+        self.chiral = {}
+        self.cistrans = {}
+        self.tied = {}
+
+
+def _stereo_centers(graph, ranks):
+    """
+    Finds the stereochemistry in graph that a SMILES should show: centers
+    whose stereo references match their actual neighbors, and whose
+    substituents are all ranked differently. Chiral centers with just two
+    substituents ranked the same are set aside in self.tied.
+    graph :: _HeavyGraph.
+    ranks :: [int]. From refinement, before any tie is broken arbitrarily.
+    return :: _StereoCenters.
+    """
+    output = _StereoCenters()
+    for i in xrange(len(graph)):
+        if i in graph.chiral:
+            center = _chiral_references(graph, i)
+            if center is not None:
+                neighborRanks = [-1 if j is None else ranks[j] for j in center]
+                if len(set(neighborRanks)) == 4:
+                    output.chiral[i] = center
+                elif len(set(neighborRanks)) == 3:
+                    output.tied[i] = center
+        j = graph.cistrans[i][0] if i in graph.cistrans else None
+        if j is not None and j in graph.cistrans and \
+           graph.cistrans[j][0] == i and dict(graph.bonds[i]).get(j) == 2:
+            if ranks[j] < ranks[i] or (i, j) in output.cistrans:
+                continue
+            left = _cistrans_substituents(graph, i, j)
+            right = _cistrans_substituents(graph, j, i)
+            if left is None or right is None:
+                continue
+            if None not in left and ranks[left[0]] == ranks[left[1]] or \
+               None not in right and ranks[right[0]] == ranks[right[1]]:
+                continue
+            output.cistrans[(i, j)] = (left, right)
+    return output
+
+
+def _chiral_references(graph, i):
+    """
+    graph :: _HeavyGraph.
+    i :: int. A chiral atom.
+    return :: [int or None] or None. Its chiralA-D, or None if they don't
+        match its neighbors.
+    """
+    center = graph.chiral[i]
+    if OUTSIDE in center:
+        return None
+    heavy = [j for j in center if j is not None]
+    if sorted(heavy) != sorted(j for j, _ in graph.bonds[i]) or \
+       len(center) - len(heavy) != graph.hydrogens[i]:
+        return None
+    return center
+
+
+def _cistrans_substituents(graph, i, j):
+    """
+    graph :: _HeavyGraph.
+    i :: int. One end of a cis-trans double bond.
+    j :: int. The other end.
+    return :: [int or None] or None. The substituents of i in CTa, CTb
+        order, None standing for a hydrogen; None if i has no heavy
+        substituent, or if they don't match the stereo references.
+    """
+    others = [k for k, _ in graph.bonds[i] if k != j]
+    if not others or len(others) + graph.hydrogens[i] != 2:
+        return None
+    slots = list(graph.cistrans[i][1])
+    if len(others) == 2:
+        if sorted(others) != sorted(slots):
+            return None
+        return slots
+    ## One heavy substituent; a hydrogen fills the other slot.
+    if slots == [others[0], None] or slots == [None, others[0]]:
+        return slots
+    return None
+
+
+def _write_component(graph, ranks, stereo, start, written):
+    """
+    Writes the connected part of graph that start is in, in one depth-first
+    traversal. Works with explicit stacks, so long chains can't hit the
+    recursion limit.
+
+    graph :: _HeavyGraph.
+    ranks :: [int]. See _canonical_ranks.
+    stereo :: _StereoCenters.
+    start :: int. Where to start writing.
+    written :: set of int. Gets the atoms written added to it.
+    return :: str.
+    """
+    def neighborsByRank(i):
+        return iter(sorted((j for j, _ in graph.bonds[i]),
+                           key=ranks.__getitem__))
+
+    ## Pass 1: the depth-first tree, with neighbors visited in rank order.
+    ## Bonds outside the tree close rings.
+    order = [start]
+    position = {start: 0}
+    parent = {start: None}
+    children = {start: []}
+    ringPartners = {}
+    stack = [(start, neighborsByRank(start))]
+    while stack:
+        i, neighbors = stack[-1]
+        for j in neighbors:
+            if j == parent[i]:
+                continue
+            if j in position:
+                if j not in ringPartners.get(i, ()):
+                    ringPartners.setdefault(i, []).append(j)
+                    ringPartners.setdefault(j, []).append(i)
+                continue
+            parent[j] = i
+            children[i].append(j)
+            children[j] = []
+            position[j] = len(order)
+            order.append(j)
+            stack.append((j, neighborsByRank(j)))
+            break
+        else:
+            stack.pop()
+    written.update(order)
+
+    ## Pass 2, in writing order: ring-closure digits (reusing the lowest free
+    ## ones), the order each atom's neighbors are written in, and cis-trans
+    ## marks.
+    digits = {} # open ring bond -> its digit
+    ringTokens = {}
+    writtenNeighbors = {}
+    for i in order:
+        partners = ringPartners.get(i, [])
+        closing = sorted((j for j in partners if position[j] < position[i]),
+                         key=position.__getitem__)
+        opening = sorted((j for j in partners if position[j] > position[i]),
+                         key=position.__getitem__)
+        tokens = []
+        freed = []
+        for j in closing:
+            digit = digits.pop(frozenset((i, j)))
+            tokens.append(_rflag_to_str(digit))
+            freed.append(digit)
+        inUse = set(digits.itervalues()) | set(freed)
+        for j in opening:
+            digit = 1
+            while digit in inUse:
+                digit += 1
+            inUse.add(digit)
+            digits[frozenset((i, j))] = digit
+            tokens.append((j, _rflag_to_str(digit)))
+        ringTokens[i] = tokens
+        neighborOrder = [] if parent[i] is None else [parent[i]]
+        neighborOrder += [None] * graph.hydrogens[i]
+        neighborOrder += closing + opening + children[i]
+        writtenNeighbors[i] = neighborOrder
+
+    directions = _cistrans_directions(stereo, position, writtenNeighbors)
+
+    def bondText(i, j):
+        order = dict(graph.bonds[i])[j]
+        bond = frozenset((i, j))
+        if bond in directions:
+            return directions[bond]
+        aromatic = graph.aromatic[i] and graph.aromatic[j]
+        if order == 1 and aromatic:
+            return '-'
+        if order == 1.5 and aromatic:
+            return ''
+        if order in CANONICAL_BOND_SYMBOLS:
+            return CANONICAL_BOND_SYMBOLS[order]
+        return BOND_SYMBOLS.get(order, '')
+
+    ## Pass 3: put the string together.
+    pieces = []
+    stack = [start]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            pieces.append(item)
+            continue
+        i = item
+        if parent[i] is not None:
+            pieces.append(bondText(parent[i], i))
+        chiralMark = ''
+        if i in stereo.chiral:
+            if _parity(stereo.chiral[i], writtenNeighbors[i]) == 0:
+                chiralMark = '@@'
+            else:
+                chiralMark = '@'
+        pieces.append(_atom_text(graph, i, chiralMark))
+        for token in ringTokens[i]:
+            if isinstance(token, tuple):
+                j, digit = token
+                pieces.append(bondText(i, j) + digit)
+            else:
+                pieces.append(token)
+        kids = children[i]
+        if kids:
+            ## Branches in parentheses, then the last child carries on the
+            ## chain.
+            stack.append(kids[-1])
+            for k in reversed(kids[:-1]):
+                stack.append(')')
+                stack.append(k)
+                stack.append('(')
+    return ''.join(pieces)
+
+
+def _cistrans_directions(stereo, position, writtenNeighbors):
+    """
+    Picks '/' or '\\' for one single bond at each end of every cis-trans
+    double bond: the first substituent written on either end.
+    stereo :: _StereoCenters.
+    position :: {int: int}. Where each atom is in the writing order.
+    writtenNeighbors :: {int: [int or None]}.
+    return :: {frozenset of 2 ints: str}. Each mark as written, reading
+        from the atom written first to the other.
+    """
+    directions = {}
+
+    def mark(center, substituent, side):
+        ## side is +1 for "up" from center, -1 for "down".
+        bond = frozenset((center, substituent))
+        if position[substituent] < position[center]:
+            side = -side # written the other way round
+        char = '/' if side > 0 else '\\'
+        if directions.setdefault(bond, char) != char:
+            return False
+        return True
+
+    def sideOf(center, substituent):
+        bond = frozenset((center, substituent))
+        if bond not in directions:
+            return None
+        side = 1 if directions[bond] == '/' else -1
+        if position[substituent] < position[center]:
+            side = -side
+        return side
+
+    for (i, j), (left, right) in sorted(
+            stereo.cistrans.iteritems(),
+            key=lambda item: min(position[k] for k in item[0])):
+        if position[j] < position[i]:
+            i, j, left, right = j, i, right, left
+        first = [k for k in writtenNeighbors[i] if k is not None and k != j]
+        second = [k for k in writtenNeighbors[j] if k is not None and k != i]
+        s, t = first[0], second[0]
+        side = sideOf(i, s)
+        if side is None:
+            side = 1
+            mark(i, s, side)
+        if left.index(s) == right.index(t):
+            side = -side # trans
+        mark(j, t, side)
+    return directions
+
+
+def _atom_text(graph, i, chiralMark):
+    """
+    graph :: _HeavyGraph.
+    i :: int.
+    chiralMark :: str. '', '@' or '@@'.
+    return :: str. Atom i as canonical SMILES writes it: bare if it is in
+        the organic subset and the parser would give it the right number of
+        hydrogens, bracketed otherwise. Atom classes are left out.
+    """
+    element = _element(graph.elements[i])
+    symbol = element.lower() if graph.aromatic[i] else element
+    hydrogens = graph.hydrogens[i]
+    charge = graph.charges[i]
+    isotope = graph.isotopes[i]
+    if not chiralMark and not charge and isotope is None:
+        if graph.aromatic[i]:
+            bare = symbol in ('b', 'c', 'n', 'o', 's', 'p')
+        else:
+            bare = element in ORGANIC_SUBSET
+        if bare:
+            valence = sum(order for _, order in graph.bonds[i])
+            implied = max(0, int(MAX_VALENCE.get(element, valence) - valence))
+            if hydrogens == implied:
+                return symbol
+    output = '['
+    if isotope is not None:
+        output += str(isotope)
+    output += symbol + chiralMark
+    if hydrogens == 1:
+        output += 'H'
+    elif hydrogens > 1:
+        output += 'H' + str(hydrogens)
+    if charge == -1:
+        output += '-'
+    elif charge == 1:
+        output += '+'
+    elif charge:
+        output += '%+d' % charge
+    return output + ']'
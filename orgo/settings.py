@@ -91,6 +91,15 @@ STATICFILES_DIRS = (
     os.path.join(PROJECT_ROOT, 'static'),
 )
 
+# 'openbabel' or 'native' (pure Python), or None for OpenBabel when it is
+# installed. See engine/toCanonical.py.
+CANONICAL_BACKEND = None
+
+# A SQLite file of canonical SMILES shared by every worker on the host, or
+# None to keep canonical forms in memory only. See engine/canonicalStore.py.
+CANONICAL_STORE = None
+#CANONICAL_STORE = os.path.join(BASE_DIR, 'canonical.sqlite3')
+
 TEMPLATE_DIRS = (
     # Put strings here, like "/home/html/django_templates" or "C:/www/django/templates".
     # Always use forward slashes, even on Windows.
@@ -6,7 +6,7 @@ function synthesisProblemMain(parameters) {
 
     parameters.startingMoleculeSvgs.forEach(function(svg, i, arr) {
         var smiles = parameters.startingMoleculeSmileses[i];
-        addMolecule(svg, smiles);
+        addMolecule(svg, smiles, "");
     });
 
 
@@ -56,6 +56,9 @@ function synthesisProblemMain(parameters) {
             $("#inProgressReaction").click(function() {
                 var input_smileses = $.map($('.selectedMolecule').toArray(),
                                            function(element, index) { return $(element).attr('data-smiles'); });
+                // Signatures let the server skip re-canonicalizing SMILES it wrote itself
+                var input_signatures = $.map($('.selectedMolecule').toArray(),
+                                             function(element, index) { return $(element).attr('data-signature'); });
                 if (input_smileses.length == 0) {
                     fancyAlert("You forgot to select a molecule.", "Try again");
                 }
@@ -65,6 +68,7 @@ function synthesisProblemMain(parameters) {
                         {
                             'data': {
                                 'input_smileses': input_smileses,
+                                'input_signatures': input_signatures,
                                 'answer': $('#target').attr('data-smiles'),
                                 'reaction': reaction,
                             },
@@ -80,7 +84,7 @@ function synthesisProblemMain(parameters) {
                                 } else {
                                     var svg = data.svg;
                                     var smiles = data.smiles;
-                                    addMolecule(svg, smiles);
+                                    addMolecule(svg, smiles, data.signature);
                                     
                                     // Check for victory
                                     if (data.isAnswer) {
@@ -120,8 +124,8 @@ function b(thing) {
     return "<b>" + thing + "</b>";
 }
 
-function addMolecule(svg, smiles) {
-    $("#workspace").append(molecule(svg, smiles));
+function addMolecule(svg, smiles, signature) {
+    $("#workspace").append(molecule(svg, smiles, signature));
     $(".molecule").unbind("click");
     $(".molecule").click(function() {
         isToggled = $(this).attr("data-toggled");
@@ -133,8 +137,8 @@ function addMolecule(svg, smiles) {
     });
 }
 
-function molecule(svg, smiles) {
-    return "<div class=\"molecule\" data-smiles=\""+smiles+"\" data-toggled=\"false\">"+svg+"</div>";
+function molecule(svg, smiles, signature) {
+    return "<div class=\"molecule\" data-smiles=\""+smiles+"\" data-signature=\""+signature+"\" data-toggled=\"false\">"+svg+"</div>";
 }
 
 function unselectMolecule($this) {
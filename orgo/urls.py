@@ -3,16 +3,20 @@ import json
 import random
 
 from engine.renderSVG import render as smilesToSvg
+from engine.renderSVG import renderMolecule as moleculeToSvg
 from engine.reaction_functions import *
+from engine.toCanonical import open_store, use_backend
 from engine.toMolecule import moleculify
 from engine.toSmiles import smilesify
-from engine.toCanonical import to_canonical
 
+from django.conf import settings
 from django.conf.urls import patterns, include, url
 from django.contrib import admin
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
+from django.core.signing import Signer
 from django.http import HttpResponse
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
 
 urlpatterns = patterns('',
     # Examples:
@@ -28,6 +32,11 @@ urlpatterns = patterns('',
 
 urlpatterns += staticfiles_urlpatterns()
 
+if settings.CANONICAL_BACKEND:
+    use_backend(settings.CANONICAL_BACKEND)
+if settings.CANONICAL_STORE:
+    open_store(settings.CANONICAL_STORE)
+
 
 
 ## API
@@ -51,15 +60,19 @@ def synthesis_problem(request, random_seed):
 
 ## API
 ## Inputs:  - Reaction identifier
-##          - Signed? SMILES representations of each input molecule
-## Outputs: - Signed? SMILES representation of the result
+##          - SMILES representations of each input molecule, each with the
+##            signature it came with (or '' if it came without one)
+## Outputs: - SMILES representation of the result, and its signature
 def run_reaction(request):
     answer = request.GET.get('answer', None)
     input_smileses = request.GET.getlist('input_smileses[]', [])
+    input_signatures = request.GET.getlist('input_signatures[]', [])
     reaction_name = request.GET.get('reaction', MIX)
 
     if type(input_smileses) is not list:
         input_smileses = [input_smileses]
+    ## Inputs we wrote ourselves are canonical already: no OpenBabel needed.
+    trusted = all_signed(input_smileses, input_signatures)
 
     if reaction_name == MIX:        
         if len(input_smileses) <= 1:
@@ -71,12 +84,14 @@ def run_reaction(request):
         return HttpResponse(json.dumps({
             "reactionHappened": True,
             "smiles": output_smiles,
+            "signature": sign_smiles(output_smiles) if trusted else "",
             "svg": smilesToSvg(output_smiles),
             "isAnswer": check_solution(answer, output_smiles)
         }))
 
     else:
-        input_molecule = moleculify(input_smileses)
+        input_molecule = moleculify(input_smileses, implicitHydrogens=True,
+                                    canonical=trusted)
         reaction_function = NAMES_TO_REACTIONS[reaction_name]
         output_molecule = reaction_function(input_molecule)
         if output_molecule == None:
@@ -84,19 +99,29 @@ def run_reaction(request):
                 "reactionHappened": False,
             }))
         if type(output_molecule) is list:
-            output_smiles = [smilesify(m, canonical=True) for m in output_molecule]
-            output_smiles = sorted(list(set(output_smiles)))
+            ## One molecule per distinct product, drawn without going
+            ## through SMILES again.
+            unique = dict((smilesify(m, canonical=True), m)
+                          for m in output_molecule)
+            output_smiles = sorted(unique)
+            output_molecules = [unique[s] for s in output_smiles]
         else:
             output_smiles = [output_molecule]
-        if is_nr(output_smiles, input_smileses):
+            output_molecules = None
+        if is_nr(output_smiles, input_smileses, trusted):
             return HttpResponse(json.dumps({
                 "reactionHappened": False,
             }))
         output_smiles = '.'.join(output_smiles)
+        if output_molecules is not None:
+            output_svg = moleculeToSvg(output_molecules)
+        else:
+            output_svg = smilesToSvg(output_smiles)
         return HttpResponse(json.dumps({
             "reactionHappened": True,
             "smiles": output_smiles,
-            "svg": smilesToSvg(output_smiles),
+            "signature": sign_smiles(output_smiles),
+            "svg": output_svg,
             "isAnswer": check_solution(answer, output_smiles)
         }))
 
@@ -115,9 +140,36 @@ def render_molecule(request):
 def hexhash(string):
     return hashlib.sha224(string).hexdigest()
 
-def is_nr(output_smiles, input_smiles = []):
+## Signs SMILES strings the server wrote with smilesify(..., canonical=True),
+## so that when the browser sends them back, run_reaction can parse them as
+## they are instead of canonicalizing them first. Keyed on SECRET_KEY.
+SMILES_SIGNER = Signer(salt='orgo.urls.canonical_smiles')
+
+def sign_smiles(smiles):
+    return SMILES_SIGNER.signature(smiles)
+
+def all_signed(smileses, signatures):
+    ## Return True if every one of smileses comes with its own signature.
+    if len(smileses) != len(signatures):
+        return False
+    for smiles, signature in zip(smileses, signatures):
+        if not constant_time_compare(sign_smiles(smiles), signature):
+            return False
+    return True
+
+def canonical_smiles(smiles, trusted=False):
+    ## Canonical SMILES, as smilesify writes it.
+    ## trusted: smiles was written by smilesify already (see all_signed).
+    ## smilesify aromatizes Kekule rings itself, so the answer doesn't
+    ## depend on whether OpenBabel or our own parser read smiles (see
+    ## test_toMolecule.TestPaths).
+    return smilesify(moleculify(smiles, canonical=trusted))
+
+def is_nr(output_smiles, input_smiles = [], trusted=False):
     ## Return True if we don't need to add another molecule box for this.
     ## Not to be used for the "mixing" reaction.
+    ## output_smiles come straight from smilesify, so are canonical already.
+    ## trusted: so are input_smiles (see all_signed).
     if type(output_smiles) is not list:
         output_smiles = [output_smiles]
     if type(input_smiles) is not list:
@@ -127,8 +179,8 @@ def is_nr(output_smiles, input_smiles = []):
         print "WAS no reaction."
         return True
     
-    input_smiles = sorted(list(set([to_canonical(s) for s in input_smiles])))
-    output_smiles = sorted(list(set([to_canonical(s) for s in output_smiles])))
+    input_smiles = sorted(list(set([canonical_smiles(s, trusted) for s in input_smiles])))
+    output_smiles = sorted(list(set(output_smiles)))
 
     if input_smiles == output_smiles:
         return True
@@ -145,8 +197,11 @@ def check_solution(answer, newest):
     """
     if answer is None or newest is None:
         return False
+    elif answer == newest:
+        ## Both written by smilesify; no need to parse them.
+        return True
     else:
-        return to_canonical(answer) == to_canonical(newest)
+        return canonical_smiles(answer) == canonical_smiles(newest)
 
 
 
@@ -175,13 +230,13 @@ class SynthesisProblem(object):
             random.seed(random_seed)
             self.starting_smiles = [random.choice(ALKENES)]
             reaction = random.choice(NAMES_TO_REACTIONS.values())
-            self.target_smiles = smilesify(reaction(moleculify(self.starting_smiles)))
+            self.target_smiles = smilesify(reaction(moleculify(self.starting_smiles, implicitHydrogens=True)))
             count = 0
             while is_nr(self.target_smiles, self.starting_smiles):
                 if count > 100:
                     raise StandardError("Could not gen problem. Try again.")
                 reaction = random.choice(NAMES_TO_REACTIONS.values())
-                self.target_smiles = smilesify(reaction(moleculify(self.starting_smiles)))
+                self.target_smiles = smilesify(reaction(moleculify(self.starting_smiles, implicitHydrogens=True)))
                 count += 1
         else:
             self.starting_smiles = ['CCC=CCC']